@@ -15,6 +15,12 @@ _TIMEOUT_MS_FOR_GENERAL: Final = 10 * 1000
 
 _REGEXP_FOR_ACTION_NAME: Final = re.compile(r"^[I\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FFF]+$")
 
+_PATH_FOR_POLLING_STATS: Final = Path(__file__).with_name("polling_stats.json") # history of waits (see `MyPollingStat`)
+
+_IS_TIMING_RECORDED: Final = False # print a summary of sleeps, waits, captures and inputs at exit (see `MyTimingRecorder`)
+
+_IS_LATENCY_PROFILED: Final = False # print latencies from a key press to reaction of screen at exit (see `MyLatencyProfiler`)
+
 #=============================================================================
 # Exception
 
@@ -61,7 +67,7 @@ class Status:
 
     def __init__(self):
         self._flags = dict()
-        screenshot = Screenshot()
+        screenshot = get_shared_screenshot() # share a frame with the frame watcher
         check_window_title(screenshot.window_info)
         for label, table in _TABLE_OF_PIXEL_COLOR.items():
             value = None # default value when no match
@@ -91,10 +97,19 @@ class Status:
     def is_in_input_mode(self) -> bool:
         return not self._flags['is_visible_ime_icon']
 
+def on_status_change(func: Callable[[], Any]) -> Callable[[], Any]:
+    """
+    Declare that `func` depends on `Status` (pixels in the table and active window).
+    Waits evaluate `func` again only when one of them is changed.
+    """
+    offsets = my_unique(offset for table in _TABLE_OF_PIXEL_COLOR.values() for offset, _, _ in table)
+    signals = [get_region_signal(MyRect(top=offset.y, right=offset.x + 1, bottom=offset.y + 1, left=offset.x)) for offset in offsets]
+    return my_depends_on(*signals, get_foreground_window_signal())(func)
+
 #=============================================================================
 # Proces a recipe
 
-def g_issue_command(text: str) -> Generator[None]:
+def g_issue_command(text: str) -> Generator[MyWaitRequest | None]:
     print(f"issue_command: {text!r}")
     assert text
     assert text.startswith('/')
@@ -104,24 +119,29 @@ def g_issue_command(text: str) -> Generator[None]:
     assert status.is_in_craft_mode()
     assert not status.is_in_input_mode()
     copy_to_clipboard(text)
-    key_press(NormalKey.Slash)
-    yield from g_with_timeout_until(_TIMEOUT_MS_FOR_GENERAL, lambda: Status().is_in_input_mode())
+    if (profiler := get_latency_profiler()) is not None:
+        offset = _TABLE_OF_PIXEL_COLOR['is_visible_ime_icon'][0][0]
+        rect = MyRect(top=offset.y, right=offset.x + 1, bottom=offset.y + 1, left=offset.x)
+        yield from profiler.g_measure("open chat input", g_key_press(NormalKey.Slash), [rect])
+    else:
+        key_press(NormalKey.Slash)
+    yield from g_with_timeout_until(_TIMEOUT_MS_FOR_GENERAL, on_status_change(lambda: Status().is_in_input_mode()))
     yield from g_sleep_a_moment()
     key_press(NormalKey.V, MyModifier.CTRL)
     yield from g_sleep_a_moment()
     key_press(NormalKey.Enter)
-    yield from g_with_timeout_until(_TIMEOUT_MS_FOR_GENERAL, lambda: Status().is_busy())
-    yield from g_with_timeout_while(_TIMEOUT_MS_FOR_GENERAL, lambda: Status().is_in_input_mode())
+    yield from g_with_timeout_until(_TIMEOUT_MS_FOR_GENERAL, on_status_change(lambda: Status().is_busy()))
+    yield from g_with_timeout_while(_TIMEOUT_MS_FOR_GENERAL, on_status_change(lambda: Status().is_in_input_mode()))
     copy_to_clipboard(f"{my_random()}") # overwrite clipboard by random text
 
-def g_process_a_recipe(recipe: list[str]) -> Generator[None]:
+def g_process_a_recipe(recipe: list[str]) -> Generator[MyWaitRequest | None]:
     print(f"process a recipe ({len(recipe)} steps)")
     yield from g_sleep_with_random(1000, variation_ratio=0.0)
     key_press(NormalKey.NUM_0)
     yield from g_sleep_to_ensure()
     key_press(NormalKey.NUM_0)
     yield from g_sleep_to_ensure()
-    yield from g_with_timeout_until(_TIMEOUT_MS_FOR_GENERAL, lambda: (status := Status()).is_in_craft_mode() and not status.is_busy())
+    yield from g_with_timeout_until(_TIMEOUT_MS_FOR_GENERAL, on_status_change(lambda: (status := Status()).is_in_craft_mode() and not status.is_busy()))
     yield from g_sleep_to_ensure()
     assert not Status().is_in_input_mode()
     for skill_name in recipe:
@@ -138,9 +158,9 @@ def g_process_a_recipe(recipe: list[str]) -> Generator[None]:
                     raise MyRecipeEarlyFinishError(skill_name)
         command = f"/ac {skill_name}"
         yield from g_issue_command(command)
-        yield from g_with_timeout_while(_TIMEOUT_MS_FOR_GENERAL, lambda: (status := Status()).is_busy() and status.is_in_craft_mode())
+        yield from g_with_timeout_while(_TIMEOUT_MS_FOR_GENERAL, on_status_change(lambda: (status := Status()).is_busy() and status.is_in_craft_mode()))
         yield from g_sleep_a_moment()
-    g_with_timeout_while(_TIMEOUT_MS_FOR_GENERAL, lambda: Status().is_in_craft_mode())
+    yield from g_with_timeout_while(_TIMEOUT_MS_FOR_GENERAL, on_status_change(lambda: Status().is_in_craft_mode()))
     yield from g_sleep_to_ensure()
     assert Status().is_busy() # because keep sitting
     print("finish a recipe")
@@ -166,7 +186,7 @@ def parse_recipe_file(generator_for_lines: Iterable[str]) -> list[str]:
             yield line
     return [text for text in generator()] # make a real list to validate all lines in input
 
-def g_process_a_recipe_file(path: Path, num_of_loop: int) -> Generator[None]:
+def g_process_a_recipe_file(path: Path, num_of_loop: int) -> Generator[MyWaitRequest | None]:
     print(f"start processing a recipe file \"{path}\" at {my_get_str_timestamp()}")
     assert num_of_loop > 0
     assert path.suffix == '.MAC'
@@ -192,42 +212,28 @@ def g_process_a_recipe_file(path: Path, num_of_loop: int) -> Generator[None]:
 
     print(f"finish processing a recipe file \"{path}\" at {my_get_str_timestamp()}")
 
-#=============================================================================
-# Executor
-
-def run(generator: Generator[None], callback_for_each_yield: Callable[[], Any]):
-    for _ in generator:
-        callback_for_each_yield()
-
 #=============================================================================
 # Main
 
-def crate_callback_func():
-    key_for_abort = MyModifier.LSHIFT
-    is_key_pressed_since_previous_call = setup_keyboard_listener()
-    is_key_pressed_since_previous_call(key_for_abort) # call once in advance to clear status
-
-    hwnd = 0
-
-    def callback_func():
-        nonlocal hwnd
-        if is_key_pressed_since_previous_call(key_for_abort):
-            print("Aborted by SHIFT key")
-            sys.exit(3)
-        window_info = get_active_window_info()
-        if hwnd == 0 and window_info.title == _EXPECTED_WINDOW_TITLE:
-            hwnd = window_info.hwnd
-        elif hwnd != 0 and window_info.hwnd != hwnd:
-            print("Aborted because the active window was changed")
-            sys.exit(4)
+def start_watchdog() -> MyWatchdog:
+    # abort by SHIFT key or change of the active window (see `MyWatchdog`)
+    watchdog = MyWatchdog(abort_keys=MyModifier.LSHIFT, window_title=_EXPECTED_WINDOW_TITLE)
+    watchdog.start()
+    return watchdog
 
-    return callback_func
+def start_hotkeys() -> MyHotkeyEngine:
+    # pause by Ctrl+Alt+F11 and resume by Ctrl+Alt+F12 (matched in the listener thread, see `MyHotkeyEngine`)
+    engine = get_hotkey_engine()
+    engine.bind("pause", (MyModifier.LCTRL | MyModifier.LALT, NormalKey.F11), action=my_request_pause)
+    engine.bind("resume", (MyModifier.LCTRL | MyModifier.LALT, NormalKey.F12), action=my_request_resume)
+    engine.start()
+    return engine
 
 def usage(_args: Iterable[str]) -> NoReturn:
     print(f"Usage: python -m {__package__} macro-file num-of-loop")
     sys.exit(1)
 
-def g_main() -> Generator[None]:
+def g_main() -> Generator[MyWaitRequest | None]:
     print(f"start ff14_craft at {my_get_str_timestamp()}")
 
     args = sys.argv
@@ -283,12 +289,25 @@ def g_main() -> Generator[None]:
     show_dialog(f"PyKMmacro: finish at {my_get_str_timestamp()}")
 
 def main():
-    callback_for_each_yield = crate_callback_func()
+    if _IS_TIMING_RECORDED:
+        enable_timing_recorder()
+    if _IS_LATENCY_PROFILED:
+        enable_latency_profiler()
+    if _PATH_FOR_POLLING_STATS.exists():
+        load_polling_stats(_PATH_FOR_POLLING_STATS)
+    start_watchdog()
+    start_hotkeys()
     try:
-        run(g_main(), callback_for_each_yield)
+        run_macro(g_main())
+    except MyAbortedByKeyError:
+        sys.exit(3)
+    except MyAbortedByWindowChangeError:
+        sys.exit(4)
     except Exception as ex:
         # show diaglog to change FF14 window from foreground to background
         show_dialog(f"ERROR: {ex!r}")
         raise ex
+    finally:
+        save_polling_stats(_PATH_FOR_POLLING_STATS)
 
 main()
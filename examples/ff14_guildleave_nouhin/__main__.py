@@ -1,5 +1,5 @@
 import sys
-from typing import Any, Callable, Final, Generator, Iterable, NoReturn
+from typing import Final, Generator, Iterable, NoReturn
 
 from pykmmacro import *
 
@@ -66,36 +66,22 @@ class Status:
     def is_already_completed(self) -> bool:
         return self._flags['is_green_check_displayed']
 
-#=============================================================================
-# Executor
-
-def run(generator: Generator[None], callback_for_each_yield: Callable[[], Any]):
-    for _ in generator:
-        callback_for_each_yield()
-
 #=============================================================================
 # Main
 
-def crate_callback_func():
-    key_for_abort = MyModifier.LSHIFT
-    is_key_pressed_since_previous_call = setup_keyboard_listener()
-    is_key_pressed_since_previous_call(key_for_abort) # call once in advance to clear status
+def start_watchdog() -> MyWatchdog:
+    # abort by SHIFT key or change of the active window (see `MyWatchdog`)
+    watchdog = MyWatchdog(abort_keys=MyModifier.LSHIFT, window_title=_EXPECTED_WINDOW_TITLE)
+    watchdog.start()
+    return watchdog
 
-    hwnd = 0
-
-    def callback_func():
-        nonlocal hwnd
-        if is_key_pressed_since_previous_call(key_for_abort):
-            print("Aborted by SHIFT key")
-            sys.exit(3)
-        window_info = get_active_window_info()
-        if hwnd == 0 and window_info.title == _EXPECTED_WINDOW_TITLE:
-            hwnd = window_info.hwnd
-        elif hwnd != 0 and window_info.hwnd != hwnd:
-            print("Aborted because the active window was changed")
-            sys.exit(4)
-
-    return callback_func
+def start_hotkeys() -> MyHotkeyEngine:
+    # pause by Ctrl+Alt+F11 and resume by Ctrl+Alt+F12 (matched in the listener thread, see `MyHotkeyEngine`)
+    engine = get_hotkey_engine()
+    engine.bind("pause", (MyModifier.LCTRL | MyModifier.LALT, NormalKey.F11), action=my_request_pause)
+    engine.bind("resume", (MyModifier.LCTRL | MyModifier.LALT, NormalKey.F12), action=my_request_resume)
+    engine.start()
+    return engine
 
 def usage(_args: Iterable[str]) -> NoReturn:
     print(f"Usage: python -m {__package__} num-of-loop")
@@ -106,7 +92,7 @@ def get_package_basename():
     _, _, basename = __package__.rpartition('.')
     return basename
 
-def g_main() -> Generator[None]:
+def g_main() -> Generator[MyWaitRequest | None]:
     print(f"{get_package_basename()}: start at {my_get_str_timestamp()}")
 
     args: Final = sys.argv
@@ -164,7 +150,7 @@ def g_main() -> Generator[None]:
         print(f"start nouhin: {i+1} / {num_of_loop}")
 
         print(f"click 1st NPC: {offset1=!r}")
-        mouse_move_to(offset1)
+        yield from g_mouse_glide_to(offset1)
         yield from g_sleep_a_moment()
         mouse_click()
         yield from g_sleep_to_ensure()
@@ -213,7 +199,7 @@ def g_main() -> Generator[None]:
         yield from g_sleep_to_ensure()
 
         print(f"click 2st NPC: {offset2=!r}")
-        mouse_move_to(offset2)
+        yield from g_mouse_glide_to(offset2)
         yield from g_sleep_a_moment()
         mouse_click()
 
@@ -238,7 +224,13 @@ def g_main() -> Generator[None]:
     show_dialog(f"{get_package_basename()}: completed at {my_get_str_timestamp()}")
 
 def main():
-    callback_for_each_yield = crate_callback_func()
-    run(g_main(), callback_for_each_yield)
+    start_watchdog()
+    start_hotkeys()
+    try:
+        run_macro(g_main())
+    except MyAbortedByKeyError:
+        sys.exit(3)
+    except MyAbortedByWindowChangeError:
+        sys.exit(4)
 
 main()
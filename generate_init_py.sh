@@ -23,7 +23,8 @@ while read -r FILENAME; do
     test -s "$TARGET"
 
     cat "$TARGET" |
-    grep -E '^(def|class) ' |
+    grep -E '^(async def|def|class) ' |
+    perl -pe 's/^async //' |
     awk '{print $2}' |
     perl -pe 's/^([a-zA-Z0-9_]+).+$/$1/' |
     grep -v -E '^_' |
@@ -1,10 +1,28 @@
 # type: ignore
+from .asyncmacro import a_key_press, a_mouse_click, a_run_macro, a_screenshot, a_sleep, a_sleep_a_moment, a_sleep_to_ensure, a_sleep_until_ns, a_sleep_with_random, a_with_timeout, a_with_timeout_until, a_with_timeout_while
+from .clickhistory import MyClick, MyClickHistory
 from .clipboard import copy_to_clipboard
-from .keyboardinput import AllKey, key_press, NormalKey, with_modifier_keys
-from .keyboardstat import setup_keyboard_listener
+from .eventhub import get_event_hub, get_virtual_key_code, MyDeviceEventKind, MyDeviceEventRing, MyEventCursor, MyEventHub, MyPressWatcher
+from .eventlog import MyEventLogWriter, read_event_log
+from .hotkey import get_hotkey_engine, MyHotkeyEngine, MyHotkeyMatch
+from .humanize import get_humanize_rng, MyHumanizeRng, set_humanize_seed
+from .inputdispatch import g_send_input_sequence, get_input_dispatcher, get_key_event, get_mouse_event, get_mouse_move_event, get_unicode_events, InputDispatcher, MyCompiledInputSequence, MyInputEvent, MyInputEventKind, MyInputSequence, MyRecordingInputDispatcher, NullInputDispatcher, send_input_sequence, set_input_dispatcher, Win32InputDispatcher
+from .keyboardinput import AllKey, g_key_press, g_with_modifier_keys, key_press, NormalKey, with_modifier_keys
+from .keyboardstat import get_keyboard_signal, setup_keyboard_listener
+from .latencystat import enable_latency_profiler, get_latency_profiler, MyLatencyProfiler, MyLatencyStat
+from .macrocache import g_run_macro_file, load_macro_code
+from .macroinclude import get_macro_include_resolver, MyMacroIncludeCycleError, MyMacroIncludeResolver, MyMacroProject
+from .macroparser import iter_macro_statements, MyMacroBinaryOp, MyMacroCall, MyMacroCommand, MyMacroDim, MyMacroEnd, MyMacroExpression, MyMacroFor, MyMacroFunctionCall, MyMacroGoto, MyMacroIf, MyMacroInclude, MyMacroLabel, MyMacroLiteral, MyMacroNode, MyMacroProgram, MyMacroReturn, MyMacroSet, MyMacroStatement, MyMacroSyntaxError, MyMacroToken, MyMacroTokenKind, MyMacroUnaryOp, MyMacroVariable, MySourceLocation, parse_macro_file, parse_macro_text, read_macro_lines, tokenize_macro_line
+from .macrovm import compile_macro, g_run_macro_code, MyMacroCode, MyMacroRuntimeError
 from .modifier import MyModifier
-from .mouseinput import mouse_click, mouse_move_relative, mouse_move_to, MouseButton
-from .mousestat import get_mouse_position, setup_mouse_listener
-from .screenshot import Color, Screenshot
-from .utils import g_sleep, g_sleep_a_moment, g_sleep_to_ensure, g_sleep_with_random, g_with_timeout, g_with_timeout_until, g_with_timeout_while, my_assert_eq, my_fail_always, my_get_str_timestamp, my_get_timestamp_ms, my_random, my_sleep_a_moment, my_sleep_ms, my_sleep_with_random, my_unique, MyError, MyFailAlwaysError, MyOffsetInRect, MyPosition, MyRect, MyTimeoutError
-from .windowsapi import activate_window, get_active_window_info, get_screen_info, MyMonitorInfo, MyPaddingInfo, MyScreenInfo, MyWindowInfo, OffsetInScreen, OffsetInWindow, PositionInScreen, show_dialog, TimeoutForWindowSwitch
+from .mouseinput import g_mouse_click, g_mouse_glide_to, mouse_click, mouse_glide_to, mouse_move_relative, mouse_move_to, MouseButton
+from .mousestat import get_mouse_position, get_mouse_signal, setup_mouse_listener
+from .pollingstat import get_all_polling_stats, get_polling_stat, load_polling_stats, MyPollingStat, save_polling_stats
+from .screenshot import Color, get_frame_signal, get_frame_watcher, get_region_signal, get_shared_screenshot, MyFrameWatcher, MyScreenshotCache, Screenshot
+from .textinput import g_type_text, is_typable_by_keys, type_text
+from .timingstat import disable_timing_recorder, enable_timing_recorder, get_timing_recorder, MyHistogram, MyTimingRecorder, MyTimingStat
+from .trajectory import get_mouse_trajectory
+from .utils import g_sleep, g_sleep_a_moment, g_sleep_to_ensure, g_sleep_with_random, g_wait_for, g_with_input_lock, g_with_timeout, g_with_timeout_until, g_with_timeout_while, get_clock, get_input_lock, my_assert_eq, my_depends_on, my_fail_always, my_get_current_task, my_get_monotonic_ns, my_get_str_timestamp, my_get_timestamp_ms, my_is_abort_requested, my_is_pause_requested, my_random, my_request_abort, my_request_pause, my_request_resume, my_sleep_a_moment, my_sleep_ms, my_sleep_with_random, my_unique, MyAbortError, MyClock, MyError, MyFailAlwaysError, MyInputLock, MyMacroTask, MyOffsetInRect, MyPosition, MyRealClock, MyRect, MyScheduler, MySchedulingPolicy, MySignal, MyTimeoutError, MyVirtualClock, MyWaitRequest, run_macro, set_clock
+from .watchdog import MyAbortedByKeyError, MyAbortedByWindowChangeError, MyWatchdog
+from .windowindex import find_window, get_window_index, MyWindowEntry, MyWindowIndex, Win32WindowEnumerator, WindowEnumerator
+from .windowsapi import activate_window, get_active_window_info, get_foreground_window_signal, get_screen_info, MyMonitorInfo, MyPaddingInfo, MyScreenInfo, MyWindowInfo, OffsetInScreen, OffsetInWindow, PositionInScreen, show_dialog, TimeoutForWindowSwitch
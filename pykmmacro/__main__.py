@@ -1,3 +1,4 @@
+import statistics
 import time
 
 from . import *
@@ -25,6 +26,59 @@ def main():
         print("finish")
         return
 
+    if False:
+        print("measure accuracy of g_sleep()")
+        def g_measure(results: list[float]):
+            for period_ms in (3, 17, 75, 120, 333):
+                for _ in range(10):
+                    start_ns = my_get_monotonic_ns()
+                    yield from g_sleep(period_ms)
+                    results.append((my_get_monotonic_ns() - start_ns) / (1000 * 1000) - period_ms)
+        def run_by_for_loop(generator):
+            for _ in generator:
+                pass
+        for label, driver in (("for-loop (tick by tick)", run_by_for_loop), ("run_macro", run_macro)):
+            lateness: list[float] = []
+            driver(g_measure(lateness))
+            print(f"{label}: lateness mean={statistics.mean(lateness):.3f}ms max={max(lateness):.3f}ms stdev={statistics.stdev(lateness):.3f}ms")
+        return
+
+    if False:
+        print("measure throughput of my_random()")
+        import random
+        def old_my_random() -> float:
+            acc = 0.0
+            for _ in range(100):
+                acc += random.random()
+            return acc / 100
+        num_of_draws = 100 * 1000
+        for label, func in (("average of 100 uniforms", old_my_random), ("MyHumanizeRng", my_random)):
+            start_ns = my_get_monotonic_ns()
+            for _ in range(num_of_draws):
+                func()
+            print(f"{label}: {(my_get_monotonic_ns() - start_ns) / num_of_draws / 1000:.3f}us/draw")
+        return
+
+    if False:
+        print("measure throughput of input paths (recording backend with virtual clock)")
+        import contextlib
+        import io
+        set_clock(MyVirtualClock())
+        recorder = MyRecordingInputDispatcher()
+        set_input_dispatcher(recorder)
+        num_of_calls = 10 * 1000
+        for label, func in (("key_press", lambda: key_press(NormalKey.Enter, MyModifier.LCTRL)),
+                            ("with_modifier_keys", lambda: with_modifier_keys(lambda: key_press(NormalKey.Enter), MyModifier.LSHIFT | MyModifier.LALT)),
+                            ("mouse_click", lambda: mouse_click(MouseButton.LEFT, MyModifier.LCTRL))):
+            recorder.clear()
+            start_ns = time.perf_counter_ns()
+            with contextlib.redirect_stdout(io.StringIO()): # suppress logs of each call
+                for _ in range(num_of_calls):
+                    func()
+            elapsed_ns = time.perf_counter_ns() - start_ns
+            print(f"{label}: {elapsed_ns / num_of_calls / 1000:.3f}us/call {len(recorder) * 1e9 / elapsed_ns:.0f}events/s ({len(recorder)} events in {recorder.num_of_batches} batches)")
+        return
+
     print("sleep 3 sec")
     time.sleep(3)
 
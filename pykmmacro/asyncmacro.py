@@ -0,0 +1,159 @@
+import asyncio
+from typing import Any, Callable, Final, Generator
+
+from .keyboardinput import g_key_press, NormalKey
+from .modifier import MyModifier
+from .mouseinput import g_mouse_click, MouseButton
+from .screenshot import Screenshot
+from .utils import *
+from .utils import _DELAY_MS_FOR_A_MOMENT, _DELAY_MS_FOR_A_TICK, _DELAY_MS_FOR_ENSURE, _NS_PER_MS, _get_dependencies, _get_period_ms_with_random, _take_abort_error
+
+# asyncio counterparts of `g_*` helpers.
+# A coroutine whose name starts with `a_` can be awaited in an asyncio event loop
+# without blocking other tasks (such as subprocess, socket and file I/O).
+
+#=============================================================================
+# Shared variables
+
+# serialize input of coroutines to avoid interleaving keystrokes of chords
+_lock_for_input: Final = asyncio.Lock()
+
+#=============================================================================
+# Time
+
+async def a_sleep_until_ns(deadline_ns: int) -> None:
+    """
+    Sleep until the deadline on monotonic clock (see `my_get_monotonic_ns()`).
+    """
+    if not isinstance(clock := get_clock(), MyRealClock):
+        clock.sleep_until_ns(deadline_ns) # advance simulated time instantly
+        await asyncio.sleep(0) # give a chance to other tasks
+        return
+    while (remaining_ns := deadline_ns - my_get_monotonic_ns()) > 0:
+        await asyncio.sleep(remaining_ns / 1e9)
+
+async def a_sleep_with_random(period_ms: int, /, *, variation_ratio: float = 0.4) -> None:
+    period = _get_period_ms_with_random(period_ms, variation_ratio)
+    await a_sleep_until_ns(my_get_monotonic_ns() + int(period * _NS_PER_MS))
+
+async def a_sleep(period_ms: int) -> None:
+    await a_sleep_with_random(period_ms, variation_ratio=0.0)
+
+async def a_sleep_a_moment() -> None:
+    await a_sleep_with_random(_DELAY_MS_FOR_A_MOMENT, variation_ratio=0.2)
+
+async def a_sleep_to_ensure() -> None:
+    await a_sleep_with_random(_DELAY_MS_FOR_ENSURE, variation_ratio=0.2)
+
+async def a_with_timeout(timeout_ms: int, func: Callable[Any, Any], *args, **kwargs) -> Any: # type: ignore
+    # NOTE: `func` should not be a coroutine function.
+    assert timeout_ms > 0
+    dependencies = _get_dependencies(func)
+    limit = my_get_monotonic_ns() + timeout_ms * _NS_PER_MS
+    while True:
+        # call `func()` before timeout judgement
+        timestamp = my_get_monotonic_ns() # capture this timing (before calling `func`)
+        request = MyWaitRequest.on_signals(dependencies, deadline_ns=limit) if dependencies else None # capture versions before calling `func`
+        ret = func(*args, **kwargs)
+        if ret is not None:
+            return ret
+        if timestamp > limit:
+            raise MyTimeoutError(f"{timeout_ms=} / {func.__name__}()")
+        if request is not None:
+            await _a_wait_for_request(request)
+        else:
+            await a_sleep(_DELAY_MS_FOR_A_TICK)
+
+async def a_with_timeout_until(timeout_ms: int, func: Callable[Any, Any], *args, **kwargs) -> Any: # type: ignore
+    return await a_with_timeout(timeout_ms, my_depends_on(*_get_dependencies(func))(lambda: func(*args, **kwargs) or None))
+
+async def a_with_timeout_while(timeout_ms: int, func: Callable[Any, Any], *args, **kwargs) -> Any: # type: ignore
+    return await a_with_timeout_until(timeout_ms, my_depends_on(*_get_dependencies(func))(lambda: not func(*args, **kwargs)))
+
+#=============================================================================
+# Input and capture
+
+async def a_key_press(key: NormalKey | None, modifiers: MyModifier = MyModifier.NONE, /) -> None:
+    """
+    Press key with modifier keys (see `g_key_press()`).
+    The event loop is not blocked while waiting between key events.
+    """
+    async with _lock_for_input:
+        await a_run_macro(g_key_press(key, modifiers))
+
+async def a_mouse_click(button: MouseButton = MouseButton.LEFT, modifiers: MyModifier = MyModifier.NONE, /) -> None:
+    """
+    Press mouse button (see `g_mouse_click()`).
+    The event loop is not blocked while waiting between mouse events.
+    """
+    async with _lock_for_input:
+        await a_run_macro(g_mouse_click(button, modifiers))
+
+async def a_screenshot(*, all_screens: bool = False) -> Screenshot:
+    """
+    Take a screenshot in another thread (see `Screenshot`).
+    """
+    return await asyncio.to_thread(Screenshot, all_screens=all_screens)
+
+#=============================================================================
+# Adapter for generator-based macro
+
+async def a_run_macro(generator: Generator[MyWaitRequest | None, Any, Any]) -> Any:
+    """
+    Run a macro generator (such as `g_sleep()`) in an asyncio event loop, and return its return value.
+    Each `MyWaitRequest` yielded by the generator is awaited without blocking the event loop.
+    If abort is requested (see `my_request_abort()`), `MyAbortError` is thrown into the generator.
+    """
+    try:
+        request = next(generator)
+        while True:
+            if request is None:
+                await asyncio.sleep(0) # give a chance to other tasks
+            else:
+                await _a_wait_for_request(request)
+            if my_is_abort_requested():
+                request = generator.throw(_take_abort_error())
+            else:
+                request = next(generator)
+    except StopIteration as ex:
+        return ex.value
+    finally:
+        generator.close()
+
+async def _a_wait_for_request(request: MyWaitRequest) -> None:
+    tick_ns = _DELAY_MS_FOR_A_TICK * _NS_PER_MS
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    def callback():
+        loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+    for signal in request.signals:
+        signal.num_of_waiters += 1
+        signal.subscribe(callback)
+    try:
+        while True:
+            now_ns = my_get_monotonic_ns()
+            if request.is_satisfied(now_ns):
+                return
+            deadline_ns = now_ns + tick_ns
+            if request.deadline_ns is not None and not request.is_polled():
+                deadline_ns = request.deadline_ns # no need to wake up every tick
+            elif request.deadline_ns is not None:
+                deadline_ns = min(deadline_ns, request.deadline_ns)
+            timeout = (deadline_ns - now_ns) / 1e9
+            if request.event is not None:
+                # wait for the event in another thread to wake up immediately when it is set
+                await asyncio.to_thread(get_clock().wait_event, request.event, deadline_ns - now_ns)
+            elif request.signals and not isinstance(get_clock(), MyRealClock):
+                if not future.done():
+                    await a_sleep_until_ns(deadline_ns) # advance simulated time instead of waiting for a signal
+            elif request.signals:
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), timeout if request.is_polled() or request.deadline_ns is not None else None)
+                except TimeoutError:
+                    pass
+            else:
+                await a_sleep_until_ns(deadline_ns)
+    finally:
+        for signal in request.signals:
+            signal.unsubscribe(callback)
+            signal.num_of_waiters -= 1
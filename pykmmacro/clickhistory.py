@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+from dataclasses import dataclass
+import sys
+from typing import Final
+
+from .eventhub import *
+from .eventhub import _MARGIN_FOR_OVERWRITE
+from .mouseinput import MouseButton
+from .utils import *
+from .utils import _NS_PER_MS
+from .windowsapi import PositionInScreen
+
+#=============================================================================
+# Click history
+
+@dataclass(frozen=True, slots=True)
+class MyClick:
+    timestamp_ns: int # value of `my_get_monotonic_ns()`
+    button: int # virtual-key code (see `get_virtual_key_code()`)
+    position: PositionInScreen
+
+def _get_range_of_time(ring: MyDeviceEventRing, since_ns: int | None, until_ns: int | None) -> range:
+    # sequence numbers of events in [since_ns, until_ns) by binary search (timestamps are sorted in a ring)
+    end = ring.count # capture the value at this timing
+    seqs = range(max(0, end - ring.capacity + _MARGIN_FOR_OVERWRITE), end)
+    def key(seq: int) -> int:
+        return ring.timestamps_ns[seq & ring.mask]
+    begin_index = 0 if since_ns is None else bisect_left(seqs, since_ns, key=key)
+    end_index = len(seqs) if until_ns is None else bisect_left(seqs, until_ns, key=key)
+    return seqs[begin_index:end_index]
+
+class MyClickHistory:
+    """
+    Time-window queries of clicks (release of a mouse button) and moves recorded by the event hub.
+    Nothing is copied in the listener thread, so the history is bounded by the capacity of the ring buffers (see `MyEventHub`).
+    `rect` of queries is in screen coordinates (same as `PositionInScreen`).
+    """
+
+    def __init__(self, hub: MyEventHub | None = None, /, *, is_move_recorded: bool = False):
+        if hub is None:
+            hub = get_event_hub()
+        self._ring: Final = hub.start_mouse()
+        self._ring_for_move: Final = hub.mouse_move
+        if is_move_recorded:
+            hub.is_mouse_move_recorded = True
+
+    def _is_matched(self, index: int, button: int | None, rect: MyRect | None) -> bool:
+        ring = self._ring
+        if ring.kinds[index] != MyDeviceEventKind.RELEASE:
+            return False
+        if button is not None and ring.codes[index] != button:
+            return False
+        if rect is not None and not rect.includes(MyPosition(ring.xs[index], ring.ys[index])):
+            return False
+        return True
+
+    def _to_click(self, index: int) -> MyClick:
+        ring = self._ring
+        return MyClick(ring.timestamps_ns[index], ring.codes[index], PositionInScreen(ring.xs[index], ring.ys[index]))
+
+    def get_clicks(self, *, since_ns: int | None = None, until_ns: int | None = None,
+                   button: MouseButton | int | None = MouseButton.LEFT, rect: MyRect | None = None) -> list[MyClick]:
+        """
+        Return clicks in [since_ns, until_ns) in chronological order.
+        If `button` is None, clicks of any button are returned.
+        """
+        vk = None if button is None else get_virtual_key_code(button)
+        mask = self._ring.mask
+        return [self._to_click(seq & mask) for seq in _get_range_of_time(self._ring, since_ns, until_ns) if self._is_matched(seq & mask, vk, rect)]
+
+    def get_clicks_in_last(self, period_ms: int, /, *, button: MouseButton | int | None = MouseButton.LEFT, rect: MyRect | None = None) -> list[MyClick]:
+        """Return clicks in the last `period_ms` (such as "clicks in the last 2 sec")."""
+        return self.get_clicks(since_ns=my_get_monotonic_ns() - period_ms * _NS_PER_MS, button=button, rect=rect)
+
+    def get_first_click_after(self, timestamp_ns: int, /, *, button: MouseButton | int | None = MouseButton.LEFT, rect: MyRect | None = None) -> MyClick | None:
+        vk = None if button is None else get_virtual_key_code(button)
+        mask = self._ring.mask
+        for seq in _get_range_of_time(self._ring, timestamp_ns, None):
+            if self._is_matched(seq & mask, vk, rect):
+                return self._to_click(seq & mask)
+        return None
+
+    def get_moves(self, *, since_ns: int | None = None, until_ns: int | None = None) -> list[tuple[int, PositionInScreen]]:
+        """Return (timestamp_ns, position) of moves (only while moves are recorded)."""
+        ring = self._ring_for_move
+        mask = ring.mask
+        return [(ring.timestamps_ns[seq & mask], PositionInScreen(ring.xs[seq & mask], ring.ys[seq & mask])) for seq in _get_range_of_time(ring, since_ns, until_ns)]
+
+#=============================================================================
+# Test
+
+def _test_click_history():
+    import time
+    hub = MyEventHub(capacity=64)
+    history = MyClickHistory(hub)
+    left = get_virtual_key_code(MouseButton.LEFT)
+    right = get_virtual_key_code(MouseButton.RIGHT)
+    for i in range(100): # older events are overwritten
+        vk = right if i % 10 == 9 else left
+        hub._on_press(hub.mouse, vk, i, i)
+        hub._on_release(hub.mouse, vk, i, i)
+        time.sleep(0.001)
+    clicks = history.get_clicks()
+    assert all(click.button == left for click in clicks)
+    assert 20 <= len(clicks) <= 32, len(clicks)
+    my_assert_eq(clicks[-1].position, PositionInScreen(98, 98))
+    my_assert_eq(history.get_clicks(button=right)[-1].position, PositionInScreen(99, 99))
+    middle = clicks[len(clicks) // 2]
+    my_assert_eq(history.get_first_click_after(middle.timestamp_ns), middle)
+    my_assert_eq(history.get_clicks(since_ns=middle.timestamp_ns, until_ns=middle.timestamp_ns + 1), [middle])
+    my_assert_eq([click.position.x for click in history.get_clicks(rect=MyRect(top=0, right=96, bottom=96, left=90))], [90, 91, 92, 93, 94, 95])
+    assert len(history.get_clicks_in_last(1000 * 1000)) == len(clicks)
+    assert not history.get_clicks_in_last(0)
+    print(f"OK: {_test_click_history.__name__}()")
+    sys.exit(1)
+
+if False:
+    _test_click_history()
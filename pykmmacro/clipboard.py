@@ -1,8 +1,7 @@
-import pyperclip
-
 def copy_to_clipboard(text: str):
     """
     Copy text into clipboard.
     """
+    import pyperclip # imported lazily (not needed until the first copy)
     assert text
     pyperclip.copy(text)
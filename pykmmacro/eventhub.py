@@ -0,0 +1,387 @@
+from __future__ import annotations
+
+from array import array
+import enum
+import sys
+import threading
+from typing import TYPE_CHECKING, Final
+
+from .keyboardinput import AllKey, NormalKey
+from .modifier import MyModifier
+from .utils import *
+
+if TYPE_CHECKING:
+    from pynput import keyboard, mouse
+
+    from .mouseinput import MouseButton
+
+#=============================================================================
+# Virtual-key code
+# https://learn.microsoft.com/en-us/windows/win32/inputdev/virtual-key-codes
+
+_NUM_OF_VIRTUAL_KEYS: Final[int] = 256
+
+_VK_TABLE_FOR_MODIFIER: Final[dict[MyModifier, int]] = {
+    MyModifier.LSHIFT: 0xA0,
+    MyModifier.LCTRL: 0xA2,
+    MyModifier.LALT: 0xA4,
+    MyModifier.LWIN: 0x5B,
+
+    MyModifier.RSHIFT: 0xA1,
+    MyModifier.RCTRL: 0xA3,
+    MyModifier.RALT: 0xA5,
+    MyModifier.RWIN: 0x5C,
+}
+
+_VK_TABLE_FOR_MOUSE_BUTTON: Final[dict[str, int]] = {
+    # name of `pynput.mouse.Button` (same as `MouseButton.code`)
+    'left': 0x01,
+    'right': 0x02,
+    'middle': 0x04,
+    'x1': 0x05,
+    'x2': 0x06,
+}
+
+def _create_vk_table_for_normal_key() -> dict[NormalKey, int]:
+    table: dict[NormalKey, int] = {
+        NormalKey.CapsLock: 0x14,
+        NormalKey.NumLock: 0x90,
+        NormalKey.ESC: 0x1B,
+        NormalKey.PrintScreen: 0x2C,
+        NormalKey.ScrollLock: 0x91,
+        NormalKey.Pause: 0x13,
+        NormalKey.Backspace: 0x08,
+        NormalKey.Insert: 0x2D,
+        NormalKey.Home: 0x24,
+        NormalKey.PageUp: 0x21,
+        NormalKey.PageDown: 0x22,
+        NormalKey.TAB: 0x09,
+        NormalKey.Delete: 0x2E,
+        NormalKey.End: 0x23,
+        NormalKey.Enter: 0x0D,
+        NormalKey.Space: 0x20,
+        NormalKey.Application: 0x5D,
+        NormalKey.Up: 0x26,
+        NormalKey.Left: 0x25,
+        NormalKey.Down: 0x28,
+        NormalKey.Right: 0x27,
+
+        # special keys for Japanese keyboard
+        NormalKey.Zenkaku: 0xF3, # VK_OEM_AUTO (0xF4 while Zenkaku mode)
+        NormalKey.Henkan: 0x1C,
+        NormalKey.Muhenkan: 0x1D,
+        NormalKey.Hiragana: 0xF2,
+
+        # symbols for Japanese keyboard
+        NormalKey.Hyphen: 0xBD,
+        NormalKey.Hat: 0xDE,
+        NormalKey.YenSign: 0xDC,
+        NormalKey.Atmark: 0xC0,
+        NormalKey.LeftSquareBracket: 0xDB,
+        NormalKey.RightSquareBracket: 0xDD,
+        NormalKey.Colon: 0xBA,
+        NormalKey.Semicolon: 0xBB,
+        NormalKey.Comma: 0xBC,
+        NormalKey.Period: 0xBE,
+        NormalKey.Slash: 0xBF,
+        NormalKey.BackSlash: 0xE2,
+
+        # numpad (ten-key)
+        NormalKey.NUM_Multiply: 0x6A,
+        NormalKey.NUM_Plus: 0x6B,
+        NormalKey.NUM_Minus: 0x6D,
+        NormalKey.NUM_Devide: 0x6F,
+        NormalKey.NUM_Period: 0x6E,
+        NormalKey.NUM_Enter: 0x0D, # same as Enter key (distinguished only by extended flag)
+    }
+    for i in range(10):
+        table[NormalKey[f"NUM_{i}"]] = 0x60 + i
+    for i in range(1, 13):
+        table[NormalKey[f"F{i}"]] = 0x70 + i - 1
+    for key in NormalKey:
+        keycode = key.keycode
+        if isinstance(keycode, str) and len(keycode) == 1 and keycode.isalnum():
+            table[key] = ord(keycode.upper()) # same as ASCII code
+    return table
+
+_VK_TABLE_FOR_NORMAL_KEY: Final[dict[NormalKey, int]] = _create_vk_table_for_normal_key()
+
+def _validate_vk_tables():
+    for modifier in MyModifier: # not include aliases (such as "SHIFT")
+        assert modifier in _VK_TABLE_FOR_MODIFIER
+    for key in NormalKey:
+        assert key in _VK_TABLE_FOR_NORMAL_KEY, key
+
+if True:
+    _validate_vk_tables()
+
+def get_virtual_key_code(key: AllKey | MyModifier | MouseButton | int) -> int:
+    """
+    Return the virtual-key code of a key or a mouse button (an integer is returned as is).
+    """
+    if isinstance(key, int) and not isinstance(key, enum.Enum):
+        assert 0 < key and key < _NUM_OF_VIRTUAL_KEYS, key
+        return key
+    if isinstance(key, MyModifier):
+        return _VK_TABLE_FOR_MODIFIER[key]
+    if isinstance(key, NormalKey):
+        return _VK_TABLE_FOR_NORMAL_KEY[key]
+    if isinstance(key, AllKey): # modifier key
+        return _VK_TABLE_FOR_MODIFIER[MyModifier[key.keyname]]
+    return _VK_TABLE_FOR_MOUSE_BUTTON[key.code]
+
+#=============================================================================
+# Ring buffer of device events
+
+# the oldest events may be overwritten by the listener thread while they are read
+_MARGIN_FOR_OVERWRITE: Final[int] = 16
+
+class MyDeviceEventKind(enum.IntEnum):
+    PRESS = enum.auto()
+    RELEASE = enum.auto()
+    SCROLL = enum.auto() # `x` and `y` are amount of scroll (instead of position)
+    MOVE = enum.auto()
+
+class MyDeviceEventRing:
+    """
+    Preallocated ring buffer of timestamped events of a device (keyboard or mouse).
+    Only one thread (the listener thread of the device) writes events, and any thread can read them without lock.
+    Readers use `MyEventCursor` to read new events, and an old event is overwritten when the buffer is full.
+    `code` is a virtual-key code (see `get_virtual_key_code()`).
+    `device_id` identifies the ring in a binary event log (see `MyEventLogWriter`).
+    """
+
+    def __init__(self, name: str, device_id: int, /, *, capacity: int = 4096):
+        assert capacity > _MARGIN_FOR_OVERWRITE and (capacity & (capacity - 1)) == 0 # power of 2
+        self.name: Final = name
+        self.device_id: Final = device_id
+        self.capacity: Final = capacity
+        self.mask: Final = capacity - 1
+        self.timestamps_ns: Final = array('q', bytes(8 * capacity))
+        self.kinds: Final = array('B', bytes(capacity))
+        self.codes: Final = array('B', bytes(capacity))
+        self.xs: Final = array('i', bytes(4 * capacity))
+        self.ys: Final = array('i', bytes(4 * capacity))
+        self.count = 0 # the number of written events (the sequence number of the next event)
+        self.signal: Final = MySignal(name)
+
+    def append(self, kind: MyDeviceEventKind, code: int, x: int = 0, y: int = 0, /, *, is_fired: bool = True) -> None:
+        index = self.count & self.mask
+        self.timestamps_ns[index] = my_get_monotonic_ns()
+        self.kinds[index] = kind
+        self.codes[index] = code
+        self.xs[index] = x
+        self.ys[index] = y
+        self.count += 1 # publish after all fields are written
+        if is_fired:
+            self.signal.fire()
+
+    def create_cursor(self) -> MyEventCursor:
+        """Create a cursor which reads events written after now."""
+        return MyEventCursor(self)
+
+    def is_overwritten(self, seq: int) -> bool:
+        """Return whether the event of `seq` is overwritten (check after reading its fields)."""
+        return seq <= self.count - self.capacity
+
+class MyEventCursor:
+    """
+    Read position of a consumer in `MyDeviceEventRing`.
+    `get_new_range()` returns sequence numbers of new events, and the fields of an event are read by index (`seq & ring.mask`).
+    Events overwritten before read are counted in `num_of_lost_events`
+    (the oldest events are counted too, because they may be overwritten while they are read).
+    """
+
+    def __init__(self, ring: MyDeviceEventRing):
+        self.ring: Final = ring
+        self.position = ring.count
+        self.num_of_lost_events = 0
+
+    def get_new_range(self) -> range:
+        end = self.ring.count # capture the value at this timing
+        begin = max(self.position, end - self.ring.capacity + _MARGIN_FOR_OVERWRITE)
+        self.num_of_lost_events += begin - self.position
+        self.position = end
+        return range(begin, end)
+
+    def get_latest(self, kind: MyDeviceEventKind, code: int) -> int | None:
+        """
+        Consume new events, and return the sequence number of the latest event of `kind` and `code` (or None).
+        Read its fields by index (`seq & ring.mask`), then check `ring.is_overwritten(seq)`.
+        """
+        ring = self.ring
+        latest: int | None = None
+        for seq in self.get_new_range():
+            index = seq & ring.mask
+            if ring.kinds[index] == kind and ring.codes[index] == code:
+                latest = seq
+        return latest
+
+#=============================================================================
+# Event hub
+
+# truncate bits because Integer type has unlimited precision
+_BITMASK_FOR_TRUNCATE: Final[int] = 0xffffffff
+
+class MyEventHub:
+    """
+    Receive all keyboard/mouse events by one listener thread per device (started at the first use of the device).
+    Events are written into ring buffers (`keyboard` and `mouse`),
+    and the state of each key/button is kept in arrays indexed by virtual-key code.
+    Moves of mouse are written into `mouse_move` only while `is_mouse_move_recorded` is True
+    (they do not fire the signal, and do not push out clicks in `mouse`).
+    Injected events (such as input sent by macros) are ignored, so they are not mistaken for the user's input (such as abort keys).
+    """
+
+    def __init__(self, *, capacity: int = 4096):
+        self.keyboard: Final = MyDeviceEventRing("keyboard", 0, capacity=capacity)
+        self.mouse: Final = MyDeviceEventRing("mouse", 1, capacity=capacity)
+        self.mouse_move: Final = MyDeviceEventRing("mouse move", 2, capacity=capacity)
+        self.is_mouse_move_recorded = False
+        self.held: Final = array('B', bytes(_NUM_OF_VIRTUAL_KEYS))
+        self.press_counts: Final = array('I', bytes(4 * _NUM_OF_VIRTUAL_KEYS))
+        self._lock = threading.Lock()
+        self._keyboard_listener: keyboard.Listener | None = None
+        self._mouse_listener: mouse.Listener | None = None
+
+    def _on_press(self, ring: MyDeviceEventRing, vk: int, x: int = 0, y: int = 0) -> None:
+        if not self.held[vk]: # ignore auto-repeat
+            self.press_counts[vk] = (self.press_counts[vk] + 1) & _BITMASK_FOR_TRUNCATE
+        self.held[vk] = 1
+        ring.append(MyDeviceEventKind.PRESS, vk, x, y)
+
+    def _on_release(self, ring: MyDeviceEventRing, vk: int, x: int = 0, y: int = 0) -> None:
+        self.held[vk] = 0
+        ring.append(MyDeviceEventKind.RELEASE, vk, x, y)
+
+    def start_keyboard(self) -> MyDeviceEventRing:
+        with self._lock:
+            if self._keyboard_listener is None:
+                from pynput import keyboard # imported lazily (not needed until the first listener is started)
+                def get_vk(key: keyboard.Key | keyboard.KeyCode | None) -> int | None:
+                    if isinstance(key, keyboard.Key):
+                        key = key.value
+                    vk = getattr(key, 'vk', None)
+                    return vk if vk is not None and 0 < vk < _NUM_OF_VIRTUAL_KEYS else None
+                def on_press(key: keyboard.Key | keyboard.KeyCode | None, injected: bool = False) -> None: # `injected` is passed by pynput 1.8 or later
+                    if not injected and (vk := get_vk(key)) is not None:
+                        self._on_press(self.keyboard, vk)
+                def on_release(key: keyboard.Key | keyboard.KeyCode | None, injected: bool = False) -> None:
+                    if not injected and (vk := get_vk(key)) is not None:
+                        self._on_release(self.keyboard, vk)
+                self._keyboard_listener = keyboard.Listener(on_press=on_press, on_release=on_release)
+                self._keyboard_listener.start() # start new listener theread
+        return self.keyboard
+
+    def start_mouse(self) -> MyDeviceEventRing:
+        with self._lock:
+            if self._mouse_listener is None:
+                from pynput import mouse
+                def on_click(x: int, y: int, button: mouse.Button, pressed: bool, injected: bool = False) -> None:
+                    vk = _VK_TABLE_FOR_MOUSE_BUTTON.get(button.name)
+                    if vk is None or injected:
+                        return
+                    if pressed:
+                        self._on_press(self.mouse, vk, x, y)
+                    else:
+                        self._on_release(self.mouse, vk, x, y)
+                def on_scroll(_x: int, _y: int, dx: int, dy: int, injected: bool = False) -> None:
+                    if not injected:
+                        self.mouse.append(MyDeviceEventKind.SCROLL, 0, dx, dy)
+                def on_move(x: int, y: int, injected: bool = False) -> None:
+                    if self.is_mouse_move_recorded and not injected:
+                        self.mouse_move.append(MyDeviceEventKind.MOVE, 0, x, y, is_fired=False)
+                self._mouse_listener = mouse.Listener(on_click=on_click, on_scroll=on_scroll, on_move=on_move)
+                self._mouse_listener.start() # start new listener theread
+        return self.mouse
+
+    def is_held(self, key: AllKey | MyModifier | MouseButton | int) -> bool:
+        """Return True if the key (or the button) is pressed now."""
+        return bool(self.held[get_virtual_key_code(key)])
+
+    def get_press_count(self, key: AllKey | MyModifier | MouseButton | int) -> int:
+        """Return the number of presses (auto-repeat is not counted) modulo 2**32."""
+        return self.press_counts[get_virtual_key_code(key)]
+
+    def create_press_watcher(self) -> MyPressWatcher:
+        return MyPressWatcher(self)
+
+class MyPressWatcher:
+    """
+    Tell whether a key (or a button) is pressed since the previous call for the key.
+    A watcher has its own snapshot of press counts, so consumers do not affect each other.
+    """
+
+    def __init__(self, hub: MyEventHub):
+        self.hub: Final = hub
+        self._counts: Final = array('I', hub.press_counts) # snapshot
+
+    def is_pressed_since_previous_call(self, key: AllKey | MyModifier | MouseButton | int) -> bool:
+        vk = get_virtual_key_code(key)
+        count = self.hub.press_counts[vk] # capture the value at this timing
+        is_updated = count != self._counts[vk]
+        if is_updated:
+            self._counts[vk] = count
+        return is_updated
+
+_shared_event_hub: MyEventHub | None = None
+
+def get_event_hub() -> MyEventHub:
+    """
+    Return the event hub shared in this process.
+    """
+    global _shared_event_hub
+    if _shared_event_hub is None:
+        _shared_event_hub = MyEventHub()
+    return _shared_event_hub
+
+#=============================================================================
+# Test
+
+def _test_event_hub():
+    import time
+    hub = MyEventHub(capacity=32)
+    watcher = hub.create_press_watcher()
+    cursor = hub.keyboard.create_cursor()
+    shift = get_virtual_key_code(MyModifier.LSHIFT)
+    assert get_virtual_key_code(NormalKey.A) == 0x41
+    assert get_virtual_key_code(NormalKey.F12) == 0x7B
+    assert not watcher.is_pressed_since_previous_call(MyModifier.LSHIFT)
+    hub._on_press(hub.keyboard, shift)
+    hub._on_press(hub.keyboard, shift) # auto-repeat
+    assert hub.is_held(MyModifier.LSHIFT)
+    assert hub.get_press_count(MyModifier.LSHIFT) == 1
+    hub._on_release(hub.keyboard, shift)
+    assert not hub.is_held(MyModifier.LSHIFT)
+    assert watcher.is_pressed_since_previous_call(MyModifier.LSHIFT)
+    assert not watcher.is_pressed_since_previous_call(MyModifier.LSHIFT)
+    my_assert_eq([hub.keyboard.kinds[seq & hub.keyboard.mask] for seq in cursor.get_new_range()], [MyDeviceEventKind.PRESS, MyDeviceEventKind.PRESS, MyDeviceEventKind.RELEASE])
+    assert not cursor.get_new_range()
+    for _ in range(40):
+        hub._on_press(hub.keyboard, 0x41)
+    my_assert_eq(len(cursor.get_new_range()), 32 - _MARGIN_FOR_OVERWRITE)
+    my_assert_eq(cursor.num_of_lost_events, 40 - (32 - _MARGIN_FOR_OVERWRITE))
+    hub._on_release(hub.keyboard, 0x41)
+    seq = cursor.get_latest(MyDeviceEventKind.RELEASE, 0x41)
+    assert seq is not None and not hub.keyboard.is_overwritten(seq)
+    for _ in range(32):
+        hub._on_press(hub.keyboard, 0x41)
+    assert hub.keyboard.is_overwritten(seq)
+    num_of_events = 100 * 1000
+    hub = MyEventHub()
+    cursor = hub.keyboard.create_cursor()
+    start_ns = time.perf_counter_ns()
+    for i in range(num_of_events):
+        if i & 1:
+            hub._on_release(hub.keyboard, 0x41)
+        else:
+            hub._on_press(hub.keyboard, 0x41)
+    print(f"cost of write: {(time.perf_counter_ns() - start_ns) / num_of_events / 1000:.3f}us/event")
+    start_ns = time.perf_counter_ns()
+    assert cursor.get_latest(MyDeviceEventKind.RELEASE, 0x41) is not None
+    print(f"cost of read: {(time.perf_counter_ns() - start_ns) / hub.keyboard.capacity / 1000:.3f}us/event")
+    print(f"OK: {_test_event_hub.__name__}()")
+    sys.exit(1)
+
+if False:
+    _test_event_hub()
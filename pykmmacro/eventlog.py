@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+from pathlib import Path
+import struct
+import sys
+import threading
+from typing import BinaryIO, Final, Iterable, Iterator
+
+from .eventhub import *
+from .utils import *
+
+#=============================================================================
+# Constant
+
+_MAGIC_FOR_EVENT_LOG: Final[bytes] = b"PKMEVT01"
+
+# timestamp_ns, device_id, kind, code, (padding), x, y
+_RECORD_FOR_EVENT_LOG: Final = struct.Struct('<qBBBxii')
+
+_SIZE_OF_WRITE_BUFFER: Final[int] = 64 * 1024
+
+#=============================================================================
+# Binary event log
+
+class MyEventLogWriter:
+    """
+    Append events of the event hub to a binary file of fixed-size records (see `read_event_log()`).
+    Events are read from the ring buffers by a background thread periodically,
+    so the listener threads do nothing extra for the log.
+    Events which are overwritten in a ring before being read are lost (increase `interval_ms` carefully).
+    """
+
+    def __init__(self, path: Path, rings: Iterable[MyDeviceEventRing] | None = None, /, *, interval_ms: int = 1000):
+        assert interval_ms > 0
+        if rings is None:
+            hub = get_event_hub()
+            rings = (hub.keyboard, hub.mouse, hub.mouse_move)
+        self.path: Final = path
+        self._cursors: Final = [ring.create_cursor() for ring in rings]
+        self._interval_s: Final = interval_ms / 1000
+        self._buffer = bytearray(_RECORD_FOR_EVENT_LOG.size * 256)
+        self._file: BinaryIO | None = None
+        self._stop_event: Final = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.num_of_records = 0
+
+    def start(self) -> None:
+        assert self._file is None
+        is_new = not self.path.exists() or self.path.stat().st_size == 0
+        self._file = open(self.path, 'ab', buffering=_SIZE_OF_WRITE_BUFFER)
+        if is_new:
+            self._file.write(_MAGIC_FOR_EVENT_LOG)
+        self._thread = threading.Thread(target=self._run, name="pykmmacro-event-log", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Write remaining events, and close the file."""
+        assert self._thread is not None and self._file is not None
+        self._stop_event.set()
+        self._thread.join()
+        self._flush()
+        self._file.close()
+        self._file = None
+
+    def _flush(self) -> None:
+        assert self._file is not None
+        record = _RECORD_FOR_EVENT_LOG
+        for cursor in self._cursors:
+            ring = cursor.ring
+            seqs = cursor.get_new_range()
+            if len(self._buffer) < record.size * len(seqs):
+                self._buffer = bytearray(record.size * len(seqs))
+            buffer = self._buffer
+            offset = 0
+            for seq in seqs:
+                index = seq & ring.mask
+                record.pack_into(buffer, offset, ring.timestamps_ns[index], ring.device_id, ring.kinds[index], ring.codes[index], ring.xs[index], ring.ys[index])
+                offset += record.size
+            self._file.write(memoryview(buffer)[:offset])
+            self.num_of_records += len(seqs)
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self._interval_s):
+            self._flush()
+
+def read_event_log(path: Path) -> Iterator[tuple[int, int, MyDeviceEventKind, int, int, int]]:
+    """
+    Generate (timestamp_ns, device_id, kind, code, x, y) of each record in a file written by `MyEventLogWriter`.
+    """
+    record = _RECORD_FOR_EVENT_LOG
+    with open(path, 'rb') as f:
+        if f.read(len(_MAGIC_FOR_EVENT_LOG)) != _MAGIC_FOR_EVENT_LOG:
+            raise MyError(f"not an event log: {path}")
+        while chunk := f.read(record.size * 4096):
+            size = len(chunk) - len(chunk) % record.size # ignore a broken record at the end (such as by crash)
+            for timestamp_ns, device_id, kind, code, x, y in record.iter_unpack(chunk[:size]):
+                yield timestamp_ns, device_id, MyDeviceEventKind(kind), code, x, y
+
+#=============================================================================
+# Test
+
+def _test_event_log():
+    import tempfile
+    import time
+    hub = MyEventHub()
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "events.bin"
+        writer = MyEventLogWriter(path, (hub.keyboard, hub.mouse), interval_ms=10)
+        writer.start()
+        num_of_events = 2 * 2000 # within the capacity of rings (not to lose events even if the writer thread is late)
+        start_ns = time.perf_counter_ns()
+        for i in range(num_of_events // 2):
+            hub._on_press(hub.mouse, 0x01, i, -i)
+            hub._on_release(hub.keyboard, 0x41)
+        print(f"cost of write in listener: {(time.perf_counter_ns() - start_ns) / num_of_events / 1000:.3f}us/event")
+        writer.stop()
+        records = list(read_event_log(path))
+        my_assert_eq(len(records), num_of_events)
+        my_assert_eq(path.stat().st_size, len(_MAGIC_FOR_EVENT_LOG) + num_of_events * _RECORD_FOR_EVENT_LOG.size)
+        mouse_records = [record for record in records if record[1] == hub.mouse.device_id]
+        my_assert_eq(mouse_records[-1][2:], (MyDeviceEventKind.PRESS, 0x01, num_of_events // 2 - 1, -(num_of_events // 2 - 1)))
+    print(f"OK: {_test_event_log.__name__}()")
+    sys.exit(1)
+
+if False:
+    _test_event_log()
@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+from array import array
+from collections import deque
+from dataclasses import dataclass
+import sys
+from typing import Any, Callable, Final
+
+from .eventhub import *
+from .eventhub import _NUM_OF_VIRTUAL_KEYS, _VK_TABLE_FOR_MODIFIER
+from .keyboardinput import AllKey
+from .modifier import MyModifier
+from .utils import *
+from .utils import _NS_PER_MS
+
+#=============================================================================
+# Constant
+
+_DEFAULT_TIMEOUT_MS_FOR_SEQUENCE: Final[int] = 500 # between strokes of a sequence (such as a double-tap)
+_MAX_NUM_OF_QUEUED_MATCHES: Final[int] = 256 # older matches are discarded if the macro thread does not read them
+
+def _create_modifier_table() -> array[int]:
+    # bit of `MyModifier` for each virtual-key code (0 for non-modifier keys)
+    table = array('B', bytes(_NUM_OF_VIRTUAL_KEYS))
+    for modifier, vk in _VK_TABLE_FOR_MODIFIER.items():
+        table[vk] = modifier.value
+    return table
+
+_MODIFIER_TABLE: Final[array[int]] = _create_modifier_table()
+
+#=============================================================================
+# Hotkey
+
+@dataclass(frozen=True, slots=True)
+class MyHotkeyMatch:
+    timestamp_ns: int # of the last stroke (value of `my_get_monotonic_ns()`)
+    name: str
+
+class _MyHotkeyNode:
+    # a node of the trie of strokes
+    __slots__ = ("children", "name", "action")
+
+    def __init__(self):
+        self.children: Final[dict[int, _MyHotkeyNode]] = dict()
+        self.name: str | None = None # not None only for a leaf (end of a binding)
+        self.action: Callable[[], Any] | None = None
+
+def _get_token(stroke: AllKey | MyModifier | int | tuple[MyModifier, AllKey | MyModifier | int]) -> int:
+    # a stroke is identified by the pressed key and the modifiers held at the time
+    modifiers, key = stroke if isinstance(stroke, tuple) else (MyModifier.NONE, stroke)
+    vk = get_virtual_key_code(key)
+    assert not (modifiers.value & _MODIFIER_TABLE[vk]), "the pressed key should not be included in the held modifiers"
+    return vk | (modifiers.value << 8)
+
+class MyHotkeyEngine:
+    """
+    Match hotkeys (chords, sequences and double-taps) against keyboard events in the listener thread.
+    A binding is a sequence of strokes, and a stroke is a key pressed while exactly the given modifiers are held,
+    such as `(MyModifier.LCTRL | MyModifier.LALT, NormalKey.F12)` (a key alone means no modifier is held).
+    A double-tap is the same stroke twice, and each stroke of a sequence should follow the previous one within `timeout_ms`.
+    Bindings are compiled into a trie, and each event costs one dict lookup.
+    On a match, `action` of the binding is called in the listener thread (it should be quick and thread-safe,
+    such as `my_request_pause()`), and the match is queued for macros (see `get_matches()` and `signal`).
+    """
+
+    def __init__(self, hub: MyEventHub | None = None, /, *, timeout_ms: int = _DEFAULT_TIMEOUT_MS_FOR_SEQUENCE):
+        assert timeout_ms > 0
+        self.hub: Final = get_event_hub() if hub is None else hub
+        self.timeout_ns: Final = timeout_ms * _NS_PER_MS
+        self.signal: Final = MySignal("hotkey") # fired for each match
+        self._root: Final = _MyHotkeyNode()
+        self._node = self._root # current state
+        self._deadline_ns = 0 # for the next stroke
+        self._modifiers = 0 # held modifiers (value of `MyModifier`)
+        self._held: Final = array('B', bytes(_NUM_OF_VIRTUAL_KEYS)) # to ignore auto-repeat
+        self._matches: Final[deque[MyHotkeyMatch]] = deque(maxlen=_MAX_NUM_OF_QUEUED_MATCHES)
+        self._cursor: MyEventCursor | None = None
+
+    def bind(self, name: str, *strokes: AllKey | MyModifier | int | tuple[MyModifier, AllKey | MyModifier | int],
+             action: Callable[[], Any] | None = None) -> None:
+        """
+        Add a binding (call before `start()`).
+        A binding can not be a prefix of another binding (it would hide the longer one).
+        """
+        assert strokes
+        node = self._root
+        for stroke in strokes:
+            if node.name is not None:
+                raise MyError(f"hotkey {name!r} is hidden by {node.name!r}")
+            node = node.children.setdefault(_get_token(stroke), _MyHotkeyNode())
+        if node.name is not None or node.children:
+            raise MyError(f"hotkey {name!r} conflicts with another binding")
+        node.name = name
+        node.action = action
+
+    def start(self) -> None:
+        assert self._cursor is None
+        ring = self.hub.start_keyboard()
+        for vk in range(_NUM_OF_VIRTUAL_KEYS): # modifiers held in advance
+            if self.hub.held[vk]:
+                self._held[vk] = 1
+                self._modifiers |= _MODIFIER_TABLE[vk]
+        self._cursor = ring.create_cursor()
+        ring.signal.subscribe(self._on_signal)
+
+    def stop(self) -> None:
+        assert self._cursor is not None
+        self._cursor.ring.signal.unsubscribe(self._on_signal)
+        self._cursor = None
+
+    def get_matches(self) -> list[MyHotkeyMatch]:
+        """Return matches since the previous call (in chronological order)."""
+        matches: list[MyHotkeyMatch] = []
+        while self._matches:
+            matches.append(self._matches.popleft())
+        return matches
+
+    def _on_signal(self) -> None:
+        # called in the listener thread
+        cursor = self._cursor
+        if cursor is None:
+            return
+        ring = cursor.ring
+        for seq in cursor.get_new_range():
+            index = seq & ring.mask
+            self._feed(ring.kinds[index], ring.codes[index], ring.timestamps_ns[index])
+
+    def _feed(self, kind: int, vk: int, timestamp_ns: int) -> None:
+        bit = _MODIFIER_TABLE[vk]
+        if kind == MyDeviceEventKind.RELEASE:
+            self._held[vk] = 0
+            self._modifiers &= ~bit
+            return
+        if kind != MyDeviceEventKind.PRESS or self._held[vk]:
+            return # auto-repeat
+        self._held[vk] = 1
+        token = vk | (self._modifiers << 8)
+        self._modifiers |= bit
+        root = self._root
+        node = self._node
+        if node is not root and timestamp_ns > self._deadline_ns:
+            node = root # timeout of a sequence
+        child = node.children.get(token)
+        if child is None and node is not root:
+            child = root.children.get(token) # may be the first stroke of another binding
+            if child is None and bit:
+                return # pressing a modifier between strokes keeps the state (such as Ctrl+K Ctrl+C)
+        if child is None:
+            self._node = root
+            return
+        if child.name is None:
+            self._node = child
+            self._deadline_ns = timestamp_ns + self.timeout_ns
+            return
+        self._node = root
+        self._matches.append(MyHotkeyMatch(timestamp_ns, child.name))
+        if child.action is not None:
+            child.action()
+        self.signal.fire()
+
+_shared_hotkey_engine: MyHotkeyEngine | None = None
+
+def get_hotkey_engine() -> MyHotkeyEngine:
+    """
+    Return the hotkey engine shared in this process (call `bind()` and `start()` to use).
+    """
+    global _shared_hotkey_engine
+    if _shared_hotkey_engine is None:
+        _shared_hotkey_engine = MyHotkeyEngine()
+    return _shared_hotkey_engine
+
+#=============================================================================
+# Test
+
+def _test_hotkey():
+    import time
+    from .keyboardinput import NormalKey
+    hub = MyEventHub()
+    engine = MyHotkeyEngine(hub, timeout_ms=100)
+    actions: list[str] = []
+    engine.bind("pause", (MyModifier.LCTRL | MyModifier.LALT, NormalKey.F12), action=lambda: actions.append("pause"))
+    engine.bind("skip", NormalKey.F9, NormalKey.F9)
+    engine.bind("abort", MyModifier.LSHIFT)
+    try:
+        engine.bind("conflict", NormalKey.F9)
+        assert False
+    except MyError:
+        pass
+    engine.start()
+    ctrl, alt, shift = (get_virtual_key_code(modifier) for modifier in (MyModifier.LCTRL, MyModifier.LALT, MyModifier.LSHIFT))
+    f9, f12 = get_virtual_key_code(NormalKey.F9), get_virtual_key_code(NormalKey.F12)
+    def tap(*vks: int):
+        for vk in vks:
+            hub._on_press(hub.keyboard, vk)
+        for vk in reversed(vks):
+            hub._on_release(hub.keyboard, vk)
+    tap(ctrl, alt, f12)
+    tap(alt, f12) # Ctrl is not held
+    tap(f9)
+    tap(ctrl, f9) # modifiers are not a part of "F9 F9"
+    tap(f9)
+    tap(f9)
+    time.sleep(0.15) # timeout
+    tap(f9)
+    tap(shift)
+    my_assert_eq([match.name for match in engine.get_matches()], ["pause", "skip", "abort"])
+    my_assert_eq(actions, ["pause"])
+    assert not engine.get_matches()
+    my_assert_eq(engine.signal.version, 3)
+    num_of_events = 100 * 1000
+    start_ns = time.perf_counter_ns()
+    for _ in range(num_of_events // 2):
+        tap(f9)
+    print(f"cost of matching: {(time.perf_counter_ns() - start_ns) / num_of_events / 1000:.3f}us/event (including the event hub)")
+    engine.stop()
+    print(f"OK: {_test_hotkey.__name__}()")
+    sys.exit(1)
+
+if False:
+    _test_hotkey()
@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import hashlib
+import math
+import random
+from statistics import NormalDist
+import sys
+from typing import Final
+
+#=============================================================================
+# Constant
+
+_SIZE_OF_BLOCK: Final[int] = 4096 # the number of samples generated at once
+
+# `my_random()` used the average of 100 uniform random values (Irwin-Hall distribution).
+# It is approximated well by a normal distribution with the same mean and variance.
+_NUM_OF_SAMPLES_FOR_APPROX_GAUSSIAN: Final[int] = 100
+_SIGMA_FOR_APPROX_GAUSSIAN: Final[float] = math.sqrt(1 / (12 * _NUM_OF_SAMPLES_FOR_APPROX_GAUSSIAN))
+
+_STANDARD_NORMAL: Final = NormalDist()
+
+#=============================================================================
+# Random number generator for humanization
+
+class MyHumanizeRng:
+    """
+    Random number generator for humanized timing and positions.
+    Samples are generated in blocks into a pool, so a draw is only an index increment and some arithmetic.
+    If `seed` is specified, all values can be replayed exactly (in the same order of draws).
+    Use `spawn()` to create an independent stream (such as per macro or per purpose).
+    """
+
+    def __init__(self, seed: int | str | None = None):
+        self.seed: Final = seed
+        self._random = random.Random(seed)
+        self._normal_pool: list[float] = []
+        self._normal_index = 0
+        self._uniform_pool: list[float] = []
+        self._uniform_index = 0
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(seed={self.seed!r})"
+
+    def spawn(self, name: str) -> MyHumanizeRng:
+        """
+        Create an independent stream derived from the seed of this generator and `name`.
+        """
+        if self.seed is None:
+            return MyHumanizeRng(self._random.getrandbits(64))
+        digest = hashlib.sha256(f"{self.seed!r}/{name}".encode()).digest()
+        return MyHumanizeRng(int.from_bytes(digest[:8], 'little'))
+
+    def _refill_normal(self) -> None:
+        self._normal_pool = _STANDARD_NORMAL.samples(_SIZE_OF_BLOCK, seed=self._random.getrandbits(64))
+        self._normal_index = 0
+
+    def _refill_uniform(self) -> None:
+        rnd = self._random.random
+        self._uniform_pool = [rnd() for _ in range(_SIZE_OF_BLOCK)]
+        self._uniform_index = 0
+
+    def standard_normal(self) -> float:
+        """Return a value of N(0, 1)."""
+        if self._normal_index >= len(self._normal_pool):
+            self._refill_normal()
+        value = self._normal_pool[self._normal_index]
+        self._normal_index += 1
+        return value
+
+    def uniform(self) -> float:
+        """Return a value in [0.0, 1.0)."""
+        if self._uniform_index >= len(self._uniform_pool):
+            self._refill_uniform()
+        value = self._uniform_pool[self._uniform_index]
+        self._uniform_index += 1
+        return value
+
+    def normal(self, mu: float, sigma: float) -> float:
+        assert sigma >= 0
+        return mu + sigma * self.standard_normal()
+
+    def truncated_normal(self, mu: float, sigma: float, low: float, high: float) -> float:
+        """
+        Return a value of normal distribution truncated to [low, high] (by inverse transform sampling).
+        """
+        assert low <= high
+        if sigma == 0:
+            return min(max(mu, low), high)
+        assert sigma > 0
+        dist = NormalDist(mu, sigma)
+        p_low = dist.cdf(low)
+        p_high = dist.cdf(high)
+        p = p_low + (p_high - p_low) * self.uniform()
+        if p <= 0.0 or p >= 1.0: # out of precision (the range is far from `mu`)
+            return min(max(mu, low), high)
+        return min(max(dist.inv_cdf(p), low), high)
+
+    def lognormal(self, mu: float, sigma: float) -> float:
+        """Return a value whose logarithm is N(mu, sigma)."""
+        return math.exp(self.normal(mu, sigma))
+
+    def approx_gaussian(self) -> float:
+        """
+        Return a value in [0.0, 1.0) with bell-shaped distribution (mean 0.5).
+        This is the same distribution family as the average of 100 uniform random values.
+        """
+        value = 0.5 + _SIGMA_FOR_APPROX_GAUSSIAN * self.standard_normal()
+        if value < 0.0 or value >= 1.0: # beyond 17 sigma (almost impossible)
+            return 0.5
+        return value
+
+#=============================================================================
+# Shared generator
+
+_shared_humanize_rng = MyHumanizeRng()
+
+def get_humanize_rng() -> MyHumanizeRng:
+    """
+    Return the generator shared in this process (used by `my_random()` and humanized sleeps).
+    """
+    return _shared_humanize_rng
+
+def set_humanize_seed(seed: int | str | None) -> MyHumanizeRng:
+    """
+    Replace the shared generator with new one initialized by `seed` (to replay timing of a whole macro).
+    """
+    global _shared_humanize_rng
+    _shared_humanize_rng = MyHumanizeRng(seed)
+    return _shared_humanize_rng
+
+#=============================================================================
+# Test
+
+def _test_humanize_rng():
+    a = MyHumanizeRng(1234)
+    b = MyHumanizeRng(1234)
+    values = [a.approx_gaussian() for _ in range(10000)]
+    assert values == [b.approx_gaussian() for _ in range(10000)] # replayable
+    assert all(0.0 <= value < 1.0 for value in values)
+    mean = sum(values) / len(values)
+    sigma = math.sqrt(sum((value - mean) ** 2 for value in values) / len(values))
+    print(f"approx_gaussian: {mean=:.4f} {sigma=:.4f} (expected 0.5 and {_SIGMA_FOR_APPROX_GAUSSIAN:.4f})")
+    assert abs(mean - 0.5) < 0.002
+    assert abs(sigma - _SIGMA_FOR_APPROX_GAUSSIAN) < 0.002
+    assert all(2.0 <= a.truncated_normal(0.0, 1.0, 2.0, 3.0) <= 3.0 for _ in range(1000))
+    assert all(a.lognormal(0.0, 0.5) > 0 for _ in range(1000))
+    assert a.spawn("x").uniform() == b.spawn("x").uniform()
+    assert a.spawn("x").uniform() != a.spawn("y").uniform()
+    print(f"OK: {_test_humanize_rng.__name__}()")
+    sys.exit(1)
+
+if False:
+    _test_humanize_rng()
@@ -0,0 +1,457 @@
+from __future__ import annotations
+
+from array import array
+import ctypes
+from ctypes import wintypes
+from dataclasses import dataclass
+import enum
+import sys
+from typing import Any, Final, Generator, Iterable, Sequence
+
+from . import timingstat as _timingstat
+from .utils import *
+from .utils import _NS_PER_MS, _deferring_pause, _get_period_ms_with_random, _run_blocking
+
+#=============================================================================
+# Input event
+
+class MyInputEventKind(enum.IntEnum):
+    KEY_DOWN = enum.auto()
+    KEY_UP = enum.auto()
+    MOUSE_DOWN = enum.auto()
+    MOUSE_UP = enum.auto()
+    MOUSE_MOVE = enum.auto() # relative
+    MOUSE_MOVE_TO = enum.auto() # absolute (position in screen)
+    UNICODE_DOWN = enum.auto() # a character independent of keyboard layout
+    UNICODE_UP = enum.auto()
+
+@dataclass(frozen=True, slots=True)
+class MyInputEvent:
+    """
+    Low-level input event sent by `InputDispatcher`.
+    `code` is a key name of pydirectinput (such as 'shiftleft' and 'up') or a DirectInput key code for keyboard,
+    a button name ('left', 'right' or 'middle') for mouse,
+    or a UTF-16 code unit (as a string of one character) for unicode.
+    `x` and `y` are used only for mouse move.
+    """
+
+    kind: MyInputEventKind
+    code: str | int = ''
+    x: int = 0
+    y: int = 0
+
+    @property
+    def is_press(self) -> bool:
+        return self.kind in (MyInputEventKind.KEY_DOWN, MyInputEventKind.MOUSE_DOWN, MyInputEventKind.UNICODE_DOWN)
+
+    @property
+    def is_release(self) -> bool:
+        return self.kind in (MyInputEventKind.KEY_UP, MyInputEventKind.MOUSE_UP, MyInputEventKind.UNICODE_UP)
+
+    def get_release_event(self) -> MyInputEvent:
+        match self.kind:
+            case MyInputEventKind.KEY_DOWN:
+                return MyInputEvent(MyInputEventKind.KEY_UP, self.code)
+            case MyInputEventKind.MOUSE_DOWN:
+                return MyInputEvent(MyInputEventKind.MOUSE_UP, self.code)
+            case MyInputEventKind.UNICODE_DOWN:
+                return MyInputEvent(MyInputEventKind.UNICODE_UP, self.code)
+            case _:
+                return self
+
+_cache_for_key_event: Final[dict[tuple[str | int, bool], MyInputEvent]] = dict()
+
+def get_key_event(keycode: str | int, is_down: bool) -> MyInputEvent:
+    """
+    Return the (shared) event for a key name of pydirectinput (such as 'shiftleft' and 'up')
+    or a DirectInput key code (for keys not in `pydirectinput.KEYBOARD_MAPPING`, such as 0x7D for Yen sign).
+    """
+    event = _cache_for_key_event.get((keycode, is_down))
+    if event is None:
+        event = MyInputEvent(MyInputEventKind.KEY_DOWN if is_down else MyInputEventKind.KEY_UP, keycode)
+        _cache_for_key_event[(keycode, is_down)] = event
+    return event
+
+def get_mouse_event(button_code: str, is_down: bool) -> MyInputEvent:
+    assert button_code in ('left', 'right', 'middle'), button_code
+    return MyInputEvent(MyInputEventKind.MOUSE_DOWN if is_down else MyInputEventKind.MOUSE_UP, button_code)
+
+def get_unicode_events(char: str, is_down: bool) -> list[MyInputEvent]:
+    """
+    Return events to input a character by its code (a character beyond BMP needs two events of surrogate pair).
+    """
+    assert len(char) == 1, char
+    kind = MyInputEventKind.UNICODE_DOWN if is_down else MyInputEventKind.UNICODE_UP
+    utf16 = char.encode('utf-16-le', 'surrogatepass')
+    return [MyInputEvent(kind, chr(int.from_bytes(utf16[i:i + 2], 'little'))) for i in range(0, len(utf16), 2)]
+
+def get_mouse_move_event(x: int, y: int, /, *, is_relative: bool = False) -> MyInputEvent:
+    return MyInputEvent(MyInputEventKind.MOUSE_MOVE if is_relative else MyInputEventKind.MOUSE_MOVE_TO, x=x, y=y)
+
+#=============================================================================
+# Input dispatcher
+
+class InputDispatcher:
+    """
+    Interface to send input events to OS (input backend).
+    Override this class to send input to somewhere else (for test).
+    """
+
+    def send(self, events: Sequence[MyInputEvent]) -> None:
+        """Send events at once (in the order)."""
+        raise NotImplementedError
+
+class NullInputDispatcher(InputDispatcher):
+    """
+    Discard all events.
+    """
+
+    def send(self, events: Sequence[MyInputEvent]) -> None:
+        pass
+
+class MyRecordingInputDispatcher(InputDispatcher):
+    """
+    Record all events with timestamps (value of `my_get_monotonic_ns()`) instead of sending them.
+    Events are stored in compact arrays (a few dozen bytes per event).
+    """
+
+    def __init__(self):
+        self.timestamps_ns: Final = array('q')
+        self.kinds: Final = array('B')
+        self.codes: Final = array('H') # index of `self._names_of_code`
+        self.xs: Final = array('i')
+        self.ys: Final = array('i')
+        self.num_of_batches = 0
+        self._names_of_code: Final[list[str | int]] = []
+        self._indexes_of_code: Final[dict[str | int, int]] = dict()
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def send(self, events: Sequence[MyInputEvent]) -> None:
+        timestamp_ns = my_get_monotonic_ns()
+        for event in events:
+            index = self._indexes_of_code.get(event.code)
+            if index is None:
+                index = len(self._names_of_code)
+                self._names_of_code.append(event.code)
+                self._indexes_of_code[event.code] = index
+            self.timestamps_ns.append(timestamp_ns)
+            self.kinds.append(event.kind)
+            self.codes.append(index)
+            self.xs.append(event.x)
+            self.ys.append(event.y)
+        self.num_of_batches += 1
+
+    def get_events(self) -> list[tuple[int, MyInputEvent]]:
+        """Return recorded events with timestamps."""
+        return [(timestamp_ns, MyInputEvent(MyInputEventKind(kind), self._names_of_code[code], x, y))
+                for timestamp_ns, kind, code, x, y in zip(self.timestamps_ns, self.kinds, self.codes, self.xs, self.ys)]
+
+    def clear(self) -> None:
+        for values in (self.timestamps_ns, self.kinds, self.codes, self.xs, self.ys):
+            del values[:]
+        self.num_of_batches = 0
+
+# https://learn.microsoft.com/en-us/windows/win32/api/winuser/ns-winuser-input
+_INPUT_MOUSE: Final[int] = 0
+_INPUT_KEYBOARD: Final[int] = 1
+_KEYEVENTF_EXTENDEDKEY: Final[int] = 0x0001
+_KEYEVENTF_KEYUP: Final[int] = 0x0002
+_KEYEVENTF_UNICODE: Final[int] = 0x0004
+_KEYEVENTF_SCANCODE: Final[int] = 0x0008
+_MOUSEEVENTF_MOVE: Final[int] = 0x0001
+_MOUSEEVENTF_ABSOLUTE: Final[int] = 0x8000
+_MOUSEEVENTF_FLAGS: Final[dict[tuple[str, bool], int]] = {
+    ('left', True): 0x0002,
+    ('left', False): 0x0004,
+    ('right', True): 0x0008,
+    ('right', False): 0x0010,
+    ('middle', True): 0x0020,
+    ('middle', False): 0x0040,
+}
+_SM_CXSCREEN: Final[int] = 0
+_SM_CYSCREEN: Final[int] = 1
+
+# DirectInput key codes (used by `pydirectinput.KEYBOARD_MAPPING`) include 0x80 for E0-prefixed (extended) keys
+_BIT_FOR_EXTENDED_KEY: Final[int] = 0x80
+
+class _KEYBDINPUT(ctypes.Structure):
+    _fields_ = [("wVk", wintypes.WORD), ("wScan", wintypes.WORD), ("dwFlags", wintypes.DWORD), ("time", wintypes.DWORD), ("dwExtraInfo", ctypes.c_size_t)]
+
+class _MOUSEINPUT(ctypes.Structure):
+    _fields_ = [("dx", wintypes.LONG), ("dy", wintypes.LONG), ("mouseData", wintypes.DWORD), ("dwFlags", wintypes.DWORD), ("time", wintypes.DWORD), ("dwExtraInfo", ctypes.c_size_t)]
+
+class _HARDWAREINPUT(ctypes.Structure):
+    _fields_ = [("uMsg", wintypes.DWORD), ("wParamL", wintypes.WORD), ("wParamH", wintypes.WORD)]
+
+class _INPUT_UNION(ctypes.Union):
+    _fields_ = [("ki", _KEYBDINPUT), ("mi", _MOUSEINPUT), ("hi", _HARDWAREINPUT)]
+
+class _INPUT(ctypes.Structure):
+    _fields_ = [("type", wintypes.DWORD), ("union", _INPUT_UNION)]
+
+class Win32InputDispatcher(InputDispatcher):
+    """
+    Send events by one `SendInput()` call for each batch (without `pydirectinput.PAUSE`).
+    Scan codes are taken from `pydirectinput.KEYBOARD_MAPPING` (imported at the first key event).
+    """
+
+    def __init__(self):
+        self._cache: Final[dict[MyInputEvent, _INPUT]] = dict()
+        self._keyboard_mapping: dict[str, int] | None = None
+
+    def _get_scan_code(self, keycode: str | int) -> tuple[int, bool]:
+        if isinstance(keycode, int):
+            code = keycode
+        else:
+            if self._keyboard_mapping is None:
+                import pydirectinput
+                self._keyboard_mapping = pydirectinput.KEYBOARD_MAPPING
+            assert keycode in self._keyboard_mapping, keycode
+            code = self._keyboard_mapping[keycode]
+        return code & ~_BIT_FOR_EXTENDED_KEY, bool(code & _BIT_FOR_EXTENDED_KEY)
+
+    def _to_input(self, event: MyInputEvent) -> _INPUT:
+        item = self._cache.get(event)
+        if item is not None:
+            return item
+        item = _INPUT()
+        match event.kind:
+            case MyInputEventKind.KEY_DOWN | MyInputEventKind.KEY_UP:
+                scan_code, is_extended = self._get_scan_code(event.code)
+                item.type = _INPUT_KEYBOARD
+                item.union.ki.wScan = scan_code
+                item.union.ki.dwFlags = (_KEYEVENTF_SCANCODE |
+                                         (_KEYEVENTF_EXTENDEDKEY if is_extended else 0) |
+                                         (_KEYEVENTF_KEYUP if event.kind == MyInputEventKind.KEY_UP else 0))
+            case MyInputEventKind.UNICODE_DOWN | MyInputEventKind.UNICODE_UP:
+                assert isinstance(event.code, str) and len(event.code) == 1, event.code
+                item.type = _INPUT_KEYBOARD
+                item.union.ki.wScan = ord(event.code)
+                item.union.ki.dwFlags = _KEYEVENTF_UNICODE | (_KEYEVENTF_KEYUP if event.kind == MyInputEventKind.UNICODE_UP else 0)
+            case MyInputEventKind.MOUSE_DOWN | MyInputEventKind.MOUSE_UP:
+                item.type = _INPUT_MOUSE
+                item.union.mi.dwFlags = _MOUSEEVENTF_FLAGS[(event.code, event.kind == MyInputEventKind.MOUSE_DOWN)]
+            case MyInputEventKind.MOUSE_MOVE | MyInputEventKind.MOUSE_MOVE_TO:
+                # same as `pydirectinput.moveTo()` (absolute coordinates normalized by the size of primary screen)
+                x, y = event.x, event.y
+                if event.kind == MyInputEventKind.MOUSE_MOVE:
+                    point = wintypes.POINT()
+                    ctypes.windll.user32.GetCursorPos(ctypes.byref(point)) # type: ignore
+                    x += point.x
+                    y += point.y
+                width = ctypes.windll.user32.GetSystemMetrics(_SM_CXSCREEN) # type: ignore
+                height = ctypes.windll.user32.GetSystemMetrics(_SM_CYSCREEN) # type: ignore
+                item.type = _INPUT_MOUSE
+                item.union.mi.dx = (x * 65536) // width + 1
+                item.union.mi.dy = (y * 65536) // height + 1
+                item.union.mi.dwFlags = _MOUSEEVENTF_MOVE | _MOUSEEVENTF_ABSOLUTE
+                return item # not cached (depends on the cursor position and the screen size)
+        self._cache[event] = item
+        return item
+
+    def send(self, events: Sequence[MyInputEvent]) -> None:
+        if not events:
+            return
+        array_of_input = (_INPUT * len(events))(*(self._to_input(event) for event in events))
+        # https://learn.microsoft.com/en-us/windows/win32/api/winuser/nf-winuser-sendinput
+        num_of_sent = ctypes.windll.user32.SendInput(len(events), array_of_input, ctypes.sizeof(_INPUT)) # type: ignore
+        if num_of_sent != len(events):
+            raise MyError(f"SendInput() failed: {num_of_sent}/{len(events)} events")
+
+_input_dispatcher: InputDispatcher | None = None
+
+def get_input_dispatcher() -> InputDispatcher:
+    """
+    Return the input dispatcher used in this process (`Win32InputDispatcher` by default).
+    """
+    global _input_dispatcher
+    if _input_dispatcher is None:
+        _input_dispatcher = Win32InputDispatcher()
+    return _input_dispatcher
+
+def set_input_dispatcher(dispatcher: InputDispatcher | None) -> InputDispatcher | None:
+    """
+    Replace the input dispatcher used in this process, and return the previous one.
+    If `dispatcher` is None, the default one is used.
+    """
+    global _input_dispatcher
+    previous = _input_dispatcher
+    _input_dispatcher = dispatcher
+    return previous
+
+#=============================================================================
+# Input sequence
+
+_MARGIN_NS_FOR_BATCH: Final[int] = _NS_PER_MS // 2 # events within this margin are sent together
+
+@dataclass(frozen=True, slots=True)
+class MyCompiledInputSequence:
+    """
+    Input events with target offsets (in nanoseconds from the start), sorted by offset.
+    `period_ns` is the whole period of the sequence (includes delay after the last event).
+    """
+
+    offsets_ns: tuple[int, ...]
+    events: tuple[MyInputEvent, ...]
+    period_ns: int
+
+    def __post_init__(self):
+        assert len(self.offsets_ns) == len(self.events)
+        assert all(a <= b for a, b in zip(self.offsets_ns, self.offsets_ns[1:]))
+        assert not self.offsets_ns or self.offsets_ns[-1] <= self.period_ns
+
+    def __len__(self):
+        return len(self.events)
+
+class MyInputSequence:
+    """
+    Builder of a sequence of key/mouse events (such as a chord).
+    Random delays are determined by `compile()`, so compile it again for each use.
+    """
+
+    def __init__(self):
+        self._items: list[MyInputEvent | tuple[int, float]] = [] # event or (period_ms, variation_ratio)
+
+    def key_down(self, keycode: str | int) -> MyInputSequence:
+        self._items.append(get_key_event(keycode, True))
+        return self
+
+    def key_up(self, keycode: str | int) -> MyInputSequence:
+        self._items.append(get_key_event(keycode, False))
+        return self
+
+    def unicode_down(self, char: str) -> MyInputSequence:
+        self._items.extend(get_unicode_events(char, True))
+        return self
+
+    def unicode_up(self, char: str) -> MyInputSequence:
+        self._items.extend(get_unicode_events(char, False))
+        return self
+
+    def mouse_down(self, button_code: str) -> MyInputSequence:
+        self._items.append(get_mouse_event(button_code, True))
+        return self
+
+    def mouse_up(self, button_code: str) -> MyInputSequence:
+        self._items.append(get_mouse_event(button_code, False))
+        return self
+
+    def mouse_move(self, x: int, y: int, /, *, is_relative: bool = False) -> MyInputSequence:
+        self._items.append(get_mouse_move_event(x, y, is_relative=is_relative))
+        return self
+
+    def sleep(self, period_ms: int, /, *, variation_ratio: float = 0.0) -> MyInputSequence:
+        """Insert delay between events (see `my_sleep_with_random()`)."""
+        self._items.append((period_ms, variation_ratio))
+        return self
+
+    def compile(self) -> MyCompiledInputSequence:
+        offsets_ns: list[int] = []
+        events: list[MyInputEvent] = []
+        offset_ns = 0
+        for item in self._items:
+            if isinstance(item, MyInputEvent):
+                offsets_ns.append(offset_ns)
+                events.append(item)
+            else:
+                period_ms, variation_ratio = item
+                offset_ns += int(_get_period_ms_with_random(period_ms, variation_ratio) * _NS_PER_MS)
+        return MyCompiledInputSequence(tuple(offsets_ns), tuple(events), offset_ns)
+
+def g_send_input_sequence(sequence: MyCompiledInputSequence, /) -> Generator[MyWaitRequest | None, Any, None]:
+    """
+    Send events at their target time (with holding the input lock).
+    Events whose target time has come are sent by one call of the input dispatcher.
+    Keys and buttons pressed by this sequence are released even if the generator is closed or an exception is thrown into it.
+    """
+    yield from g_with_input_lock(_g_send_input_sequence(sequence))
+
+def send_input_sequence(sequence: MyCompiledInputSequence, /) -> None:
+    """
+    This function is synchronous (blocking) API (see `g_send_input_sequence()`).
+    """
+    _run_blocking(_g_send_input_sequence(sequence))
+
+def _g_send_input_sequence(sequence: MyCompiledInputSequence) -> Generator[MyWaitRequest | None, Any, None]:
+    dispatcher = get_input_dispatcher()
+    lock = get_input_lock()
+    offsets_ns = sequence.offsets_ns
+    events = sequence.events
+    pressed: dict[MyInputEvent, None] = dict() # ordered set of release events
+    start_ns = my_get_monotonic_ns()
+    index = 0
+    with _deferring_pause(): # not to pause with holding keys
+        try:
+            while index < len(events):
+                deadline_ns = start_ns + offsets_ns[index]
+                if deadline_ns > my_get_monotonic_ns() + _MARGIN_NS_FOR_BATCH:
+                    yield from g_wait_for(MyWaitRequest(deadline_ns=deadline_ns))
+                limit_ns = my_get_monotonic_ns() + _MARGIN_NS_FOR_BATCH - start_ns
+                end = index
+                while end < len(events) and offsets_ns[end] <= limit_ns:
+                    end += 1
+                batch = events[index:end]
+                lock.notify_input(is_release=all(event.is_release for event in batch))
+                sent_ns = my_get_monotonic_ns()
+                dispatcher.send(batch)
+                if (recorder := _timingstat.active_timing_recorder) is not None:
+                    recorder.record("input", 0, my_get_monotonic_ns() - sent_ns)
+                for event in batch:
+                    if event.is_release:
+                        pressed.pop(event, None)
+                    elif event.is_press:
+                        pressed[event.get_release_event()] = None
+                index = end
+            if (deadline_ns := start_ns + sequence.period_ns) > my_get_monotonic_ns():
+                yield from g_wait_for(MyWaitRequest(deadline_ns=deadline_ns)) # delay after the last event
+        except BaseException:
+            if pressed:
+                # release without `yield` because it is not allowed while the generator is closed
+                lock.notify_input(is_release=True)
+                dispatcher.send(list(reversed(pressed)))
+            raise
+
+#=============================================================================
+# Test
+
+def _test_input_sequence():
+    class FakeInputDispatcher(InputDispatcher):
+        def __init__(self):
+            self.batches: list[tuple[int, list[MyInputEvent]]] = []
+
+        def send(self, events: Sequence[MyInputEvent]) -> None:
+            self.batches.append((my_get_monotonic_ns(), list(events)))
+
+    win32_dispatcher = Win32InputDispatcher()
+    win32_dispatcher._keyboard_mapping = {'up': 0xC8}
+    item = win32_dispatcher._to_input(get_key_event('up', False))
+    my_assert_eq((item.union.ki.wScan, item.union.ki.dwFlags), (0x48, _KEYEVENTF_SCANCODE | _KEYEVENTF_EXTENDEDKEY | _KEYEVENTF_KEYUP))
+    dispatcher = FakeInputDispatcher()
+    previous = set_input_dispatcher(dispatcher)
+    try:
+        sequence = MyInputSequence().key_down('ctrlleft').sleep(20).key_down('v').sleep(5).key_up('v').key_up('ctrlleft').sleep(20).mouse_down('left').compile()
+        send_input_sequence(sequence)
+        my_assert_eq([len(events) for _, events in dispatcher.batches], [1, 1, 2, 1])
+        timestamps = [timestamp for timestamp, _ in dispatcher.batches]
+        jitter_ms = max(abs((timestamp - timestamps[0]) - offset) for timestamp, offset in zip(timestamps, (0, 20 * _NS_PER_MS, 25 * _NS_PER_MS, 45 * _NS_PER_MS))) / _NS_PER_MS
+        print(f"{jitter_ms=:.3f}")
+        assert jitter_ms < 2.0
+        dispatcher.batches.clear()
+        generator = g_send_input_sequence(MyInputSequence().key_down('ctrlleft').sleep(1000).key_up('ctrlleft').compile())
+        next(generator)
+        generator.close() # the pressed key should be released
+        my_assert_eq([event.kind for _, events in dispatcher.batches for event in events], [MyInputEventKind.KEY_DOWN, MyInputEventKind.KEY_UP])
+        recorder = MyRecordingInputDispatcher()
+        set_input_dispatcher(recorder)
+        send_input_sequence(MyInputSequence().mouse_move(10, 20).mouse_down('left').sleep(5).mouse_up('left').compile())
+        my_assert_eq([event for _, event in recorder.get_events()], [get_mouse_move_event(10, 20), get_mouse_event('left', True), get_mouse_event('left', False)])
+        my_assert_eq(recorder.num_of_batches, 2)
+    finally:
+        set_input_dispatcher(previous)
+    print(f"OK: {_test_input_sequence.__name__}()")
+    sys.exit(1)
+
+if False:
+    _test_input_sequence()
@@ -2,12 +2,13 @@ import atexit
 from dataclasses import dataclass
 from enum import Enum
 import sys
-from typing import Any, Callable, Final
-
-import pydirectinput
+from typing import Any, Callable, Final, Generator, Iterable
 
+from . import timingstat as _timingstat
+from .inputdispatch import *
 from .modifier import MyModifier
 from .utils import *
+from .utils import _DELAY_MS_FOR_A_MOMENT, _deferring_pause, _handlers_for_abort, _run_blocking
 
 # for key name, refer to pydirectinput repository in GitHub
 # https://github.com/learncodebygaming/pydirectinput/blob/master/pydirectinput/__init__.py
@@ -203,60 +204,123 @@ def _cleanup() -> None:
         _key_up(key)
     assert not _pending_keys
 
+_handlers_for_abort.append(_cleanup) # release pressed keys when macros are aborted
+
 def _key_down(key: AllKey) -> None:
     global _is_handler_at_exit_already_registered
     # print(f"keyDown: {key.keyname}")
     if not _is_handler_at_exit_already_registered:
         _is_handler_at_exit_already_registered = True
         atexit.register(_handler_at_exit)
-    assert key.keycode in pydirectinput.KEYBOARD_MAPPING
+    event = get_key_event(key.keycode, True)
     assert key not in _pending_keys
+    get_input_lock().notify_input()
     _pending_keys.add(key)
-    pydirectinput.keyDown(key.keycode)
+    start_ns = my_get_monotonic_ns()
+    get_input_dispatcher().send((event,))
+    if (recorder := _timingstat.active_timing_recorder) is not None:
+        recorder.record("input", 0, my_get_monotonic_ns() - start_ns)
 
 def _key_up(key: AllKey) -> None:
     # print(f"keyUp: {key.keyname}")
-    assert key.keycode in pydirectinput.KEYBOARD_MAPPING
+    event = get_key_event(key.keycode, False)
     assert key in _pending_keys
-    pydirectinput.keyUp(key.keycode)
+    get_input_lock().notify_input(is_release=True)
+    start_ns = my_get_monotonic_ns()
+    get_input_dispatcher().send((event,))
+    if (recorder := _timingstat.active_timing_recorder) is not None:
+        recorder.record("input", 0, my_get_monotonic_ns() - start_ns)
     _pending_keys.remove(key)
 
+def _g_with_modifier_keys[T](generator: Generator[MyWaitRequest | None, Any, T], modifiers: MyModifier = MyModifier.NONE, /) -> Generator[MyWaitRequest | None, Any, T]:
+    # without the input lock (see `g_with_modifier_keys()`)
+    with _deferring_pause(): # not to pause with holding modifier keys
+        pressed: list[AllKey] = []
+        try:
+            for modifier in modifiers:
+                key = _ModifierKey[modifier.keyname]
+                _key_down(key)
+                pressed.append(key)
+                yield from g_sleep_a_moment()
+            result = yield from generator
+            if _pending_keys:
+                yield from g_sleep_a_moment()
+                _cleanup()
+                yield from g_sleep_a_moment()
+            return result
+        finally:
+            # release immediately (without delay) if the generator is closed or an exception is thrown into it,
+            # because `yield` is not allowed while the generator is closed
+            _release_keys(pressed)
+
+def _add_modifier_keys_down(sequence: MyInputSequence, modifiers: MyModifier) -> None:
+    for modifier in modifiers:
+        sequence.key_down(_ModifierKey[modifier.keyname].keycode)
+        sequence.sleep(_DELAY_MS_FOR_A_MOMENT, variation_ratio=0.2)
+
+def _add_modifier_keys_up(sequence: MyInputSequence, modifiers: MyModifier) -> None:
+    if not modifiers:
+        return
+    sequence.sleep(_DELAY_MS_FOR_A_MOMENT, variation_ratio=0.2)
+    for modifier in modifiers:
+        sequence.key_up(_ModifierKey[modifier.keyname].keycode) # released at once (in one batch)
+    sequence.sleep(_DELAY_MS_FOR_A_MOMENT, variation_ratio=0.2)
+
+def _compile_key_press(key: NormalKey | None, modifiers: MyModifier) -> MyCompiledInputSequence:
+    sequence = MyInputSequence()
+    _add_modifier_keys_down(sequence, modifiers)
+    if key is not None:
+        sequence.key_down(key.keycode)
+        sequence.sleep(6, variation_ratio=2/6) # use specific period instead of `_DELAY_MS_FOR_A_MOMENT` because max 9ms wait cause key repeat
+        sequence.key_up(key.keycode)
+    _add_modifier_keys_up(sequence, modifiers)
+    return sequence.compile()
+
+def _release_keys(keys: Iterable[AllKey]) -> None:
+    for key in keys:
+        if key in _pending_keys: # may be already released (such as by abort)
+            _key_up(key)
+
 #=============================================================================
 # Public functions
 
+def g_with_modifier_keys[T](generator: Generator[MyWaitRequest | None, Any, T], modifiers: MyModifier = MyModifier.NONE, /) -> Generator[MyWaitRequest | None, Any, T]:
+    """
+    Run a macro generator with pressing modifier keys (with holding the input lock).
+    Modifier keys can be specified as a bitmap (use bit-OR to specify multiple modifier keys).
+    No modifier key may be specified.
+    Pressed keys are released even if the generator is closed or an exception is thrown into it.
+    """
+    return (yield from g_with_input_lock(_g_with_modifier_keys(generator, modifiers)))
+
+def g_key_press(key: NormalKey | None, modifiers: MyModifier = MyModifier.NONE, /) -> Generator[MyWaitRequest | None]:
+    """
+    Press key with modifier keys (generator version of `key_press()`).
+    """
+    if False:
+        prefix = "".join(f"{modifier.keyname} + " for modifier in modifiers)
+        keyname = key.keyname if key else "NOKEY"
+        print(f"key_press: {prefix}{keyname}")
+
+    yield from g_send_input_sequence(_compile_key_press(key, modifiers))
+
 def with_modifier_keys(func: Callable[[], Any], modifiers: MyModifier = MyModifier.NONE, /):
     """
     Call `func` with pressing modifier keys.
     Modifier keys can be specified as a bitmap (use bit-OR to specify multiple modifier keys).
     No modifier key may be specified.
+    This function is synchronous (blocking) API (see `g_with_modifier_keys()`).
     """
-    try:
-        for modifier in modifiers:
-            _key_down(_ModifierKey[modifier.keyname])
-            my_sleep_a_moment()
+    def g_func() -> Generator[MyWaitRequest | None]:
         func()
-    finally:
-        if _pending_keys:
-            my_sleep_a_moment()
-            _cleanup()
-            my_sleep_a_moment()
+        yield from ()
+    _run_blocking(_g_with_modifier_keys(g_func(), modifiers))
 
 def key_press(key: NormalKey | None, modifiers: MyModifier = MyModifier.NONE, /) -> None:
     """
     Press key with modifier keys.
     Modifier keys can be specified as a bitmap (use bit-OR to specify multiple modifier keys).
     If you want to press a modifier key only, use `None` as `key` argument
+    This function is synchronous (blocking) API (see `g_key_press()`).
     """
-    def f():
-        if key is None:
-            return
-        _key_down(key)
-        my_sleep_with_random(6, variation_ratio=2/6) # use specific period instead of `my_sleep_a_moment()` because max 9ms wait cause key repeat
-        _key_up(key)
-
-    if False:
-        prefix = "".join(f"{modifier.keyname} + " for modifier in modifiers)
-        keyname = key.keyname if key else "NOKEY"
-        print(f"key_press: {prefix}{keyname}")
-
-    with_modifier_keys(f, modifiers)
+    send_input_sequence(_compile_key_press(key, modifiers))
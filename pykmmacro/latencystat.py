@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import atexit
+import sys
+from typing import Any, Final, Generator, Iterable, Sequence, TextIO
+
+from .inputdispatch import *
+from .screenshot import get_frame_signal, get_region_signal
+from .timingstat import MyHistogram
+from .utils import *
+from .utils import _NS_PER_MS
+
+#=============================================================================
+# Constant
+
+_DEFAULT_PERIOD_MS_FOR_STABLE: Final[int] = 200 # no change for this period means "stable"
+_DEFAULT_TIMEOUT_MS_FOR_LATENCY: Final[int] = 5 * 1000
+
+#=============================================================================
+# Latency statistics
+
+class MyLatencyStat:
+    """
+    Latencies of an action from its first input event to the reaction of screen.
+    "first change" is when pixels in any watched region are changed at first,
+    and "stable" is the last change before no change for a while (such as an animation is finished).
+    Resolution is the interval of the frame watcher (see `MyFrameWatcher`).
+    """
+
+    def __init__(self, action: str):
+        self.action: Final = action
+        self.first_change: Final = MyHistogram()
+        self.stable: Final = MyHistogram()
+        self.num_of_timeouts = 0
+
+    def __str__(self):
+        def to_str(histogram: MyHistogram) -> str:
+            return "/".join(f"{value_ns / _NS_PER_MS:.0f}" for value_ns in (histogram.get_percentile_ns(0.5), histogram.get_percentile_ns(0.99), histogram.max_ns))
+        return (f"{self.action}: count={self.first_change.num_of_samples} timeouts={self.num_of_timeouts} "
+                f"first-change(p50/p99/max)={to_str(self.first_change)}ms stable(p50/p99/max)={to_str(self.stable)}ms")
+
+    def get_p99_ms(self) -> float:
+        """Return p99 of "stable" latency (a candidate of the period to wait after the action)."""
+        return self.stable.get_percentile_ns(0.99) / _NS_PER_MS
+
+#=============================================================================
+# Latency profiler
+
+class MyLatencyProfiler(InputDispatcher):
+    """
+    Measure how long the screen takes to react to input (such as a window opens after a key press).
+    While started, this works as a proxy of the input dispatcher to timestamp each input event.
+    Use `g_measure()` to run an action and watch regions of the active window with the frame watcher.
+    """
+
+    def __init__(self):
+        self._dispatcher: InputDispatcher | None = None
+        self._first_inputs_ns: Final[dict[int, int | None]] = dict() # id of each measurement in progress -> timestamp of its first input
+        self._next_id_of_measurement = 0
+        self._table: Final[dict[str, MyLatencyStat]] = dict()
+
+    def send(self, events: Sequence[MyInputEvent]) -> None:
+        assert self._dispatcher is not None
+        for id_of_measurement, input_ns in self._first_inputs_ns.items(): # only the first input of each measurement is kept
+            if input_ns is None:
+                self._first_inputs_ns[id_of_measurement] = my_get_monotonic_ns()
+        self._dispatcher.send(events)
+
+    def start(self) -> None:
+        assert self._dispatcher is None
+        self._dispatcher = get_input_dispatcher()
+        set_input_dispatcher(self)
+
+    def stop(self) -> None:
+        assert self._dispatcher is not None
+        assert get_input_dispatcher() is self
+        set_input_dispatcher(self._dispatcher)
+        self._dispatcher = None
+
+    def get_stat(self, action: str) -> MyLatencyStat:
+        stat = self._table.get(action)
+        if stat is None:
+            stat = MyLatencyStat(action)
+            self._table[action] = stat
+        return stat
+
+    def get_all_stats(self) -> list[MyLatencyStat]:
+        return list(self._table.values())
+
+    def g_measure[T](self, action: str, generator: Generator[MyWaitRequest | None, Any, T], rects: Iterable[MyRect], /, *,
+                     stable_ms: int = _DEFAULT_PERIOD_MS_FOR_STABLE, timeout_ms: int = _DEFAULT_TIMEOUT_MS_FOR_LATENCY) -> Generator[MyWaitRequest | None, Any, T]:
+        """
+        Run `generator` (which sends input), then wait until pixels in `rects` are changed and become stable.
+        The latencies are recorded as `action` (timeout is recorded too, and no exception is raised).
+        """
+        signals = [get_region_signal(rect) for rect in rects]
+        return (yield from self._g_measure(action, generator, signals, frame_signal=get_frame_signal(), stable_ms=stable_ms, timeout_ms=timeout_ms))
+
+    def _g_measure[T](self, action: str, generator: Generator[MyWaitRequest | None, Any, T], signals: Sequence[MySignal], /, *,
+                      frame_signal: MySignal | None, stable_ms: int, timeout_ms: int) -> Generator[MyWaitRequest | None, Any, T]:
+        assert self._dispatcher is not None, "call start() in advance"
+        assert signals
+        changes_ns: list[int] = [] # appended by the frame watcher thread
+        def callback():
+            changes_ns.append(my_get_monotonic_ns())
+        for signal in signals:
+            signal.subscribe(callback)
+            signal.num_of_waiters += 1 # keep capturing while the action runs
+        id_of_measurement = self._next_id_of_measurement
+        self._next_id_of_measurement += 1
+        try:
+            if frame_signal is not None:
+                # baselines of the regions should be captured before the input
+                # (the watcher may have been idle, so its last frame may be old, or the regions may have no frame yet)
+                yield from g_wait_for(MyWaitRequest.on_signals((frame_signal,), deadline_ns=my_get_monotonic_ns() + timeout_ms * _NS_PER_MS))
+            self._first_inputs_ns[id_of_measurement] = None # set by `send()`
+            del changes_ns[:] # ignore changes before the action
+            result = yield from generator
+            stat = self.get_stat(action)
+            input_ns = self._first_inputs_ns.pop(id_of_measurement)
+            if input_ns is None:
+                print(f"WARNING: no input in the action: {action!r}")
+                return result
+            deadline_ns = input_ns + timeout_ms * _NS_PER_MS
+            while True:
+                last_ns = max((change_ns for change_ns in changes_ns if change_ns >= input_ns), default=None)
+                if last_ns is None:
+                    limit_ns = deadline_ns
+                else:
+                    limit_ns = min(last_ns + stable_ms * _NS_PER_MS, deadline_ns)
+                if my_get_monotonic_ns() >= limit_ns:
+                    break
+                yield from g_wait_for(MyWaitRequest.on_signals(signals, deadline_ns=limit_ns))
+            changes = [change_ns - input_ns for change_ns in changes_ns if change_ns >= input_ns]
+            if not changes or my_get_monotonic_ns() >= deadline_ns:
+                stat.num_of_timeouts += 1
+            if changes:
+                stat.first_change.add(changes[0])
+                stat.stable.add(changes[-1])
+            return result
+        finally:
+            self._first_inputs_ns.pop(id_of_measurement, None) # if the action is aborted
+            for signal in signals:
+                signal.num_of_waiters -= 1
+                signal.unsubscribe(callback)
+
+    def dump(self, file: TextIO | None = None) -> None:
+        if file is None:
+            file = sys.stderr
+        print("===== latency summary =====", file=file)
+        for stat in sorted(self._table.values(), key=lambda stat: stat.action):
+            print(f"  {stat}", file=file)
+
+_latency_profiler: MyLatencyProfiler | None = None
+
+def enable_latency_profiler(*, dump_at_exit: bool = True) -> MyLatencyProfiler:
+    """
+    Start the latency profiler shared in this process, and return it.
+    If `dump_at_exit` is True, a summary is printed at exit of this process.
+    """
+    global _latency_profiler
+    if _latency_profiler is None:
+        _latency_profiler = MyLatencyProfiler()
+        _latency_profiler.start()
+        if dump_at_exit:
+            atexit.register(_latency_profiler.dump)
+    return _latency_profiler
+
+def get_latency_profiler() -> MyLatencyProfiler | None:
+    return _latency_profiler
+
+#=============================================================================
+# Test
+
+def _test_latency_profiler():
+    import threading
+    profiler = MyLatencyProfiler()
+    previous = set_input_dispatcher(NullInputDispatcher())
+    profiler.start()
+    try:
+        signal = MySignal("test region")
+        def g_action() -> Generator[MyWaitRequest | None]:
+            send_input_sequence(MyInputSequence().key_down('a').sleep(5).key_up('a').compile())
+            for delay_s in (0.080, 0.120, 0.150): # animation after input
+                threading.Timer(delay_s, signal.fire).start()
+            yield from g_sleep(10)
+        for _ in range(3):
+            run_macro(profiler._g_measure("press A", g_action(), [signal], frame_signal=None, stable_ms=100, timeout_ms=1000))
+        stat = profiler.get_stat("press A")
+        print(stat)
+        my_assert_eq(stat.first_change.num_of_samples, 3)
+        assert 80 <= stat.first_change.get_percentile_ns(0.5) / _NS_PER_MS < 100
+        assert 150 <= stat.get_p99_ms() < 200
+        assert stat.num_of_timeouts == 0
+        run_macro(profiler._g_measure("no reaction", g_action(), [MySignal("other")], frame_signal=None, stable_ms=100, timeout_ms=200))
+        send_input_sequence(MyInputSequence().key_down('a').key_up('a').compile()) # out of measurements
+        my_assert_eq(profiler._first_inputs_ns, dict())
+        assert profiler.get_stat("no reaction").num_of_timeouts == 1
+        frame_signal = MySignal("test frame")
+        def fire_first_frame():
+            signal.fire() # a difference from the old frame before the watcher was idle
+            frame_signal.fire()
+        threading.Timer(0.020, fire_first_frame).start()
+        run_macro(profiler._g_measure("after idle", g_action(), [signal], frame_signal=frame_signal, stable_ms=100, timeout_ms=1000))
+        stat = profiler.get_stat("after idle")
+        my_assert_eq(stat.first_change.num_of_samples, 1)
+        assert 80 <= stat.first_change.get_percentile_ns(0.5) / _NS_PER_MS < 100 # the change before the input is not counted
+        profiler.dump(sys.stdout)
+    finally:
+        profiler.stop()
+        set_input_dispatcher(previous)
+    print(f"OK: {_test_latency_profiler.__name__}()")
+    sys.exit(1)
+
+if False:
+    _test_latency_profiler()
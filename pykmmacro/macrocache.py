@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import dataclasses
+import marshal
+import os
+from pathlib import Path
+import sys
+from typing import Any, Final, Generator
+
+from .macroinclude import *
+from .macroinclude import _get_digest
+from .macrovm import *
+from .macrovm import _VERSION_OF_MACRO_COMPILER
+from .utils import *
+
+#=============================================================================
+# Constant
+
+_MAGIC_FOR_MACRO_CACHE: Final[bytes] = b"PKMMAC01"
+_NAME_OF_CACHE_DIRECTORY: Final[str] = "__macrocache__"
+
+#=============================================================================
+# Compiled-macro cache
+
+def _get_cache_path(path: Path) -> Path:
+    return path.parent / _NAME_OF_CACHE_DIRECTORY / f"{path.name}.{_VERSION_OF_MACRO_COMPILER}.bin"
+
+def _get_header() -> tuple[int, tuple[int, int]]:
+    # marshal format may be changed by Python version
+    return _VERSION_OF_MACRO_COMPILER, (sys.version_info.major, sys.version_info.minor)
+
+def _load_cache(cache_path: Path) -> MyMacroCode | None:
+    try:
+        data = cache_path.read_bytes() # one bulk read
+    except OSError:
+        return None
+    if not data.startswith(_MAGIC_FOR_MACRO_CACHE):
+        return None
+    try:
+        header, dependencies, fields = marshal.loads(memoryview(data)[len(_MAGIC_FOR_MACRO_CACHE):])
+    except (EOFError, ValueError, TypeError):
+        return None # broken (such as by crash while writing)
+    if header != _get_header():
+        return None
+    for path, digest in dependencies:
+        try:
+            if _get_digest(path) != digest:
+                return None
+        except OSError:
+            return None # such as an include file is removed
+    return MyMacroCode(*fields)
+
+def _save_cache(cache_path: Path, code: MyMacroCode, dependencies: list[tuple[str, bytes]]) -> None:
+    fields = tuple(getattr(code, field.name) for field in dataclasses.fields(MyMacroCode))
+    data = _MAGIC_FOR_MACRO_CACHE + marshal.dumps((_get_header(), tuple(dependencies), fields))
+    temporary_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    try:
+        cache_path.parent.mkdir(exist_ok=True)
+        temporary_path.write_bytes(data)
+        os.replace(temporary_path, cache_path) # readers never see a partial file
+    except OSError as ex:
+        print(f"WARNING: can not write macro cache: {ex}")
+        temporary_path.unlink(missing_ok=True)
+
+def load_macro_code(path: Path, /, *, is_cached: bool = True) -> MyMacroCode:
+    """
+    Return a compiled macro file (see `compile_macro()`).
+    Compiled code is cached in "__macrocache__" directory beside the file (like ".pyc" files),
+    and it is used while the contents of the file and all files included by it (transitively) are not changed.
+    The cache is also invalidated by a change of the compiler.
+    Files are parsed by the `INCLUDE` resolver shared in this process (see `MyMacroIncludeResolver`).
+    """
+    path = path.resolve() # `INCLUDE` is resolved by absolute paths (independent of current directory)
+    cache_path = _get_cache_path(path)
+    if is_cached and (code := _load_cache(cache_path)) is not None:
+        return code
+    project = get_macro_include_resolver().resolve(path)
+    code = compile_macro(project.programs[project.root], get_included=project.programs.__getitem__)
+    if is_cached:
+        _save_cache(cache_path, code, list(project.digests.items()))
+    return code
+
+def g_run_macro_file(path: Path, /, *, is_cached: bool = True) -> Generator[MyWaitRequest | None, Any, dict[str, int | str]]:
+    """Load (see `load_macro_code()`) and run a macro file (see `g_run_macro_code()`)."""
+    return (yield from g_run_macro_code(load_macro_code(path, is_cached=is_cached)))
+
+#=============================================================================
+# Test
+
+def _test_macro_cache():
+    import tempfile
+    import time
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "main.MAC"
+        library = Path(directory) / "lib" / "library.MAC"
+        library.parent.mkdir()
+        library.write_text("DIM answer\n:SUB\nanswer = 1\nRETURN\n", encoding='cp932')
+        block = "FOR i = 1 TO 3\n    IF i % 2 == 0 THEN\n        total = total + getpixel(i, 0)\n    ENDIF\nNEXT\n"
+        path.write_text('DIM i, total\nCALL SUB\nGOTO FINISH\n' + block * 10 * 1000 + ':FINISH\nEND\nINCLUDE "lib/library.MAC"\n', encoding='cp932')
+        def run() -> dict[str, int | str]:
+            return run_macro(g_run_macro_file(path))
+        start_ns = time.perf_counter_ns()
+        code = load_macro_code(path)
+        cold_ns = time.perf_counter_ns() - start_ns
+        assert _get_cache_path(path.resolve()).exists()
+        start_ns = time.perf_counter_ns()
+        my_assert_eq(load_macro_code(path), code)
+        warm_ns = time.perf_counter_ns() - start_ns
+        print(f"load {len(code.instructions)} instructions: cold {cold_ns / 1e6:.1f}ms, warm {warm_ns / 1e6:.1f}ms")
+        my_assert_eq(run()['ANSWER'], 1)
+        library.write_text("DIM answer\n:SUB\nanswer = 2\nRETURN\n", encoding='cp932') # a change of the include file invalidates the cache
+        my_assert_eq(run()['ANSWER'], 2)
+        _get_cache_path(path.resolve()).write_bytes(_MAGIC_FOR_MACRO_CACHE + b"broken")
+        my_assert_eq(run()['ANSWER'], 2)
+    print(f"OK: {_test_macro_cache.__name__}()")
+    sys.exit(1)
+
+if False:
+    _test_macro_cache()
@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+import hashlib
+import os
+from pathlib import Path
+import sys
+from typing import Final, Iterable, Iterator
+
+from .macroparser import *
+from .utils import *
+
+#=============================================================================
+# Constant
+
+# total size of files parsed at once (parsed programs are pickled back from workers,
+# and unpickling costs about 80% of parsing, so only large sources gain from workers)
+_MIN_SIZE_OF_SOURCES_FOR_PROCESS_POOL: Final[int] = 1024 * 1024
+_SIZE_OF_DIGEST: Final[int] = 16
+
+#=============================================================================
+# Exception
+
+class MyMacroIncludeCycleError(MyMacroSyntaxError):
+    def __init__(self, message: str, location: MySourceLocation, chain: tuple[str, ...]):
+        super().__init__(message, location)
+        self.chain: Final = chain # paths from the first file of the cycle to itself
+
+    def __reduce__(self):
+        return (type(self), (self.message, self.location, self.chain))
+
+#=============================================================================
+# INCLUDE resolver
+
+def _get_digest(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=_SIZE_OF_DIGEST)).digest()
+
+def _get_size_of_file(path: str) -> int:
+    try:
+        return os.stat(path).st_size
+    except OSError:
+        return 0 # reported when it is loaded
+
+def _load_macro_file(path: str) -> tuple[MyMacroProgram, bytes, int, int]:
+    # run in a worker process (or in this process)
+    stat = os.stat(path)
+    digest = _get_digest(path) # hashed before parsing (a change while parsing invalidates the result)
+    return parse_macro_file(Path(path)), digest, stat.st_mtime_ns, stat.st_size
+
+def _iter_includes(statements: Iterable[MyMacroStatement]) -> Iterator[MyMacroInclude]:
+    for statement in statements:
+        if isinstance(statement, MyMacroInclude):
+            yield statement
+        elif isinstance(statement, MyMacroIf):
+            yield from _iter_includes(statement.then_body)
+            yield from _iter_includes(statement.else_body)
+        elif isinstance(statement, MyMacroFor):
+            yield from _iter_includes(statement.body)
+
+@dataclass(frozen=True, slots=True)
+class MyMacroProject:
+    """
+    A macro file and all files included by it (transitively), parsed by `MyMacroIncludeResolver`.
+    Keys are paths resolved by `MyMacroInclude.get_resolved_path()`.
+    """
+    root: str
+    programs: dict[str, MyMacroProgram]
+    digests: dict[str, bytes] # of contents of each file
+    graph: dict[str, tuple[str, ...]] # files included by each file (without duplicates)
+
+class MyMacroIncludeResolver:
+    """
+    Build the dependency graph of `INCLUDE` (breadth-first), and parse each file only once.
+    Parsing a file does not need the files included by it, so files found at the same depth are parsed at once,
+    by a process pool if their total size is at least `min_size_for_process_pool` (the pool is kept until `close()`).
+    Parsed files are kept while they are not modified, so a library shared by many macros is parsed once in a process.
+    A cycle of `INCLUDE` is an error (`MyMacroIncludeCycleError` tells the chain).
+    """
+
+    def __init__(self, *, max_workers: int | None = None, min_size_for_process_pool: int = _MIN_SIZE_OF_SOURCES_FOR_PROCESS_POOL):
+        self.max_workers: Final = max_workers
+        self.min_size_for_process_pool: Final = min_size_for_process_pool
+        self.num_of_parses = 0
+        self._cache: Final[dict[str, tuple[MyMacroProgram, bytes, int, int]]] = dict()
+        self._pool: ProcessPoolExecutor | None = None # created at the first use
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _get_pool(self, paths: list[str]) -> ProcessPoolExecutor | None:
+        if len(paths) < 2 or (self.max_workers or os.cpu_count() or 1) < 2:
+            return None
+        if sum(_get_size_of_file(path) for path in paths) < self.min_size_for_process_pool:
+            return None
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.max_workers)
+        return self._pool
+
+    def _is_cached(self, path: str) -> bool:
+        entry = self._cache.get(path)
+        if entry is None:
+            return False
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return entry[2] == stat.st_mtime_ns and entry[3] == stat.st_size
+
+    def resolve(self, path: Path, /) -> MyMacroProject:
+        root = str(path.resolve())
+        programs: dict[str, MyMacroProgram] = dict()
+        digests: dict[str, bytes] = dict()
+        graph: dict[str, tuple[str, ...]] = dict()
+        locations: dict[tuple[str, str], MySourceLocation] = dict() # of the first `INCLUDE` for each edge
+        seen = {root}
+        frontier = [root]
+        while frontier:
+            paths = [path for path in frontier if not self._is_cached(path)]
+            futures: list[Future[tuple[MyMacroProgram, bytes, int, int]]] = []
+            if (pool := self._get_pool(paths)) is not None:
+                futures = [pool.submit(_load_macro_file, path) for path in paths]
+            for i, path in enumerate(paths):
+                try:
+                    self._cache[path] = futures[i].result() if futures else _load_macro_file(path)
+                except OSError as ex:
+                    location = next((location for (_, included), location in locations.items() if included == path), None)
+                    if location is None:
+                        raise
+                    raise MyMacroSyntaxError(f"can not include {path!r}: {ex}", location) from ex
+                self.num_of_parses += 1
+            next_frontier: list[str] = []
+            for path in frontier:
+                program, digest, _, _ = self._cache[path]
+                programs[path] = program
+                digests[path] = digest
+                included_paths: list[str] = []
+                for statement in _iter_includes(program.statements):
+                    included = statement.get_resolved_path()
+                    locations.setdefault((path, included), statement.location)
+                    included_paths.append(included)
+                    if included not in seen:
+                        seen.add(included)
+                        next_frontier.append(included)
+                graph[path] = tuple(dict.fromkeys(included_paths))
+            frontier = next_frontier
+        _check_cycles(root, graph, locations)
+        return MyMacroProject(root, programs, digests, graph)
+
+def _check_cycles(root: str, graph: dict[str, tuple[str, ...]], locations: dict[tuple[str, str], MySourceLocation]) -> None:
+    is_finished: dict[str, bool] = dict() # False while visiting (on the chain)
+    chain: list[str] = []
+    def visit(path: str) -> None:
+        is_finished[path] = False
+        chain.append(path)
+        for included in graph[path]:
+            state = is_finished.get(included)
+            if state is None:
+                visit(included)
+            elif not state:
+                cycle = (*chain[chain.index(included):], included)
+                raise MyMacroIncludeCycleError("cycle of INCLUDE: " + " -> ".join(cycle), locations[(path, included)], cycle)
+        chain.pop()
+        is_finished[path] = True
+    visit(root)
+
+_shared_include_resolver: MyMacroIncludeResolver | None = None
+
+def get_macro_include_resolver() -> MyMacroIncludeResolver:
+    """
+    Return the `INCLUDE` resolver shared in this process.
+    """
+    global _shared_include_resolver
+    if _shared_include_resolver is None:
+        _shared_include_resolver = MyMacroIncludeResolver()
+    return _shared_include_resolver
+
+#=============================================================================
+# Test
+
+def _test_macro_include_resolver():
+    import tempfile
+    import time
+    with tempfile.TemporaryDirectory() as directory:
+        base = Path(directory)
+        num_of_libraries = 8
+        body = "DIM x{0}\n:SUB{0}\nFOR x{0} = 1 TO 10\n    PRINT x{0} + 1\nNEXT\nRETURN\n"
+        (base / "common.MAC").write_text("".join(body.format(f"C{i}") for i in range(500)), encoding='cp932')
+        for i in range(num_of_libraries):
+            # every library includes the common library (many edges to one file)
+            (base / f"lib{i}.MAC").write_text('INCLUDE "common.MAC"\n' + "".join(body.format(f"L{i}_{j}") for j in range(500)), encoding='cp932')
+        (base / "main.MAC").write_text("".join(f'INCLUDE "lib{i}.MAC"\n' for i in range(num_of_libraries)) + 'INCLUDE "common.MAC"\n', encoding='cp932')
+        for max_workers in (1, 2):
+            resolver = MyMacroIncludeResolver(max_workers=max_workers, min_size_for_process_pool=0) # the pool is used if max_workers > 1
+            start_ns = time.perf_counter_ns()
+            project = resolver.resolve(base / "main.MAC")
+            print(f"resolve (max_workers={max_workers}): {(time.perf_counter_ns() - start_ns) / 1e6:.1f}ms for {len(project.programs)} files")
+            my_assert_eq(resolver.num_of_parses, num_of_libraries + 2)
+            my_assert_eq(len(project.graph[project.root]), num_of_libraries + 1)
+            resolver.resolve(base / "main.MAC")
+            my_assert_eq(resolver.num_of_parses, num_of_libraries + 2) # not modified
+        assert MyMacroIncludeResolver(max_workers=2)._get_pool(list(project.programs)) is None # too small for the pool by default
+        (base / "lib3.MAC").write_text('INCLUDE "lib4.MAC"\n', encoding='cp932')
+        (base / "lib4.MAC").write_text('DIM y\nIF y THEN\n    INCLUDE "lib3.MAC"\nENDIF\n', encoding='cp932')
+        try:
+            resolver.resolve(base / "main.MAC")
+            assert False
+        except MyMacroIncludeCycleError as ex:
+            print(ex)
+            my_assert_eq([Path(path).name for path in ex.chain], ["lib3.MAC", "lib4.MAC", "lib3.MAC"])
+            my_assert_eq((Path(ex.location.path).name, ex.location.line), ("lib4.MAC", 3))
+        my_assert_eq(resolver.num_of_parses, num_of_libraries + 4) # only modified files
+        resolver.close()
+    print(f"OK: {_test_macro_include_resolver.__name__}()")
+    sys.exit(1)
+
+if False:
+    _test_macro_include_resolver()
@@ -0,0 +1,597 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+import enum
+from pathlib import Path
+import re
+import sys
+from typing import Final, Iterable, Iterator
+
+from .utils import *
+
+#=============================================================================
+# Constant
+
+_ENCODING_FOR_MACRO_FILE: Final[str] = 'cp932' # Shift-JIS (with extensions by Windows)
+
+# spaces before a token are skipped in the same match (a match per token)
+_PATTERN_FOR_TOKEN: Final = re.compile(r"""
+    [ \t　]*+
+    (?:
+          (?P<NAME>[A-Za-z_][A-Za-z0-9_]*)
+        | (?P<OPERATOR>==|!=|<>|<=|>=|[-+*/%<>=(),:])
+        | (?P<NUMBER>0[xX][0-9A-Fa-f]+|[0-9]+)
+        | (?P<STRING>"(?:[^"]|"")*")
+        | (?P<COMMENT>;)
+        | (?P<ERROR>.)
+    )
+""", re.VERBOSE)
+_GROUP_FOR_NAME: Final[int] = 1
+_GROUP_FOR_OPERATOR: Final[int] = 2
+_GROUP_FOR_NUMBER: Final[int] = 3
+_GROUP_FOR_STRING: Final[int] = 4
+_GROUP_FOR_COMMENT: Final[int] = 5
+
+# operators in expressions (lower value binds looser)
+_PRECEDENCE_TABLE_FOR_BINARY_OPERATOR: Final[dict[str, int]] = {
+    'OR': 1,
+    'AND': 2,
+    # 3 is for 'NOT' (unary)
+    '==': 4, '!=': 4, '<': 4, '<=': 4, '>': 4, '>=': 4,
+    '+': 5, '-': 5,
+    '*': 6, '/': 6, '%': 6,
+}
+_PRECEDENCE_FOR_NOT: Final[int] = 3
+
+_ALIAS_TABLE_FOR_OPERATOR: Final[dict[str, str]] = {
+    '=': '==',
+    '<>': '!=',
+}
+
+_RESERVED_WORDS: Final[frozenset[str]] = frozenset((
+    'AND', 'OR', 'NOT', 'THEN', 'TO', 'STEP',
+    'DIM', 'SET', 'IF', 'ELSE', 'ENDIF', 'FOR', 'NEXT', 'GOTO', 'CALL', 'RETURN', 'END', 'INCLUDE',
+))
+
+#=============================================================================
+# Exception
+
+@dataclass(frozen=True, slots=True)
+class MySourceLocation:
+    path: str
+    line: int # 1-origin
+    column: int # 1-origin (in characters)
+
+    def __str__(self):
+        return f"{self.path}:{self.line}:{self.column}"
+
+class MyMacroSyntaxError(MyError):
+    def __init__(self, message: str, location: MySourceLocation):
+        super().__init__(f"{location}: {message}")
+        self.message: Final = message
+        self.location: Final = location
+
+    def __reduce__(self):
+        # to be pickled with its location (such as from a worker process)
+        return (type(self), (self.message, self.location))
+
+#=============================================================================
+# Token
+
+class MyMacroTokenKind(enum.Enum):
+    NAME = enum.auto() # upper-cased (names are case-insensitive)
+    NUMBER = enum.auto()
+    STRING = enum.auto()
+    OPERATOR = enum.auto()
+    END = enum.auto() # end of line
+
+@dataclass(frozen=True, slots=True)
+class MyMacroToken:
+    kind: MyMacroTokenKind
+    text: str
+    value: int | str | None
+    column: int # 1-origin
+
+def tokenize_macro_line(line: str, location: MySourceLocation, /) -> list[MyMacroToken]:
+    """
+    Split a line of a macro file into tokens (the last token is always `END`).
+    `location` is the location of the head of the line.
+    """
+    tokens: list[MyMacroToken] = []
+    for match in _PATTERN_FOR_TOKEN.finditer(line):
+        group = match.lastindex
+        assert group is not None
+        text = match[group]
+        column = match.start(group) + 1
+        if group == _GROUP_FOR_NAME:
+            tokens.append(MyMacroToken(MyMacroTokenKind.NAME, text.upper(), None, column))
+        elif group == _GROUP_FOR_OPERATOR:
+            tokens.append(MyMacroToken(MyMacroTokenKind.OPERATOR, text, None, column))
+        elif group == _GROUP_FOR_NUMBER:
+            tokens.append(MyMacroToken(MyMacroTokenKind.NUMBER, text, int(text, 0), column))
+        elif group == _GROUP_FOR_STRING:
+            tokens.append(MyMacroToken(MyMacroTokenKind.STRING, text, text[1:-1].replace('""', '"'), column))
+        elif group == _GROUP_FOR_COMMENT:
+            break
+        else:
+            message = "unterminated string" if text == '"' else f"invalid character: {text!r}"
+            raise MyMacroSyntaxError(message, MySourceLocation(location.path, location.line, column))
+    tokens.append(MyMacroToken(MyMacroTokenKind.END, "", None, len(line) + 1))
+    return tokens
+
+#=============================================================================
+# AST
+
+@dataclass(frozen=True, slots=True)
+class MyMacroNode:
+    location: MySourceLocation
+
+@dataclass(frozen=True, slots=True)
+class MyMacroExpression(MyMacroNode):
+    pass
+
+@dataclass(frozen=True, slots=True)
+class MyMacroLiteral(MyMacroExpression):
+    value: int | str
+
+@dataclass(frozen=True, slots=True)
+class MyMacroVariable(MyMacroExpression):
+    name: str
+
+@dataclass(frozen=True, slots=True)
+class MyMacroUnaryOp(MyMacroExpression):
+    operator: str # '-' or 'NOT'
+    operand: MyMacroExpression
+
+@dataclass(frozen=True, slots=True)
+class MyMacroBinaryOp(MyMacroExpression):
+    operator: str # a key of `_PRECEDENCE_TABLE_FOR_BINARY_OPERATOR`
+    left: MyMacroExpression
+    right: MyMacroExpression
+
+@dataclass(frozen=True, slots=True)
+class MyMacroFunctionCall(MyMacroExpression):
+    name: str
+    args: tuple[MyMacroExpression, ...]
+
+@dataclass(frozen=True, slots=True)
+class MyMacroStatement(MyMacroNode):
+    pass
+
+@dataclass(frozen=True, slots=True)
+class MyMacroLabel(MyMacroStatement):
+    name: str
+
+@dataclass(frozen=True, slots=True)
+class MyMacroDim(MyMacroStatement):
+    names: tuple[str, ...]
+
+@dataclass(frozen=True, slots=True)
+class MyMacroSet(MyMacroStatement):
+    name: str
+    value: MyMacroExpression
+
+@dataclass(frozen=True, slots=True)
+class MyMacroIf(MyMacroStatement):
+    condition: MyMacroExpression
+    then_body: tuple[MyMacroStatement, ...]
+    else_body: tuple[MyMacroStatement, ...]
+
+@dataclass(frozen=True, slots=True)
+class MyMacroFor(MyMacroStatement):
+    variable: str
+    start: MyMacroExpression
+    stop: MyMacroExpression # inclusive
+    step: MyMacroExpression | None
+    body: tuple[MyMacroStatement, ...]
+
+@dataclass(frozen=True, slots=True)
+class MyMacroGoto(MyMacroStatement):
+    label: str
+
+@dataclass(frozen=True, slots=True)
+class MyMacroCall(MyMacroStatement):
+    label: str
+
+@dataclass(frozen=True, slots=True)
+class MyMacroReturn(MyMacroStatement):
+    pass
+
+@dataclass(frozen=True, slots=True)
+class MyMacroEnd(MyMacroStatement):
+    pass
+
+@dataclass(frozen=True, slots=True)
+class MyMacroInclude(MyMacroStatement):
+    path: str # relative to the including file
+
+    def get_resolved_path(self) -> str:
+        """Return the path of the included file (the key of the file in `INCLUDE` resolution)."""
+        return str(Path(self.location.path).parent / self.path)
+
+@dataclass(frozen=True, slots=True)
+class MyMacroCommand(MyMacroStatement):
+    name: str
+    args: tuple[MyMacroExpression, ...]
+
+@dataclass(frozen=True, slots=True)
+class MyMacroProgram:
+    path: str
+    statements: tuple[MyMacroStatement, ...]
+
+#=============================================================================
+# Parser
+
+class _MyMacroBlock:
+    # an open block (IF or FOR) whose body is being parsed
+    __slots__ = ("header", "body", "else_body")
+
+    def __init__(self, header: MyMacroIf | MyMacroFor):
+        self.header: Final = header # body of the header is empty (replaced at the end of the block)
+        self.body: Final[list[MyMacroStatement]] = []
+        self.else_body: list[MyMacroStatement] | None = None
+
+class _MyMacroParser:
+    """
+    Parse lines one by one (a statement is a line), and keep only open blocks.
+    """
+
+    def __init__(self, path: str):
+        self.path: Final = path
+        self._blocks: Final[list[_MyMacroBlock]] = []
+        self._tokens: list[MyMacroToken] = []
+        self._index = 0
+        self._line = 0
+
+    def _location(self, token: MyMacroToken) -> MySourceLocation:
+        return MySourceLocation(self.path, self._line, token.column)
+
+    def _error(self, message: str, token: MyMacroToken | None = None) -> MyMacroSyntaxError:
+        if token is None:
+            token = self._tokens[self._index]
+        return MyMacroSyntaxError(message, self._location(token))
+
+    def _peek(self) -> MyMacroToken:
+        return self._tokens[self._index]
+
+    def _next(self) -> MyMacroToken:
+        token = self._tokens[self._index]
+        if token.kind != MyMacroTokenKind.END:
+            self._index += 1
+        return token
+
+    def _is_operator(self, text: str) -> bool:
+        token = self._tokens[self._index]
+        return token.kind == MyMacroTokenKind.OPERATOR and token.text == text
+
+    def _is_keyword(self, word: str) -> bool:
+        token = self._tokens[self._index]
+        return token.kind == MyMacroTokenKind.NAME and token.text == word
+
+    def _expect_operator(self, text: str) -> MyMacroToken:
+        if not self._is_operator(text):
+            raise self._error(f"'{text}' is expected")
+        return self._next()
+
+    def _expect_keyword(self, word: str) -> MyMacroToken:
+        if not self._is_keyword(word):
+            raise self._error(f"'{word}' is expected")
+        return self._next()
+
+    def _expect_name(self) -> str:
+        token = self._peek()
+        if token.kind != MyMacroTokenKind.NAME or token.text in _RESERVED_WORDS:
+            raise self._error("a name is expected")
+        return self._next().text
+
+    def _expect_end(self) -> None:
+        if self._peek().kind != MyMacroTokenKind.END:
+            raise self._error("end of line is expected")
+
+    def feed(self, line_number: int, line: str) -> Iterator[MyMacroStatement]:
+        """Parse a line, and generate top-level statements completed by the line."""
+        self._line = line_number
+        self._tokens = tokenize_macro_line(line, MySourceLocation(self.path, line_number, 1))
+        self._index = 0
+        token = self._peek()
+        if token.kind == MyMacroTokenKind.END:
+            return # empty line (or comment only)
+        if token.kind == MyMacroTokenKind.NAME:
+            match token.text:
+                case 'IF':
+                    self._next()
+                    condition = self._parse_expression()
+                    self._expect_keyword('THEN')
+                    if self._peek().kind == MyMacroTokenKind.END:
+                        self._blocks.append(_MyMacroBlock(MyMacroIf(self._location(token), condition, (), ())))
+                        return
+                    statement = self._parse_simple_statement() # one-line IF
+                    yield from self._emit(MyMacroIf(self._location(token), condition, (statement,), ()))
+                    return
+                case 'ELSE':
+                    self._next()
+                    self._expect_end()
+                    block = self._blocks[-1] if self._blocks else None
+                    if block is None or not isinstance(block.header, MyMacroIf) or block.else_body is not None:
+                        raise self._error("'ELSE' without 'IF'", token)
+                    block.else_body = []
+                    return
+                case 'ENDIF':
+                    self._next()
+                    self._expect_end()
+                    block = self._blocks[-1] if self._blocks else None
+                    if block is None or not isinstance(block.header, MyMacroIf):
+                        raise self._error("'ENDIF' without 'IF'", token)
+                    self._blocks.pop()
+                    header = block.header
+                    yield from self._emit(MyMacroIf(header.location, header.condition, tuple(block.body), tuple(block.else_body or ())))
+                    return
+                case 'FOR':
+                    self._next()
+                    variable = self._expect_name()
+                    self._expect_operator('=')
+                    start = self._parse_expression()
+                    self._expect_keyword('TO')
+                    stop = self._parse_expression()
+                    step = None
+                    if self._is_keyword('STEP'):
+                        self._next()
+                        step = self._parse_expression()
+                    self._expect_end()
+                    self._blocks.append(_MyMacroBlock(MyMacroFor(self._location(token), variable, start, stop, step, ())))
+                    return
+                case 'NEXT':
+                    self._next()
+                    block = self._blocks[-1] if self._blocks else None
+                    if block is None or not isinstance(block.header, MyMacroFor):
+                        raise self._error("'NEXT' without 'FOR'", token)
+                    header = block.header
+                    if self._peek().kind != MyMacroTokenKind.END and self._expect_name() != header.variable:
+                        raise self._error(f"'NEXT {header.variable}' is expected", token)
+                    self._expect_end()
+                    self._blocks.pop()
+                    yield from self._emit(MyMacroFor(header.location, header.variable, header.start, header.stop, header.step, tuple(block.body)))
+                    return
+        yield from self._emit(self._parse_simple_statement())
+
+    def finish(self) -> None:
+        if self._blocks:
+            header = self._blocks[-1].header
+            keyword = "ENDIF" if isinstance(header, MyMacroIf) else "NEXT"
+            raise MyMacroSyntaxError(f"'{keyword}' is missing for this block", header.location)
+
+    def _emit(self, statement: MyMacroStatement) -> Iterator[MyMacroStatement]:
+        if not self._blocks:
+            yield statement
+            return
+        block = self._blocks[-1]
+        if block.else_body is None:
+            block.body.append(statement)
+        else:
+            block.else_body.append(statement)
+
+    def _parse_simple_statement(self) -> MyMacroStatement:
+        # a statement in a line (not a block)
+        token = self._peek()
+        location = self._location(token)
+        if token.kind == MyMacroTokenKind.OPERATOR and token.text == ':':
+            self._next()
+            statement: MyMacroStatement = MyMacroLabel(location, self._expect_name())
+        elif token.kind != MyMacroTokenKind.NAME:
+            raise self._error("a statement is expected")
+        elif self._tokens[self._index + 1].text == '=' and token.text not in _RESERVED_WORDS:
+            statement = self._parse_assignment(location) # "SET" is omitted
+        else:
+            self._next()
+            match token.text:
+                case 'DIM':
+                    names = [self._expect_name()]
+                    while self._is_operator(','):
+                        self._next()
+                        names.append(self._expect_name())
+                    statement = MyMacroDim(location, tuple(names))
+                case 'SET':
+                    statement = self._parse_assignment(location)
+                case 'GOTO':
+                    statement = MyMacroGoto(location, self._expect_name())
+                case 'CALL':
+                    statement = MyMacroCall(location, self._expect_name())
+                case 'RETURN':
+                    statement = MyMacroReturn(location)
+                case 'END':
+                    statement = MyMacroEnd(location)
+                case 'INCLUDE':
+                    path = self._next()
+                    if path.kind != MyMacroTokenKind.STRING:
+                        raise self._error("a path string is expected", path)
+                    assert isinstance(path.value, str)
+                    statement = MyMacroInclude(location, path.value)
+                case word if word in _RESERVED_WORDS:
+                    raise self._error(f"'{word}' can not be used here", token)
+                case name:
+                    args: list[MyMacroExpression] = []
+                    if self._peek().kind != MyMacroTokenKind.END:
+                        args.append(self._parse_expression())
+                        while self._is_operator(','):
+                            self._next()
+                            args.append(self._parse_expression())
+                    statement = MyMacroCommand(location, name, tuple(args))
+        self._expect_end()
+        return statement
+
+    def _parse_assignment(self, location: MySourceLocation) -> MyMacroSet:
+        name = self._expect_name()
+        self._expect_operator('=')
+        return MyMacroSet(location, name, self._parse_expression())
+
+    def _get_binary_operator(self) -> str | None:
+        token = self._tokens[self._index]
+        if token.kind == MyMacroTokenKind.OPERATOR:
+            operator = _ALIAS_TABLE_FOR_OPERATOR.get(token.text, token.text)
+            return operator if operator in _PRECEDENCE_TABLE_FOR_BINARY_OPERATOR else None
+        if token.kind == MyMacroTokenKind.NAME and token.text in ('AND', 'OR'):
+            return token.text
+        return None
+
+    def _parse_expression(self, min_precedence: int = 1) -> MyMacroExpression:
+        # precedence climbing (all binary operators are left-associative)
+        left = self._parse_unary()
+        while (operator := self._get_binary_operator()) is not None:
+            precedence = _PRECEDENCE_TABLE_FOR_BINARY_OPERATOR[operator]
+            if precedence < min_precedence:
+                break
+            location = self._location(self._next())
+            right = self._parse_expression(precedence + 1)
+            left = MyMacroBinaryOp(location, operator, left, right)
+        return left
+
+    def _parse_unary(self) -> MyMacroExpression:
+        token = self._peek()
+        if token.kind == MyMacroTokenKind.OPERATOR and token.text == '-':
+            self._next()
+            return MyMacroUnaryOp(self._location(token), '-', self._parse_unary())
+        if token.kind == MyMacroTokenKind.NAME and token.text == 'NOT':
+            self._next()
+            return MyMacroUnaryOp(self._location(token), 'NOT', self._parse_expression(_PRECEDENCE_FOR_NOT + 1))
+        return self._parse_primary()
+
+    def _parse_primary(self) -> MyMacroExpression:
+        token = self._next()
+        location = self._location(token)
+        match token.kind:
+            case MyMacroTokenKind.NUMBER | MyMacroTokenKind.STRING:
+                assert token.value is not None
+                return MyMacroLiteral(location, token.value)
+            case MyMacroTokenKind.NAME if token.text not in _RESERVED_WORDS:
+                if not self._is_operator('('):
+                    return MyMacroVariable(location, token.text)
+                self._next()
+                args: list[MyMacroExpression] = []
+                if not self._is_operator(')'):
+                    args.append(self._parse_expression())
+                    while self._is_operator(','):
+                        self._next()
+                        args.append(self._parse_expression())
+                self._expect_operator(')')
+                return MyMacroFunctionCall(location, token.text, tuple(args))
+            case MyMacroTokenKind.OPERATOR if token.text == '(':
+                expression = self._parse_expression()
+                self._expect_operator(')')
+                return expression
+        raise self._error("an expression is expected", token)
+
+#=============================================================================
+# Public function
+
+def read_macro_lines(path: Path) -> Iterator[str]:
+    """
+    Read a macro file (Shift-JIS) line by line without reading the whole file.
+    Splitting bytes by LF is safe because the second byte of a Shift-JIS character is never LF.
+    """
+    with open(path, 'rb') as f:
+        for line_number, raw in enumerate(f, 1):
+            try:
+                line = raw.decode(_ENCODING_FOR_MACRO_FILE)
+            except UnicodeDecodeError as ex:
+                column = len(raw[:ex.start].decode(_ENCODING_FOR_MACRO_FILE, errors='replace')) + 1
+                raise MyMacroSyntaxError("invalid byte for Shift-JIS", MySourceLocation(str(path), line_number, column)) from None
+            yield line.rstrip('\r\n')
+
+def iter_macro_statements(lines: Iterable[str], path: str, /) -> Iterator[MyMacroStatement]:
+    """
+    Parse lines of a macro in a single pass, and generate each top-level statement as soon as it is completed.
+    Memory usage is bounded by the largest block (`IF` or `FOR`), not by the size of the file.
+    """
+    parser = _MyMacroParser(path)
+    for line_number, line in enumerate(lines, 1):
+        yield from parser.feed(line_number, line)
+    parser.finish()
+
+def parse_macro_file(path: Path) -> MyMacroProgram:
+    return MyMacroProgram(str(path), tuple(iter_macro_statements(read_macro_lines(path), str(path))))
+
+def parse_macro_text(text: str, /, *, path: str = "<string>") -> MyMacroProgram:
+    return MyMacroProgram(path, tuple(iter_macro_statements(text.splitlines(), path)))
+
+#=============================================================================
+# Test
+
+def _test_macro_parser():
+    import tempfile
+    import time
+    import tracemalloc
+    program = parse_macro_text('''
+        ; comment
+        DIM i, total
+        total = 0
+        FOR i = 1 TO 10 STEP 2
+            IF i % 3 == 0 AND NOT i > 8 THEN
+                SET total = total + i * -2
+            ELSE
+                MESSAGE "i=" + STR(i), "「ね」"
+            ENDIF
+        NEXT i
+        :LOOP
+        IF total <> 0 THEN GOTO LOOP
+        CALL SUB
+        END
+    ''', path="test.MAC")
+    statements = program.statements
+    my_assert_eq([type(statement).__name__ for statement in statements], ["MyMacroDim", "MyMacroSet", "MyMacroFor", "MyMacroLabel", "MyMacroIf", "MyMacroCall", "MyMacroEnd"])
+    loop = statements[2]
+    assert isinstance(loop, MyMacroFor)
+    my_assert_eq(loop.location, MySourceLocation("test.MAC", 5, 9))
+    branch = loop.body[0]
+    assert isinstance(branch, MyMacroIf)
+    condition = branch.condition
+    assert isinstance(condition, MyMacroBinaryOp) and condition.operator == 'AND'
+    assert isinstance(condition.right, MyMacroUnaryOp) and isinstance(condition.right.operand, MyMacroBinaryOp) and condition.right.operand.operator == '>'
+    assignment = branch.then_body[0]
+    assert isinstance(assignment, MyMacroSet) and isinstance(assignment.value, MyMacroBinaryOp)
+    my_assert_eq(assignment.value.operator, '+')
+    command = branch.else_body[0]
+    assert isinstance(command, MyMacroCommand) and command.name == 'MESSAGE'
+    my_assert_eq(command.args[1], MyMacroLiteral(MySourceLocation("test.MAC", 9, 40), "「ね」"))
+    one_line_if = statements[4]
+    assert isinstance(one_line_if, MyMacroIf) and isinstance(one_line_if.then_body[0], MyMacroGoto)
+    for text, location in (("SET x = (1 + 2", (1, 15)), ("IF 1 THEN\n", (1, 1)), ("NEXT", (1, 1)), ('MESSAGE "abc', (1, 9)), ("SET x = 1 2", (1, 11)), ("DIM x, IF", (1, 8))):
+        try:
+            parse_macro_text(text)
+            assert False, text
+        except MyMacroSyntaxError as ex:
+            my_assert_eq((ex.location.line, ex.location.column), location, text, str(ex))
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "large.MAC"
+        block = '''DIM x, y, color
+:START
+FOR x = 0 TO 100 STEP 10
+    SET color = getpixel(x * 2, 100 + x)
+    IF color == 0xFFFFFF AND x >= 50 THEN
+        MESSAGE "白: " + STR(x)  ; comment
+    ENDIF
+NEXT
+KEY "Enter"
+DELAY 500
+'''
+        num_of_blocks = 20 * 1000
+        with open(path, 'w', encoding=_ENCODING_FOR_MACRO_FILE, newline='\r\n') as f:
+            for _ in range(num_of_blocks):
+                f.write(block)
+        size = path.stat().st_size
+        num_of_lines = num_of_blocks * block.count('\n')
+        start_ns = time.perf_counter_ns()
+        num_of_statements = sum(1 for _ in iter_macro_statements(read_macro_lines(path), str(path)))
+        elapsed_ns = time.perf_counter_ns() - start_ns
+        my_assert_eq(num_of_statements, num_of_blocks * 5)
+        print(f"parse: {num_of_lines * 1e9 / elapsed_ns:.0f} lines/s ({size / 1e6 * 1e9 / elapsed_ns:.2f} MB/s)")
+        tracemalloc.start()
+        for _ in iter_macro_statements(read_macro_lines(path), str(path)):
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"peak memory: {peak // 1024}KiB for {size // 1024}KiB file")
+    print(f"OK: {_test_macro_parser.__name__}()")
+    sys.exit(1)
+
+if False:
+    _test_macro_parser()
@@ -0,0 +1,1021 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from pathlib import Path
+import sys
+from typing import Any, Callable, Final, Generator, Iterable, Sequence, TextIO
+
+from .clipboard import copy_to_clipboard
+from .humanize import get_humanize_rng
+from .keyboardinput import g_key_press, NormalKey
+from .macroparser import *
+from .modifier import MyModifier
+from .mouseinput import g_mouse_click, mouse_move_to, MouseButton
+from .screenshot import Screenshot
+from .textinput import g_type_text
+from .utils import *
+from .windowsapi import OffsetInWindow, show_dialog
+
+#=============================================================================
+# Constant
+
+_VERSION_OF_MACRO_COMPILER: Final[int] = 3 # increment when compiled code is changed (invalidates cache of compiled code)
+
+_NUM_OF_JUMPS_PER_YIELD: Final[int] = 1000 # a loop without waits yields sometimes (for abort, pause and other tasks)
+
+# Each instruction is (opcode, a, b, c).
+# Operands are slot indexes, jump targets (instruction indexes) or indexes of tables in `MyMacroCode`.
+_OP_MOVE: Final[int] = 0 # slot[a] = slot[b]
+_OP_ADD: Final[int] = 1 # slot[a] = slot[b] + slot[c] (concatenation if any of them is a string)
+_OP_SUB: Final[int] = 2
+_OP_MUL: Final[int] = 3
+_OP_DIV: Final[int] = 4 # truncated toward zero
+_OP_MOD: Final[int] = 5 # the sign follows the dividend
+_OP_EQ: Final[int] = 6 # slot[a] = 1 or 0
+_OP_NE: Final[int] = 7
+_OP_LT: Final[int] = 8
+_OP_LE: Final[int] = 9
+_OP_GT: Final[int] = 10
+_OP_GE: Final[int] = 11
+_OP_AND: Final[int] = 12
+_OP_OR: Final[int] = 13
+_OP_NEG: Final[int] = 14 # slot[a] = -slot[b]
+_OP_NOT: Final[int] = 15
+_OP_JUMP: Final[int] = 16 # goto a
+_OP_JUMP_IF_FALSE: Final[int] = 17 # if not slot[a]: goto b
+_OP_FOR_ENTER: Final[int] = 18 # slot[a] is the counter, slot[b] is the limit, slot[b + 1] is the step, goto c if no iteration
+_OP_FOR_NEXT: Final[int] = 19 # step the counter, and goto c (head of the body) if the limit is not exceeded
+_OP_CALL: Final[int] = 20 # push the return address, and goto a
+_OP_RETURN: Final[int] = 21
+_OP_CALL_FUNCTION: Final[int] = 22 # slot[a] = functions[b](*args[c])
+_OP_COMMAND: Final[int] = 23 # yield from commands[a](*args[b])
+_OP_END: Final[int] = 24
+_OP_GETPIXELS: Final[int] = 25 # slot[a + i] = GETPIXEL of the i-th point of args[b] (x0, y0, x1, y1, ...), for c points captured at once
+# specialized by types of operands known at compile time (without checks of types)
+_OP_ADD_INT: Final[int] = 26 # slot[a] = slot[b] + slot[c] (both are integers)
+_OP_ADD_STR: Final[int] = 27 # concatenation (any of them is a string)
+_OP_MUL_INT: Final[int] = 28
+_OP_DIV_INT: Final[int] = 29
+_OP_MOD_INT: Final[int] = 30
+_OP_EQ_INT: Final[int] = 31
+_OP_NE_INT: Final[int] = 32
+_OP_LT_INT: Final[int] = 33
+_OP_LE_INT: Final[int] = 34
+_OP_GT_INT: Final[int] = 35
+_OP_GE_INT: Final[int] = 36
+# comparison fused with the conditional jump of `IF`
+_OP_JUMP_UNLESS_EQ_INT: Final[int] = 37 # if not slot[a] == slot[b]: goto c (both are integers)
+_OP_JUMP_UNLESS_NE_INT: Final[int] = 38
+_OP_JUMP_UNLESS_LT_INT: Final[int] = 39
+_OP_JUMP_UNLESS_LE_INT: Final[int] = 40
+_OP_JUMP_UNLESS_GT_INT: Final[int] = 41
+_OP_JUMP_UNLESS_GE_INT: Final[int] = 42
+
+_NAMES_OF_OPCODE: Final[tuple[str, ...]] = (
+    "MOVE", "ADD", "SUB", "MUL", "DIV", "MOD", "EQ", "NE", "LT", "LE", "GT", "GE", "AND", "OR", "NEG", "NOT",
+    "JUMP", "JUMP_IF_FALSE", "FOR_ENTER", "FOR_NEXT", "CALL", "RETURN", "CALL_FUNCTION", "COMMAND", "END", "GETPIXELS",
+    "ADD_INT", "ADD_STR", "MUL_INT", "DIV_INT", "MOD_INT", "EQ_INT", "NE_INT", "LT_INT", "LE_INT", "GT_INT", "GE_INT",
+    "JUMP_UNLESS_EQ_INT", "JUMP_UNLESS_NE_INT", "JUMP_UNLESS_LT_INT", "JUMP_UNLESS_LE_INT", "JUMP_UNLESS_GT_INT", "JUMP_UNLESS_GE_INT",
+)
+
+_OPCODE_TABLE_FOR_BINARY_OPERATOR: Final[dict[str, int]] = {
+    '+': _OP_ADD, '-': _OP_SUB, '*': _OP_MUL, '/': _OP_DIV, '%': _OP_MOD,
+    '==': _OP_EQ, '!=': _OP_NE, '<': _OP_LT, '<=': _OP_LE, '>': _OP_GT, '>=': _OP_GE,
+    'AND': _OP_AND, 'OR': _OP_OR,
+}
+
+_OPCODE_TABLE_FOR_UNARY_OPERATOR: Final[dict[str, int]] = {
+    '-': _OP_NEG,
+    'NOT': _OP_NOT,
+}
+
+# for operands known to be integers (other operators are not specialized)
+_OPCODE_TABLE_FOR_INT_OPERATOR: Final[dict[str, int]] = {
+    '+': _OP_ADD_INT, '*': _OP_MUL_INT, '/': _OP_DIV_INT, '%': _OP_MOD_INT,
+    '==': _OP_EQ_INT, '!=': _OP_NE_INT, '<': _OP_LT_INT, '<=': _OP_LE_INT, '>': _OP_GT_INT, '>=': _OP_GE_INT,
+}
+
+_OPCODE_TABLE_FOR_INT_CONDITION: Final[dict[str, int]] = {
+    '==': _OP_JUMP_UNLESS_EQ_INT, '!=': _OP_JUMP_UNLESS_NE_INT, '<': _OP_JUMP_UNLESS_LT_INT,
+    '<=': _OP_JUMP_UNLESS_LE_INT, '>': _OP_JUMP_UNLESS_GT_INT, '>=': _OP_JUMP_UNLESS_GE_INT,
+}
+
+# which operands are slot indexes (for relocation)
+_SLOT_OPERANDS_TABLE: Final[dict[int, tuple[int, ...]]] = {
+    _OP_MOVE: (1, 2),
+    **{opcode: (1, 2, 3) for opcode in _OPCODE_TABLE_FOR_BINARY_OPERATOR.values()},
+    **{opcode: (1, 2, 3) for opcode in _OPCODE_TABLE_FOR_INT_OPERATOR.values()},
+    _OP_ADD_STR: (1, 2, 3),
+    **{opcode: (1, 2) for opcode in _OPCODE_TABLE_FOR_INT_CONDITION.values()},
+    _OP_NEG: (1, 2),
+    _OP_NOT: (1, 2),
+    _OP_JUMP_IF_FALSE: (1,),
+    _OP_FOR_ENTER: (1, 2),
+    _OP_FOR_NEXT: (1, 2),
+    _OP_CALL_FUNCTION: (1,),
+    _OP_GETPIXELS: (1,),
+}
+
+# which operand is a jump target (for resolution of labels)
+_JUMP_OPERAND_TABLE: Final[dict[int, int]] = {
+    _OP_JUMP: 1,
+    _OP_JUMP_IF_FALSE: 2,
+    _OP_FOR_ENTER: 3,
+    _OP_FOR_NEXT: 3,
+    _OP_CALL: 1,
+    **{opcode: 3 for opcode in _OPCODE_TABLE_FOR_INT_CONDITION.values()},
+}
+
+# slot indexes are tagged while compiling (because the number of variables is not fixed yet)
+_TAG_FOR_CONSTANT: Final[int] = 1 << 28
+_TAG_FOR_TEMPORARY: Final[int] = 2 << 28
+
+# static types of expressions (a union of bits, inferred while compiling)
+_TYPE_INT: Final[int] = 1
+_TYPE_STR: Final[int] = 2
+_TYPE_ANY: Final[int] = _TYPE_INT | _TYPE_STR
+
+#=============================================================================
+# Exception
+
+class MyMacroRuntimeError(MyError):
+    def __init__(self, message: str, location: MySourceLocation):
+        super().__init__(f"{location}: {message}")
+        self.location: Final = location
+
+#=============================================================================
+# Built-in commands and functions
+
+def _divide(x: int, y: int) -> int:
+    if type(x) is not int or type(y) is not int:
+        raise TypeError(f"integers are expected: {x!r}, {y!r}")
+    quotient = abs(x) // abs(y)
+    return quotient if (x < 0) == (y < 0) else -quotient
+
+def _get_key(name: str) -> NormalKey:
+    key = _TABLE_FOR_KEY_NAME.get(name.upper())
+    if key is None:
+        raise ValueError(f"unknown key: {name!r}")
+    return key
+
+_TABLE_FOR_KEY_NAME: Final[dict[str, NormalKey]] = {key.name.upper(): key for key in NormalKey}
+
+def _g_delay(ms: int) -> Generator[MyWaitRequest | None]:
+    yield from g_sleep(ms)
+
+def _g_key(name: str) -> Generator[MyWaitRequest | None]:
+    yield from g_key_press(_get_key(name))
+
+def _g_click(button: str = "left") -> Generator[MyWaitRequest | None]:
+    yield from g_mouse_click(MouseButton[button.upper()])
+
+def _g_move(x: int, y: int) -> Generator[MyWaitRequest | None]:
+    mouse_move_to(OffsetInWindow(x, y))
+    yield from g_sleep_a_moment()
+
+def _g_type(text: str) -> Generator[MyWaitRequest | None]:
+    yield from g_type_text(str(text))
+
+def _g_paste(text: str) -> Generator[MyWaitRequest | None]:
+    copy_to_clipboard(str(text))
+    yield from g_key_press(NormalKey.V, MyModifier.CTRL)
+
+def _g_print(*values: int | str) -> Generator[MyWaitRequest | None]:
+    print(*values)
+    yield from ()
+
+def _g_message(text: str) -> Generator[MyWaitRequest | None]:
+    show_dialog(str(text))
+    yield from ()
+
+def _getpixel(x: int, y: int) -> int:
+    # captured at each call as `_getpixels()` (not from the shared screenshot, which may be older than the last input)
+    return _getpixels(x, y)[0]
+
+def _getpixels(*coordinates: int) -> list[int]:
+    # a run of GETPIXEL (see `_OP_GETPIXELS`) is served by one capture of the bounding region of all points
+    offsets = [OffsetInWindow(x, y) for x, y in zip(coordinates[0::2], coordinates[1::2])]
+    region = MyRect(
+        top=min(offset.y for offset in offsets),
+        right=max(offset.x for offset in offsets) + 1,
+        bottom=max(offset.y for offset in offsets) + 1,
+        left=min(offset.x for offset in offsets),
+    )
+    return [color.to_int() for color in Screenshot(region=region).get_pixels(offsets)]
+
+def _random(n: int) -> int:
+    return int(get_humanize_rng().uniform() * n)
+
+# name: (function, minimum number of arguments, maximum number of arguments)
+_COMMAND_TABLE: Final[dict[str, tuple[Callable[..., Generator[MyWaitRequest | None]], int, int]]] = {
+    'DELAY': (_g_delay, 1, 1),
+    'KEY': (_g_key, 1, 1),
+    'CLICK': (_g_click, 0, 1),
+    'MOVE': (_g_move, 2, 2),
+    'TYPE': (_g_type, 1, 1),
+    'PASTE': (_g_paste, 1, 1),
+    'PRINT': (_g_print, 0, 16),
+    'MESSAGE': (_g_message, 1, 1),
+}
+
+_FUNCTION_TABLE: Final[dict[str, tuple[Callable[..., int | str], int, int]]] = {
+    'GETPIXEL': (_getpixel, 2, 2),
+    'STR': (str, 1, 1),
+    'VAL': (int, 1, 1),
+    'LEN': (len, 1, 1),
+    'ABS': (abs, 1, 1),
+    'RANDOM': (_random, 1, 1),
+}
+
+_TYPE_TABLE_FOR_FUNCTION: Final[dict[str, int]] = {
+    'GETPIXEL': _TYPE_INT,
+    'STR': _TYPE_STR,
+    'VAL': _TYPE_INT,
+    'LEN': _TYPE_INT,
+    'ABS': _TYPE_INT,
+    'RANDOM': _TYPE_INT,
+}
+assert _TYPE_TABLE_FOR_FUNCTION.keys() == _FUNCTION_TABLE.keys()
+
+# functions without side effects (evaluated while compiling if all arguments are constants)
+_NAMES_OF_PURE_FUNCTION: Final[frozenset[str]] = frozenset(('STR', 'VAL', 'LEN', 'ABS'))
+
+def _evaluate_operator(opcode: int, x: int | str, y: int | str = 0) -> int | str:
+    # for constant folding, and for generic operators in `g_run_macro_code()`
+    if opcode == _OP_ADD:
+        return x + y if type(x) is int and type(y) is int else f"{x}{y}"
+    if opcode == _OP_SUB:
+        return x - y # type: ignore
+    if opcode == _OP_MUL:
+        if type(x) is not int or type(y) is not int:
+            raise TypeError(f"integers are expected: {x!r}, {y!r}")
+        return x * y
+    if opcode == _OP_DIV:
+        return _divide(x, y) # type: ignore
+    if opcode == _OP_MOD:
+        return x - y * _divide(x, y) # type: ignore
+    if opcode <= _OP_GE:
+        if type(x) is not type(y) and opcode >= _OP_LT:
+            x = str(x)
+            y = str(y)
+        if opcode == _OP_EQ:
+            return int(x == y)
+        if opcode == _OP_NE:
+            return int(x != y)
+        if opcode == _OP_LT:
+            return int(x < y) # type: ignore
+        if opcode == _OP_LE:
+            return int(x <= y) # type: ignore
+        if opcode == _OP_GT:
+            return int(x > y) # type: ignore
+        return int(x >= y) # type: ignore
+    if opcode == _OP_AND:
+        return int(bool(x) and bool(y))
+    if opcode == _OP_OR:
+        return int(bool(x) or bool(y))
+    if opcode == _OP_NEG:
+        return -x # type: ignore
+    assert opcode == _OP_NOT
+    return int(not x)
+
+#=============================================================================
+# Compiled code
+
+@dataclass(frozen=True, slots=True)
+class MyMacroCode:
+    """
+    A macro compiled by `compile_macro()` (run by `g_run_macro_code()`).
+    All fields are made of int/str/tuple, so this can be serialized by `marshal`.
+    Slots are laid out as variables (DIM), constants and temporaries.
+    """
+    path: str
+    instructions: tuple[tuple[int, int, int, int], ...]
+    locations: tuple[tuple[str, int, int], ...] # (path, line, column) of each instruction
+    initial_slots: tuple[int | str, ...]
+    variable_names: tuple[str | None, ...] # of the leading slots (None for a hidden variable)
+    function_names: tuple[str, ...]
+    command_names: tuple[str, ...]
+    arg_lists: tuple[tuple[int, ...], ...] # slot indexes of arguments for functions and commands
+
+    def get_location(self, index: int) -> MySourceLocation:
+        return MySourceLocation(*self.locations[index])
+
+    def disassemble(self, file: TextIO | None = None) -> None:
+        if file is None:
+            file = sys.stdout
+        for index, (opcode, a, b, c) in enumerate(self.instructions):
+            print(f"{index:5d} {_NAMES_OF_OPCODE[opcode]:20s} {a:5d} {b:5d} {c:5d}  ; {self.get_location(index)}", file=file)
+
+#=============================================================================
+# Compiler
+
+class _MyMacroCompiler:
+    def __init__(self, get_included: Callable[[str], MyMacroProgram], is_optimized: bool):
+        self._get_included: Final = get_included
+        self._is_optimized: Final = is_optimized
+        self._instructions: Final[list[list[int]]] = []
+        self._locations: Final[list[tuple[str, int, int]]] = []
+        self._variables: Final[dict[str, int]] = dict()
+        self._variable_names: Final[list[str | None]] = []
+        self._constants: Final[dict[tuple[type, int | str], int]] = dict()
+        self._num_of_temporaries = 0
+        self._max_num_of_temporaries = 0
+        self._labels: Final[dict[str, int]] = dict()
+        self._references: Final[list[tuple[int, str, MySourceLocation]]] = [] # (instruction index, label, location)
+        self._function_names: Final[list[str]] = []
+        self._command_names: Final[list[str]] = []
+        self._arg_lists: Final[list[list[int]]] = []
+        self._included: Final[set[str]] = set()
+        self._programs: Final[dict[str, MyMacroProgram]] = dict() # included files
+        self._types: Final[dict[str, int]] = dict() # of variables (all values assigned to each variable)
+        self._probes: Final[dict[int, int]] = dict() # id of `GETPIXEL` call -> slot of the value read by `_OP_GETPIXELS`
+
+    def _emit(self, location: MySourceLocation, opcode: int, a: int = 0, b: int = 0, c: int = 0) -> int:
+        self._instructions.append([opcode, a, b, c])
+        self._locations.append((location.path, location.line, location.column))
+        return len(self._instructions) - 1
+
+    def _patch_jump(self, index: int, target: int) -> None:
+        instruction = self._instructions[index]
+        instruction[_JUMP_OPERAND_TABLE[instruction[0]]] = target
+
+    def _new_variable(self, name: str | None) -> int:
+        self._variable_names.append(name)
+        return len(self._variable_names) - 1
+
+    def _get_variable(self, name: str, location: MySourceLocation) -> int:
+        slot = self._variables.get(name)
+        if slot is None:
+            raise MyMacroSyntaxError(f"variable is not declared by DIM: {name}", location)
+        return slot
+
+    def _get_constant(self, value: int | str) -> int:
+        key = (type(value), value)
+        index = self._constants.get(key)
+        if index is None:
+            index = len(self._constants)
+            self._constants[key] = index
+        return _TAG_FOR_CONSTANT | index
+
+    def _new_temporary(self) -> int:
+        index = self._num_of_temporaries
+        self._num_of_temporaries += 1
+        self._max_num_of_temporaries = max(self._max_num_of_temporaries, self._num_of_temporaries)
+        return _TAG_FOR_TEMPORARY | index
+
+    def _get_index(self, names: list[str], name: str) -> int:
+        if name not in names:
+            names.append(name)
+        return names.index(name)
+
+    def _get_included_program(self, statement: MyMacroInclude) -> MyMacroProgram:
+        path = statement.get_resolved_path()
+        program = self._programs.get(path)
+        if program is None:
+            try:
+                program = self._get_included(path)
+            except OSError as ex:
+                raise MyMacroSyntaxError(f"can not include {statement.path!r}: {ex}", statement.location) from ex
+            self._programs[path] = program
+        return program
+
+    def _iter_all_statements(self, statements: Iterable[MyMacroStatement], included: set[str]) -> Iterable[MyMacroStatement]:
+        # including nested statements and included files
+        for statement in statements:
+            yield statement
+            if isinstance(statement, MyMacroIf):
+                yield from self._iter_all_statements(statement.then_body, included)
+                yield from self._iter_all_statements(statement.else_body, included)
+            elif isinstance(statement, MyMacroFor):
+                yield from self._iter_all_statements(statement.body, included)
+            elif isinstance(statement, MyMacroInclude):
+                path = statement.get_resolved_path()
+                if path not in included:
+                    included.add(path)
+                    yield from self._iter_all_statements(self._get_included_program(statement).statements, included)
+
+    def _get_type(self, expression: MyMacroExpression) -> int:
+        if isinstance(expression, MyMacroLiteral):
+            return _TYPE_INT if type(expression.value) is int else _TYPE_STR
+        if isinstance(expression, MyMacroVariable):
+            return self._types.get(expression.name, _TYPE_ANY)
+        if isinstance(expression, MyMacroBinaryOp) and expression.operator == '+':
+            left = self._get_type(expression.left)
+            right = self._get_type(expression.right)
+            if left == _TYPE_INT and right == _TYPE_INT:
+                return _TYPE_INT
+            return _TYPE_STR if left == _TYPE_STR or right == _TYPE_STR else _TYPE_ANY
+        if isinstance(expression, MyMacroFunctionCall):
+            return _TYPE_TABLE_FOR_FUNCTION.get(expression.name, _TYPE_ANY)
+        return _TYPE_INT # other operators return an integer (or raise an error)
+
+    def _infer_types(self, program: MyMacroProgram) -> None:
+        """Infer the type of each variable from all assignments (`SET` and `FOR`) in the whole program."""
+        assignments: list[tuple[str, MyMacroExpression, int]] = [] # (variable, value, type of the other values)
+        for statement in self._iter_all_statements(program.statements, {program.path}):
+            match statement:
+                case MyMacroDim():
+                    for name in statement.names:
+                        self._types[name] = _TYPE_INT # initialized by 0
+                case MyMacroSet():
+                    assignments.append((statement.name, statement.value, 0))
+                case MyMacroFor():
+                    assignments.append((statement.variable, statement.start, _TYPE_INT)) # stepped by an integer
+        is_changed = True
+        while is_changed: # until the fixed point (types only grow, so this ends)
+            is_changed = False
+            for name, value, other_type in assignments:
+                old_type = self._types.get(name)
+                if old_type is None:
+                    continue # an error while compiling
+                new_type = old_type | self._get_type(value) | other_type
+                if new_type != old_type:
+                    self._types[name] = new_type
+                    is_changed = True
+
+    def _fold(self, expression: MyMacroExpression) -> int | str | None:
+        """Return the value of a constant expression (None if it is not constant or it raises an error at runtime)."""
+        if isinstance(expression, MyMacroLiteral):
+            return expression.value
+        if isinstance(expression, MyMacroUnaryOp):
+            operands = (expression.operand,)
+            opcode = _OPCODE_TABLE_FOR_UNARY_OPERATOR[expression.operator]
+        elif isinstance(expression, MyMacroBinaryOp):
+            operands = (expression.left, expression.right)
+            opcode = _OPCODE_TABLE_FOR_BINARY_OPERATOR[expression.operator]
+        elif isinstance(expression, MyMacroFunctionCall) and expression.name in _NAMES_OF_PURE_FUNCTION:
+            operands = expression.args
+            opcode = -1
+        else:
+            return None
+        values: list[int | str] = []
+        for operand in operands:
+            value = self._fold(operand)
+            if value is None:
+                return None
+            values.append(value)
+        try:
+            if opcode < 0:
+                return _FUNCTION_TABLE[expression.name][0](*values) # type: ignore
+            return _evaluate_operator(opcode, *values)
+        except (ArithmeticError, TypeError, ValueError):
+            return None # raised at runtime (with the location)
+
+    def _get_opcode_for_binary_op(self, expression: MyMacroBinaryOp) -> int:
+        if self._is_optimized:
+            left = self._get_type(expression.left)
+            right = self._get_type(expression.right)
+            if left == _TYPE_INT and right == _TYPE_INT:
+                opcode = _OPCODE_TABLE_FOR_INT_OPERATOR.get(expression.operator)
+                if opcode is not None:
+                    return opcode
+            elif expression.operator == '+' and (left == _TYPE_STR or right == _TYPE_STR):
+                return _OP_ADD_STR
+        return _OPCODE_TABLE_FOR_BINARY_OPERATOR[expression.operator]
+
+    def _collect_probes(self, expression: MyMacroExpression, assigned: set[str], probes: list[tuple[MyMacroFunctionCall, list[int]]]) -> None:
+        # `GETPIXEL` calls whose coordinates are known at the head of the run
+        if isinstance(expression, MyMacroUnaryOp):
+            self._collect_probes(expression.operand, assigned, probes)
+        elif isinstance(expression, MyMacroBinaryOp):
+            self._collect_probes(expression.left, assigned, probes)
+            self._collect_probes(expression.right, assigned, probes)
+        elif isinstance(expression, MyMacroFunctionCall):
+            for arg in expression.args:
+                self._collect_probes(arg, assigned, probes)
+            if expression.name != 'GETPIXEL' or len(expression.args) != 2:
+                return
+            slots: list[int] = []
+            for arg in expression.args:
+                if isinstance(arg, MyMacroVariable):
+                    slot = self._variables.get(arg.name)
+                    if slot is None or arg.name in assigned:
+                        return # not declared yet, or changed in the run
+                elif type(value := self._fold(arg)) is int:
+                    slot = self._get_constant(value)
+                else:
+                    return
+                slots.append(slot)
+            probes.append((expression, slots))
+
+    def _coalesce_probes(self, statements: Sequence[MyMacroStatement], start: int) -> int:
+        """
+        Emit `_OP_GETPIXELS` for `GETPIXEL` calls in a run of statements without inputs, waits and jumps
+        (assignments, and the condition of `IF` at the end), and return the end of the run.
+        """
+        assigned: set[str] = set()
+        probes: list[tuple[MyMacroFunctionCall, list[int]]] = []
+        end = start
+        while end < len(statements):
+            statement = statements[end]
+            if isinstance(statement, MyMacroSet):
+                self._collect_probes(statement.value, assigned, probes)
+                assigned.add(statement.name)
+            elif isinstance(statement, MyMacroIf):
+                self._collect_probes(statement.condition, assigned, probes)
+                end += 1
+                break
+            elif not isinstance(statement, MyMacroDim):
+                break
+            end += 1
+        if len(probes) >= 2:
+            coordinates: list[int] = []
+            for call, slots in probes:
+                self._probes[id(call)] = self._new_variable(None) # consecutive hidden variables
+                coordinates.extend(slots)
+            self._arg_lists.append(coordinates)
+            self._emit(probes[0][0].location, _OP_GETPIXELS, self._probes[id(probes[0][0])], len(self._arg_lists) - 1, len(probes))
+        return max(end, start + 1)
+
+    def _compile_args(self, name: str, args: tuple[MyMacroExpression, ...], table: dict[str, tuple[Any, int, int]], kind: str, location: MySourceLocation) -> int:
+        entry = table.get(name)
+        if entry is None:
+            raise MyMacroSyntaxError(f"unknown {kind}: {name}", location)
+        _, min_args, max_args = entry
+        if not min_args <= len(args) <= max_args:
+            raise MyMacroSyntaxError(f"{kind} {name} takes {min_args}..{max_args} arguments ({len(args)} given)", location)
+        self._arg_lists.append([self._compile_expression(arg) for arg in args])
+        return len(self._arg_lists) - 1
+
+    def _compile_expression(self, expression: MyMacroExpression, dst: int | None = None) -> int:
+        """Emit instructions to evaluate `expression`, and return the slot of the value (`dst` if specified)."""
+        location = expression.location
+        mark = self._num_of_temporaries
+        value = self._fold(expression) if self._is_optimized and not isinstance(expression, MyMacroVariable) else None
+        if value is not None:
+            slot = self._get_constant(value)
+        elif isinstance(expression, MyMacroLiteral):
+            slot = self._get_constant(expression.value)
+        elif isinstance(expression, MyMacroVariable):
+            slot = self._get_variable(expression.name, location)
+        elif id(expression) in self._probes:
+            slot = self._probes[id(expression)] # read at the head of the run
+        else:
+            # operands are evaluated into their own slots before the result is written into `dst`
+            # (so `dst` can be also an operand, such as "SET x = x * 2 + x")
+            if isinstance(expression, MyMacroUnaryOp):
+                operand = self._compile_expression(expression.operand)
+                opcode, a, b, c = _OPCODE_TABLE_FOR_UNARY_OPERATOR[expression.operator], 0, operand, 0
+            elif isinstance(expression, MyMacroBinaryOp):
+                left = self._compile_expression(expression.left)
+                right = self._compile_expression(expression.right)
+                opcode, a, b, c = self._get_opcode_for_binary_op(expression), 0, left, right
+            else:
+                assert isinstance(expression, MyMacroFunctionCall)
+                args = self._compile_args(expression.name, expression.args, _FUNCTION_TABLE, "function", location)
+                opcode, a, b, c = _OP_CALL_FUNCTION, 0, self._get_index(self._function_names, expression.name), args
+            self._num_of_temporaries = mark # temporaries of operands can be reused after this instruction
+            a = self._new_temporary() if dst is None else dst
+            self._emit(location, opcode, a, b, c)
+            return a
+        if dst is None or dst == slot:
+            return slot
+        self._emit(location, _OP_MOVE, dst, slot)
+        return dst
+
+    def _compile_condition(self, condition: MyMacroExpression) -> int:
+        """Emit a jump for a false condition (the target is patched later), and return the index of the jump."""
+        location = condition.location
+        if (self._is_optimized and isinstance(condition, MyMacroBinaryOp) and condition.operator in _OPCODE_TABLE_FOR_INT_CONDITION
+                and self._get_type(condition.left) == _TYPE_INT and self._get_type(condition.right) == _TYPE_INT
+                and self._fold(condition) is None):
+            left = self._compile_expression(condition.left)
+            right = self._compile_expression(condition.right)
+            return self._emit(location, _OPCODE_TABLE_FOR_INT_CONDITION[condition.operator], left, right)
+        return self._emit(location, _OP_JUMP_IF_FALSE, self._compile_expression(condition))
+
+    def _compile_statements(self, statements: Sequence[MyMacroStatement]) -> None:
+        end_of_run = 0
+        for index, statement in enumerate(statements):
+            self._num_of_temporaries = 0
+            if self._is_optimized and index >= end_of_run:
+                end_of_run = self._coalesce_probes(statements, index)
+            self._compile_statement(statement)
+
+    def _compile_statement(self, statement: MyMacroStatement) -> None:
+        location = statement.location
+        match statement:
+            case MyMacroDim():
+                for name in statement.names:
+                    if name in self._variables:
+                        raise MyMacroSyntaxError(f"variable is declared twice: {name}", location)
+                    self._variables[name] = self._new_variable(name)
+            case MyMacroSet():
+                self._compile_expression(statement.value, self._get_variable(statement.name, location))
+            case MyMacroLabel():
+                if statement.name in self._labels:
+                    raise MyMacroSyntaxError(f"label is defined twice: {statement.name}", location)
+                self._labels[statement.name] = len(self._instructions)
+            case MyMacroGoto():
+                self._references.append((self._emit(location, _OP_JUMP), statement.label, location))
+            case MyMacroCall():
+                self._references.append((self._emit(location, _OP_CALL), statement.label, location))
+            case MyMacroReturn():
+                self._emit(location, _OP_RETURN)
+            case MyMacroEnd():
+                self._emit(location, _OP_END)
+            case MyMacroIf():
+                index_for_else = self._compile_condition(statement.condition)
+                self._compile_statements(statement.then_body)
+                if statement.else_body:
+                    index_for_end = self._emit(location, _OP_JUMP)
+                    self._patch_jump(index_for_else, len(self._instructions))
+                    self._compile_statements(statement.else_body)
+                    self._patch_jump(index_for_end, len(self._instructions))
+                else:
+                    self._patch_jump(index_for_else, len(self._instructions))
+            case MyMacroFor():
+                counter = self._get_variable(statement.variable, location)
+                limit = self._new_variable(None) # hidden variables to evaluate them only once
+                step = self._new_variable(None)
+                assert step == limit + 1
+                self._compile_expression(statement.start, counter)
+                self._compile_expression(statement.stop, limit)
+                self._compile_expression(statement.step or MyMacroLiteral(location, 1), step)
+                index_for_enter = self._emit(location, _OP_FOR_ENTER, counter, limit)
+                head = len(self._instructions)
+                self._compile_statements(statement.body)
+                self._emit(location, _OP_FOR_NEXT, counter, limit, head)
+                self._patch_jump(index_for_enter, len(self._instructions))
+            case MyMacroInclude():
+                path = statement.get_resolved_path()
+                if path in self._included:
+                    return # each file is included only once (such as a library of subroutines)
+                self._included.add(path)
+                self._compile_statements(self._get_included_program(statement).statements)
+            case MyMacroCommand():
+                args = self._compile_args(statement.name, statement.args, _COMMAND_TABLE, "command", location)
+                self._emit(location, _OP_COMMAND, self._get_index(self._command_names, statement.name), args)
+            case _:
+                raise MyMacroSyntaxError(f"unsupported statement: {type(statement).__name__}", location)
+
+    def compile(self, program: MyMacroProgram) -> MyMacroCode:
+        self._included.add(program.path)
+        if self._is_optimized:
+            self._infer_types(program)
+        self._compile_statements(program.statements)
+        self._emit(MySourceLocation(program.path, 0, 0), _OP_END)
+        for index, label, location in self._references:
+            target = self._labels.get(label)
+            if target is None:
+                raise MyMacroSyntaxError(f"label is not defined: {label}", location)
+            self._patch_jump(index, target)
+        num_of_variables = len(self._variable_names)
+        num_of_constants = len(self._constants)
+        def relocate(slot: int) -> int:
+            if slot & _TAG_FOR_TEMPORARY:
+                return num_of_variables + num_of_constants + (slot & ~_TAG_FOR_TEMPORARY)
+            if slot & _TAG_FOR_CONSTANT:
+                return num_of_variables + (slot & ~_TAG_FOR_CONSTANT)
+            return slot
+        instructions: list[tuple[int, int, int, int]] = []
+        for instruction in self._instructions:
+            for position in _SLOT_OPERANDS_TABLE.get(instruction[0], ()):
+                instruction[position] = relocate(instruction[position])
+            opcode, a, b, c = instruction
+            instructions.append((opcode, a, b, c))
+        constants = [value for _, value in self._constants.keys()]
+        return MyMacroCode(
+            path=program.path,
+            instructions=tuple(instructions),
+            locations=tuple(self._locations),
+            initial_slots=(*([0] * num_of_variables), *constants, *([0] * self._max_num_of_temporaries)),
+            variable_names=tuple(self._variable_names),
+            function_names=tuple(self._function_names),
+            command_names=tuple(self._command_names),
+            arg_lists=tuple(tuple(relocate(slot) for slot in arg_list) for arg_list in self._arg_lists),
+        )
+
+def _parse_included_file(path: str) -> MyMacroProgram:
+    return parse_macro_file(Path(path))
+
+def compile_macro(program: MyMacroProgram, /, *, get_included: Callable[[str], MyMacroProgram] = _parse_included_file,
+                  is_optimized: bool = True) -> MyMacroCode:
+    """
+    Compile a parsed macro into instructions of a register machine.
+    Labels are resolved into instruction indexes, and variables are resolved into slot indexes.
+    `INCLUDE` is expanded in place (only at the first time for each file), and `get_included` returns the parsed file.
+    If `is_optimized`, constant subexpressions are folded, and operators are specialized by types inferred from
+    all assignments of each variable (such as `ADD_INT` without checks of types, and a comparison fused with the jump of `IF`).
+    And `GETPIXEL` calls in a run of statements without inputs and waits are served by one capture of their bounding region.
+    """
+    return _MyMacroCompiler(get_included, is_optimized).compile(program)
+
+#=============================================================================
+# Virtual machine
+
+def _create_operation(index: int, instruction: tuple[int, int, int, int], slots: list[Any], functions: list[Callable[..., int | str]],
+                      arg_lists: tuple[tuple[int, ...], ...], return_addresses: list[int], budget: list[int]) -> Callable[[], int]:
+    """
+    Return a closure which executes `instruction` and returns the index of the next instruction
+    (a table of closures is dispatched faster than a chain of `if` for each instruction).
+    An instruction which yields (or ends) returns the complement of its index instead (see `g_run_macro_code()`).
+    """
+    opcode, a, b, c = instruction
+    n = index + 1
+    to_yield = ~index
+    if opcode == _OP_MOVE:
+        def operation() -> int:
+            slots[a] = slots[b]
+            return n
+    elif opcode == _OP_ADD_INT:
+        def operation() -> int:
+            slots[a] = slots[b] + slots[c]
+            return n
+    elif opcode == _OP_SUB:
+        def operation() -> int:
+            slots[a] = slots[b] - slots[c]
+            return n
+    elif opcode == _OP_MUL_INT:
+        def operation() -> int:
+            slots[a] = slots[b] * slots[c]
+            return n
+    elif opcode == _OP_DIV_INT:
+        def operation() -> int:
+            x = slots[b]
+            y = slots[c]
+            q = abs(x) // abs(y)
+            slots[a] = q if (x < 0) == (y < 0) else -q
+            return n
+    elif opcode == _OP_MOD_INT:
+        def operation() -> int:
+            x = slots[b]
+            r = abs(x) % abs(slots[c])
+            slots[a] = r if x >= 0 else -r
+            return n
+    elif opcode == _OP_ADD_STR:
+        def operation() -> int:
+            slots[a] = f"{slots[b]}{slots[c]}"
+            return n
+    elif opcode == _OP_EQ_INT:
+        def operation() -> int:
+            slots[a] = 1 if slots[b] == slots[c] else 0
+            return n
+    elif opcode == _OP_NE_INT:
+        def operation() -> int:
+            slots[a] = 1 if slots[b] != slots[c] else 0
+            return n
+    elif opcode == _OP_LT_INT:
+        def operation() -> int:
+            slots[a] = 1 if slots[b] < slots[c] else 0
+            return n
+    elif opcode == _OP_LE_INT:
+        def operation() -> int:
+            slots[a] = 1 if slots[b] <= slots[c] else 0
+            return n
+    elif opcode == _OP_GT_INT:
+        def operation() -> int:
+            slots[a] = 1 if slots[b] > slots[c] else 0
+            return n
+    elif opcode == _OP_GE_INT:
+        def operation() -> int:
+            slots[a] = 1 if slots[b] >= slots[c] else 0
+            return n
+    elif opcode == _OP_JUMP_UNLESS_EQ_INT:
+        def operation() -> int:
+            return n if slots[a] == slots[b] else c
+    elif opcode == _OP_JUMP_UNLESS_NE_INT:
+        def operation() -> int:
+            return n if slots[a] != slots[b] else c
+    elif opcode == _OP_JUMP_UNLESS_LT_INT:
+        def operation() -> int:
+            return n if slots[a] < slots[b] else c
+    elif opcode == _OP_JUMP_UNLESS_LE_INT:
+        def operation() -> int:
+            return n if slots[a] <= slots[b] else c
+    elif opcode == _OP_JUMP_UNLESS_GT_INT:
+        def operation() -> int:
+            return n if slots[a] > slots[b] else c
+    elif opcode == _OP_JUMP_UNLESS_GE_INT:
+        def operation() -> int:
+            return n if slots[a] >= slots[b] else c
+    elif opcode == _OP_FOR_ENTER:
+        def operation() -> int:
+            step = slots[b + 1]
+            if type(step) is not int or step == 0:
+                raise ValueError(f"STEP should be a non-zero integer: {step!r}")
+            return n if (slots[a] <= slots[b] if step > 0 else slots[a] >= slots[b]) else c
+    elif opcode == _OP_FOR_NEXT:
+        limit = b
+        def operation() -> int:
+            step = slots[limit + 1]
+            counter = slots[a] + step
+            slots[a] = counter
+            if not (counter <= slots[limit] if step > 0 else counter >= slots[limit]):
+                return n
+            budget[0] -= 1
+            return c if budget[0] else to_yield
+    elif opcode == _OP_JUMP:
+        def operation() -> int:
+            budget[0] -= 1
+            return a if budget[0] else to_yield
+    elif opcode == _OP_JUMP_IF_FALSE:
+        def operation() -> int:
+            return n if slots[a] else b
+    elif opcode == _OP_CALL:
+        def operation() -> int:
+            return_addresses.append(n)
+            return a
+    elif opcode == _OP_RETURN:
+        def operation() -> int:
+            if not return_addresses:
+                raise ValueError("RETURN without CALL")
+            return return_addresses.pop()
+    elif opcode == _OP_CALL_FUNCTION:
+        function = functions[b]
+        args = arg_lists[c]
+        def operation() -> int:
+            slots[a] = function(*[slots[i] for i in args])
+            return n
+    elif opcode == _OP_GETPIXELS:
+        args = arg_lists[b]
+        def operation() -> int:
+            slots[a:a + c] = _getpixels(*[slots[i] for i in args])
+            return n
+    elif opcode in (_OP_COMMAND, _OP_END):
+        def operation() -> int:
+            return to_yield
+    elif opcode in (_OP_NEG, _OP_NOT):
+        def operation() -> int:
+            slots[a] = _evaluate_operator(opcode, slots[b])
+            return n
+    else:
+        assert opcode <= _OP_OR, opcode # generic operators (types are not known while compiling)
+        def operation() -> int:
+            slots[a] = _evaluate_operator(opcode, slots[b], slots[c])
+            return n
+    return operation
+
+def g_run_macro_code(code: MyMacroCode, /) -> Generator[MyWaitRequest | None, Any, dict[str, int | str]]:
+    """
+    Run a compiled macro as a macro generator, and return the values of variables at the end.
+    Commands (such as `DELAY`) yield their waits as native macros do.
+    """
+    instructions = code.instructions
+    slots: list[Any] = list(code.initial_slots)
+    functions = [_FUNCTION_TABLE[name][0] for name in code.function_names]
+    commands = [_COMMAND_TABLE[name][0] for name in code.command_names]
+    arg_lists = code.arg_lists
+    return_addresses: list[int] = []
+    budget = [_NUM_OF_JUMPS_PER_YIELD] # of jumps until the next yield
+    operations = [_create_operation(index, instruction, slots, functions, arg_lists, return_addresses, budget) for index, instruction in enumerate(instructions)]
+    pc = 0
+    try:
+        while True:
+            pc = operations[pc]()
+            if pc < 0:
+                pc = ~pc
+                opcode, a, b, c = instructions[pc]
+                if opcode == _OP_COMMAND:
+                    yield from commands[a](*[slots[i] for i in arg_lists[b]])
+                    pc += 1
+                elif opcode == _OP_END:
+                    break
+                else:
+                    # a loop without waits
+                    budget[0] = _NUM_OF_JUMPS_PER_YIELD
+                    yield None
+                    pc = a if opcode == _OP_JUMP else c
+    except (ArithmeticError, TypeError, ValueError, KeyError) as ex:
+        raise MyMacroRuntimeError(f"{ex}", code.get_location(pc)) from ex # `pc` is not updated by the failed instruction
+    return {name: slots[i] for i, name in enumerate(code.variable_names) if name is not None}
+
+#=============================================================================
+# Test
+
+def _test_macro_vm():
+    import time
+    program = parse_macro_text('''
+        DIM i, total, text, n
+        SET total = 0
+        FOR i = 10 TO 1 STEP -3
+            total = total * 2 + total + i
+        NEXT
+        text = "a" + 1 + "b"
+        n = -7 / 2 * 10 + -7 % 2
+        CALL SUB
+        IF n < 0 AND text == "a1b" THEN
+            PRINT "ok", n
+        ELSE
+            GOTO FAIL
+        ENDIF
+        END
+        :SUB
+        n = n - 1
+        RETURN
+        :FAIL
+        n = 0
+    ''', path="test.MAC")
+    for is_optimized in (False, True):
+        variables = run_macro(g_run_macro_code(compile_macro(program, is_optimized=is_optimized)))
+        my_assert_eq(variables, {'I': -2, 'TOTAL': ((10 * 3 + 7) * 3 + 4) * 3 + 1, 'TEXT': "a1b", 'N': -3 * 10 + -1 - 1})
+    # the same results with and without optimization (constant folding and specialized operators)
+    expressions = ("7 / -2", "-7 % 2", "x % -2", "x / 2 * 3", "\"a\" + 1 + 2", "1 + 2 + \"a\"", "\"10\" < 9", "s < 9", "s == 1",
+                   "x == \"3\"", "x >= 3 AND NOT s", "STR(12) + LEN(\"abc\")", "VAL(\"5\") * -x", "s + x * 2")
+    text = "DIM x, s, r0" + "".join(f", r{i + 1}" for i in range(len(expressions))) + "\nx = -7\ns = \"s\"\n"
+    text += "".join(f"r{i + 1} = {expression}\nIF {expression} THEN\n    r0 = r0 + {1 << i}\nENDIF\n" for i, expression in enumerate(expressions))
+    program = parse_macro_text(text)
+    naive_code = compile_macro(program, is_optimized=False)
+    optimized_code = compile_macro(program)
+    assert len(optimized_code.instructions) < len(naive_code.instructions)
+    my_assert_eq(run_macro(g_run_macro_code(optimized_code)), run_macro(g_run_macro_code(naive_code)))
+    for text, message in (("DIM x\nSET y = 1", "test.MAC:2:1: variable is not declared by DIM: Y"),
+                          ("GOTO L", "test.MAC:1:1: label is not defined: L"),
+                          ("FOO 1", "test.MAC:1:1: unknown command: FOO"),
+                          ("DIM x\nx = LEN(1, 2)", "test.MAC:2:5: function LEN takes 1..1 arguments (2 given)")):
+        try:
+            compile_macro(parse_macro_text(text, path="test.MAC"))
+            assert False, text
+        except MyMacroSyntaxError as ex:
+            my_assert_eq(str(ex), message)
+    for text, location in (("DIM x\nx = 1\nx = 10 / (x - 1)", MySourceLocation("test.MAC", 3, 8)),
+                           ("DIM x\nx = 1 + 10 / 0", MySourceLocation("test.MAC", 2, 12))): # not folded
+        try:
+            run_macro(g_run_macro_code(compile_macro(parse_macro_text(text, path="test.MAC"))))
+            assert False
+        except MyMacroRuntimeError as ex:
+            my_assert_eq(ex.location, location)
+    num_of_loops = 100 * 1000
+    code = compile_macro(parse_macro_text(f'''
+        DIM i, total
+        FOR i = 1 TO {num_of_loops}
+            total = total + i * 3 - 1
+        NEXT
+    '''))
+    vm_ns = python_ns = sys.maxsize # the best of some runs (against noise)
+    for _ in range(5):
+        start_ns = time.perf_counter_ns()
+        variables = run_macro(g_run_macro_code(code))
+        vm_ns = min(vm_ns, time.perf_counter_ns() - start_ns)
+        start_ns = time.perf_counter_ns()
+        total = 0
+        for i in range(1, num_of_loops + 1):
+            total = total + i * 3 - 1
+        python_ns = min(python_ns, time.perf_counter_ns() - start_ns)
+        my_assert_eq(variables['TOTAL'], total)
+    print(f"tight loop: VM {vm_ns / num_of_loops:.0f}ns/iteration, Python {python_ns / num_of_loops:.0f}ns/iteration (x{vm_ns / python_ns:.1f})")
+    assert vm_ns < python_ns * 10, "4 instructions per iteration should cost about x5 of Python"
+    program = parse_macro_text(f'''
+        DIM i, total, count, text
+        FOR i = 1 TO {num_of_loops}
+            total = total + (i * 3 + 60 * 60 * 24) % 7 - (2 * 8 + 1) / 4
+            IF i % 3 == 0 AND i > 10 THEN
+                count = count + 1
+            ENDIF
+            IF total >= 1000 THEN
+                total = total - 1000
+            ENDIF
+            text = "#" + count
+        NEXT
+    ''')
+    results: list[tuple[int, dict[str, int | str]]] = []
+    for is_optimized in (False, True):
+        code = compile_macro(program, is_optimized=is_optimized)
+        start_ns = time.perf_counter_ns()
+        variables = run_macro(g_run_macro_code(code))
+        elapsed_ns = time.perf_counter_ns() - start_ns
+        results.append((elapsed_ns, variables))
+        print(f"expression-heavy loop (is_optimized={is_optimized}): {elapsed_ns / num_of_loops:.0f}ns/iteration, {len(code.instructions)} instructions")
+    my_assert_eq(results[0][1], results[1][1])
+    print(f"gain of optimization: x{results[0][0] / results[1][0]:.2f}")
+    # a run of GETPIXEL is served by one capture (captures are replaced by a fake screen here)
+    captures: list[int] = []
+    def fake_getpixel(x: int, y: int) -> int:
+        captures.append(1)
+        return x * 1000 + y
+    def fake_getpixels(*coordinates: int) -> list[int]:
+        captures.append(len(coordinates) // 2)
+        return [x * 1000 + y for x, y in zip(coordinates[0::2], coordinates[1::2])]
+    program = parse_macro_text('''
+        DIM x, c1, c2, found
+        x = 10
+        DELAY 1
+        c1 = GETPIXEL(x, 20)
+        c2 = GETPIXEL(30, 40) + GETPIXEL(x + 1, 20) * 0
+        IF c1 == 10020 AND GETPIXEL(30 + 20, 60) == 50060 THEN
+            found = 1
+            x = GETPIXEL(1, 2)
+            DELAY 1
+            c1 = GETPIXEL(x, 2) + GETPIXEL(3, 4)
+        ENDIF
+    ''')
+    saved_getpixel, saved_getpixels = _FUNCTION_TABLE['GETPIXEL'], _getpixels
+    _FUNCTION_TABLE['GETPIXEL'] = (fake_getpixel, *saved_getpixel[1:])
+    globals()['_getpixels'] = fake_getpixels
+    try:
+        counts: list[list[int]] = []
+        for is_optimized in (False, True):
+            captures.clear()
+            results.append((0, run_macro(g_run_macro_code(compile_macro(program, is_optimized=is_optimized)))))
+            counts.append(list(captures))
+    finally:
+        _FUNCTION_TABLE['GETPIXEL'] = saved_getpixel
+        globals()['_getpixels'] = saved_getpixels
+    my_assert_eq(results[-1][1], results[-2][1])
+    my_assert_eq(results[-1][1], {'X': 1002, 'C1': 1002002 + 3004, 'C2': 30040, 'FOUND': 1})
+    my_assert_eq(counts, [[1] * 7, [3, 1, 1, 2]]) # "x + 1" is not a simple coordinate, and a run of one GETPIXEL is not changed
+    print(f"OK: {_test_macro_vm.__name__}()")
+    sys.exit(1)
+
+if False:
+    _test_macro_vm()
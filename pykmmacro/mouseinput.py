@@ -1,13 +1,16 @@
 from dataclasses import dataclass
 import enum
 import sys
-from typing import Final
+from typing import Final, Generator
 
-import pydirectinput
-
-from .keyboardinput import with_modifier_keys
+from . import timingstat as _timingstat
+from .inputdispatch import *
+from .keyboardinput import _add_modifier_keys_down, _add_modifier_keys_up
 from .modifier import MyModifier
+from .mousestat import get_mouse_position
+from .trajectory import get_mouse_trajectory
 from .utils import *
+from .utils import _DELAY_MS_FOR_A_MOMENT, _handlers_for_abort
 from .windowsapi import *
 
 #=============================================================================
@@ -55,47 +58,85 @@ def _cleanup():
             _mouse_up(button)
         assert not _pending_buttons
 
+_handlers_for_abort.append(_cleanup) # release pressed buttons when macros are aborted
+
+def _compile_mouse_click(button: MouseButton, modifiers: MyModifier) -> MyCompiledInputSequence:
+    print(f"MouseClick: {button.name}")
+    sequence = MyInputSequence()
+    _add_modifier_keys_down(sequence, modifiers)
+    sequence.mouse_down(button.code)
+    sequence.sleep(_DELAY_MS_FOR_A_MOMENT, variation_ratio=0.2)
+    sequence.mouse_up(button.code)
+    sequence.sleep(_DELAY_MS_FOR_A_MOMENT, variation_ratio=0.2)
+    _add_modifier_keys_up(sequence, modifiers)
+    return sequence.compile()
+
 def _mouse_down(button: MouseButton):
     print(f"MouseDown: {button.name}")
     assert button not in _pending_buttons
+    get_input_lock().notify_input()
     _pending_buttons.add(button)
     assert isinstance(button.code, str)
-    pydirectinput.mouseDown(button=button.code)
+    start_ns = my_get_monotonic_ns()
+    get_input_dispatcher().send((get_mouse_event(button.code, True),))
+    if (recorder := _timingstat.active_timing_recorder) is not None:
+        recorder.record("input", 0, my_get_monotonic_ns() - start_ns)
 
 def _mouse_up(button: MouseButton):
     print(f"MouseUp: {button.name}")
     assert button in _pending_buttons
     assert isinstance(button.code, str)
-    pydirectinput.mouseUp(button=button.code)
+    get_input_lock().notify_input(is_release=True)
+    start_ns = my_get_monotonic_ns()
+    get_input_dispatcher().send((get_mouse_event(button.code, False),))
+    if (recorder := _timingstat.active_timing_recorder) is not None:
+        recorder.record("input", 0, my_get_monotonic_ns() - start_ns)
     _pending_buttons.remove(button)
 
 #=============================================================================
 # Public function
 
+def g_mouse_click(button: MouseButton = MouseButton.LEFT, modifiers: MyModifier = MyModifier.NONE, /) -> Generator[MyWaitRequest | None]:
+    """
+    Press mouse button (generator version of `mouse_click()`).
+    The button is released even if the generator is closed or an exception is thrown into it.
+    """
+    yield from g_send_input_sequence(_compile_mouse_click(button, modifiers))
+
 def mouse_click(button: MouseButton = MouseButton.LEFT, modifiers: MyModifier = MyModifier.NONE, /):
     """
     Press mouse button.
     Modifier keys can be specified as a bitmap (use bit-OR to specify multiple modifier keys).
+    This function is synchronous (blocking) API (see `g_mouse_click()`).
     """
-    def helper():
-        try:
-            _mouse_down(button)
-            my_sleep_a_moment()
-        finally:
-            _cleanup()
-            my_sleep_a_moment()
-
-    with_modifier_keys(helper, modifiers)
+    send_input_sequence(_compile_mouse_click(button, modifiers))
 
 def mouse_move_relative(diff_x: int, diff_y: int):
     """
     Move mouse cursor to specified position.
     """
-    pydirectinput.move(diff_x, diff_y)
+    get_input_lock().notify_input()
+    get_input_dispatcher().send((get_mouse_move_event(diff_x, diff_y, is_relative=True),))
 
 def mouse_move_to(offset: OffsetInWindow):
     """
     Move mouse cursor to specified relative position
     """
     pos = offset.to_position_in_screen()
-    pydirectinput.moveTo(*pos.as_tuple())
+    get_input_lock().notify_input()
+    get_input_dispatcher().send((get_mouse_move_event(*pos.as_tuple()),))
+
+def g_mouse_glide_to(offset: OffsetInWindow) -> Generator[MyWaitRequest | None]:
+    """
+    Move mouse cursor to specified relative position along a human-like curve (generator version of `mouse_glide_to()`).
+    """
+    start = get_mouse_position()
+    yield from g_send_input_sequence(get_mouse_trajectory(start.as_tuple(), offset.to_position_in_screen().as_tuple()))
+
+def mouse_glide_to(offset: OffsetInWindow):
+    """
+    Move mouse cursor to specified relative position along a human-like curve (see `get_mouse_trajectory()`).
+    This function is synchronous (blocking) API (see `g_mouse_glide_to()`).
+    """
+    start = get_mouse_position()
+    send_input_sequence(get_mouse_trajectory(start.as_tuple(), offset.to_position_in_screen().as_tuple()))
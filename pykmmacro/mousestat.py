@@ -1,15 +1,14 @@
-from collections import deque
-from typing import Callable
-
-import pydirectinput
-from pynput import mouse
+from typing import Callable, Final
 
+from .eventhub import MyDeviceEventKind, get_event_hub
+from .utils import MySignal
 from .windowsapi import PositionInScreen
 
 #=============================================================================
 # Get mouse cursor position
 
 def get_mouse_position() -> PositionInScreen:
+    import pydirectinput # imported lazily (not needed until the first call)
     x: int
     y: int
     x, y = pydirectinput.position()
@@ -17,31 +16,29 @@ def get_mouse_position() -> PositionInScreen:
 
 #=============================================================================
 # Mouse event listener
-# https://pypi.org/project/pynput/
+
+_VK_FOR_LEFT_BUTTON: Final[int] = 0x01
+
+def get_mouse_signal() -> MySignal:
+    """
+    Return a signal which is fired for each click/scroll of mouse (moves are not included).
+    The listener thread of the event hub is started at the first call (see `MyEventHub`).
+    """
+    return get_event_hub().start_mouse().signal
 
 def setup_mouse_listener() -> Callable[[], PositionInScreen | None]:
-    # https://docs.python.org/3/library/collections.html#deque-objects
-    # - deque is thread-safe.
-    # - if deque is full, when a new item is added, the item at the opposite side will be discarded.
-    queue: deque[PositionInScreen] = deque(maxlen=1)
+    ring = get_event_hub().start_mouse()
+    cursor = ring.create_cursor()
 
     def get_position_of_latest_click() -> PositionInScreen | None:
-        try:
-            pos = queue.popleft()
-            return pos
-        except IndexError:
+        # use 'mouseUp' event of left button (ignore 'mouseDown' event)
+        seq = cursor.get_latest(MyDeviceEventKind.RELEASE, _VK_FOR_LEFT_BUTTON)
+        if seq is None:
             return None
-
-    def on_click(x: int, y: int, button: mouse.Button, pressed: bool) -> bool | None:
-        if button != mouse.Button.left:
-            return None
-        if pressed:
-            return None # ignore 'mouseDown' event (use 'mouseUp' event)
-        queue.append(PositionInScreen(x, y))
-        return None
-
-    listener = mouse.Listener(on_click=on_click)
-
-    listener.start() # start new listener theread
+        index = seq & ring.mask
+        x, y = ring.xs[index], ring.ys[index]
+        if ring.is_overwritten(seq):
+            return None # overwritten by the listener thread while reading
+        return PositionInScreen(x, y)
 
     return get_position_of_latest_click
@@ -0,0 +1,148 @@
+from dataclasses import dataclass
+import dataclasses
+import json
+import math
+from pathlib import Path
+import sys
+from typing import Final
+
+#=============================================================================
+# Constant
+
+_MIN_INTERVAL_MS_FOR_POLLING: Final[float] = 5.0
+_MAX_INTERVAL_MS_FOR_POLLING: Final[float] = 200.0
+_DEFAULT_INTERVAL_MS_FOR_POLLING: Final[float] = 50.0 # until any success is recorded
+
+_WEIGHT_FOR_NEW_SAMPLE: Final[float] = 0.2 # for exponentially weighted moving average
+_MAX_RATIO_OF_COST: Final[float] = 0.5 # spend at most half of wait time for evaluation of predicate
+_WIDTH_OF_DENSE_WINDOW: Final[float] = 2.0 # dense polling within "mean +- 2 sigma"
+
+#=============================================================================
+# Polling statistics
+
+@dataclass(kw_only=True)
+class MyPollingStat:
+    """
+    Statistics of waits (such as `g_with_timeout()`) at a call site.
+    Averages are exponentially weighted moving averages, so recent waits are dominant.
+    """
+
+    site: str
+    num_of_waits: int = 0
+    num_of_successes: int = 0
+    num_of_timeouts: int = 0
+    num_of_evaluations: int = 0
+    cost_ms: float = 0.0 # average cost of an evaluation of predicate
+    mean_ms: float = 0.0 # average time to success
+    variance_ms2: float = 0.0 # variance of time to success
+
+    def __str__(self):
+        return (f"{self.site}: waits={self.num_of_waits} timeouts={self.num_of_timeouts} "
+                f"evaluations/wait={self.num_of_evaluations / max(1, self.num_of_waits):.1f} "
+                f"cost={self.cost_ms:.3f}ms time-to-success={self.mean_ms:.1f}+-{math.sqrt(self.variance_ms2):.1f}ms")
+
+    def record_evaluation(self, cost_ms: float) -> None:
+        if self.num_of_evaluations == 0:
+            self.cost_ms = cost_ms
+        else:
+            self.cost_ms += _WEIGHT_FOR_NEW_SAMPLE * (cost_ms - self.cost_ms)
+        self.num_of_evaluations += 1
+
+    def record_success(self, elapsed_ms: float) -> None:
+        self.num_of_waits += 1
+        if self.num_of_successes == 0:
+            self.mean_ms = elapsed_ms
+            self.variance_ms2 = 0.0
+        else:
+            diff = elapsed_ms - self.mean_ms
+            self.mean_ms += _WEIGHT_FOR_NEW_SAMPLE * diff
+            self.variance_ms2 = (1 - _WEIGHT_FOR_NEW_SAMPLE) * (self.variance_ms2 + _WEIGHT_FOR_NEW_SAMPLE * diff * diff)
+        self.num_of_successes += 1
+
+    def record_timeout(self) -> None:
+        self.num_of_waits += 1
+        self.num_of_timeouts += 1
+
+    def get_next_interval_ms(self, elapsed_ms: float, /, *, min_ms: float = _MIN_INTERVAL_MS_FOR_POLLING, max_ms: float = _MAX_INTERVAL_MS_FOR_POLLING) -> float:
+        """
+        Return the period until the next evaluation of predicate.
+        Polling is dense near the expected time to success, and sparse otherwise.
+        """
+        assert 0 < min_ms and min_ms <= max_ms
+        if self.num_of_successes == 0:
+            interval = _DEFAULT_INTERVAL_MS_FOR_POLLING
+        else:
+            sigma = max(math.sqrt(self.variance_ms2), self.mean_ms * 0.1, min_ms)
+            begin = self.mean_ms - _WIDTH_OF_DENSE_WINDOW * sigma
+            end = self.mean_ms + _WIDTH_OF_DENSE_WINDOW * sigma
+            if elapsed_ms < begin:
+                interval = begin - elapsed_ms # skip to the dense window
+            elif elapsed_ms <= end:
+                interval = min_ms
+            else:
+                interval = (elapsed_ms - self.mean_ms) / 2 # back off gradually
+        interval = max(interval, self.cost_ms / _MAX_RATIO_OF_COST)
+        return min(max(interval, min_ms), max_ms)
+
+#=============================================================================
+# Shared table
+
+_table_of_polling_stat: Final[dict[str, MyPollingStat]] = dict()
+
+def get_polling_stat(site: str) -> MyPollingStat:
+    """
+    Return statistics for the call site (a new one is created at the first call).
+    """
+    stat = _table_of_polling_stat.get(site)
+    if stat is None:
+        stat = MyPollingStat(site=site)
+        _table_of_polling_stat[site] = stat
+    return stat
+
+def get_all_polling_stats() -> list[MyPollingStat]:
+    return list(_table_of_polling_stat.values())
+
+def save_polling_stats(path: Path) -> None:
+    """
+    Save statistics of all call sites as JSON (to use them in the next run).
+    """
+    data = [dataclasses.asdict(stat) for stat in _table_of_polling_stat.values()]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+
+def load_polling_stats(path: Path) -> None:
+    """
+    Load statistics saved by `save_polling_stats()`.
+    Statistics of the same call site are replaced.
+    """
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    assert isinstance(data, list)
+    for fields in data:
+        stat = MyPollingStat(**fields)
+        _table_of_polling_stat[stat.site] = stat
+
+#=============================================================================
+# Test
+
+def _test_polling_stat():
+    stat = MyPollingStat(site="test")
+    assert stat.get_next_interval_ms(0) == _DEFAULT_INTERVAL_MS_FOR_POLLING
+    for elapsed_ms in (1000, 1100, 900, 1000, 1050):
+        stat.record_evaluation(0.5)
+        stat.record_success(elapsed_ms)
+    print(stat)
+    far = stat.get_next_interval_ms(0)
+    near = stat.get_next_interval_ms(stat.mean_ms)
+    late = stat.get_next_interval_ms(stat.mean_ms * 3)
+    print(f"{far=} {near=} {late=}")
+    assert far == _MAX_INTERVAL_MS_FOR_POLLING
+    assert near == _MIN_INTERVAL_MS_FOR_POLLING
+    assert late > near
+    stat.record_evaluation(80.0) # expensive predicate
+    assert stat.get_next_interval_ms(stat.mean_ms) > _MIN_INTERVAL_MS_FOR_POLLING
+    print(f"OK: {_test_polling_stat.__name__}()")
+    sys.exit(1)
+
+if False:
+    _test_polling_stat()
@@ -1,11 +1,19 @@
 from __future__ import annotations
 
+import contextlib
+import ctypes
+from ctypes import wintypes
 from dataclasses import dataclass
+import functools
+import threading
+from typing import TYPE_CHECKING, Any, Final, Iterator, Sequence
 
-from PIL import ImageGrab
-
+from . import timingstat as _timingstat
 from .windowsapi import *
 
+if TYPE_CHECKING:
+    from PIL import Image
+
 @dataclass(frozen=True)
 class Color:
     red: int
@@ -29,12 +37,110 @@ class Color:
         assert 0 <= self.blue and self.blue <= 0xff
         return (self.red << 16) | (self.green << 8) | self.blue
 
+#=============================================================================
+# Capture of a region
+
+_SRCCOPY: Final[int] = 0x00CC0020
+_BI_RGB: Final[int] = 0
+_DIB_RGB_COLORS: Final[int] = 0
+_DPI_AWARENESS_CONTEXT_PER_MONITOR_AWARE: Final[int] = -3
+
+class _BITMAPINFOHEADER(ctypes.Structure):
+    _fields_ = [("biSize", wintypes.DWORD), ("biWidth", wintypes.LONG), ("biHeight", wintypes.LONG), ("biPlanes", wintypes.WORD),
+                ("biBitCount", wintypes.WORD), ("biCompression", wintypes.DWORD), ("biSizeImage", wintypes.DWORD),
+                ("biXPelsPerMeter", wintypes.LONG), ("biYPelsPerMeter", wintypes.LONG), ("biClrUsed", wintypes.DWORD), ("biClrImportant", wintypes.DWORD)]
+
+@functools.cache
+def _get_gdi() -> tuple[Any, Any]:
+    # handles are 64-bit (the default result type of ctypes is 32-bit)
+    user32 = ctypes.windll.user32 # type: ignore
+    gdi32 = ctypes.windll.gdi32 # type: ignore
+    user32.GetDC.argtypes = (wintypes.HWND,)
+    user32.GetDC.restype = wintypes.HDC
+    user32.ReleaseDC.argtypes = (wintypes.HWND, wintypes.HDC)
+    gdi32.CreateCompatibleDC.argtypes = (wintypes.HDC,)
+    gdi32.CreateCompatibleDC.restype = wintypes.HDC
+    gdi32.CreateCompatibleBitmap.argtypes = (wintypes.HDC, ctypes.c_int, ctypes.c_int)
+    gdi32.CreateCompatibleBitmap.restype = wintypes.HBITMAP
+    gdi32.SelectObject.argtypes = (wintypes.HDC, wintypes.HGDIOBJ)
+    gdi32.SelectObject.restype = wintypes.HGDIOBJ
+    gdi32.BitBlt.argtypes = (wintypes.HDC, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, wintypes.HDC, ctypes.c_int, ctypes.c_int, wintypes.DWORD)
+    gdi32.GetDIBits.argtypes = (wintypes.HDC, wintypes.HBITMAP, wintypes.UINT, wintypes.UINT, ctypes.c_void_p, ctypes.c_void_p, wintypes.UINT)
+    gdi32.DeleteObject.argtypes = (wintypes.HGDIOBJ,)
+    gdi32.DeleteDC.argtypes = (wintypes.HDC,)
+    if hasattr(user32, "SetThreadDpiAwarenessContext"): # since Windows 10 1607
+        user32.SetThreadDpiAwarenessContext.argtypes = (ctypes.c_void_p,)
+        user32.SetThreadDpiAwarenessContext.restype = ctypes.c_void_p
+    return user32, gdi32
+
+@contextlib.contextmanager
+def _per_monitor_dpi_awareness(user32: Any) -> Iterator[None]:
+    # in physical pixels even if this process is not DPI aware (the same as `ImageGrab.grab()`)
+    if not hasattr(user32, "SetThreadDpiAwarenessContext"):
+        yield
+        return
+    previous = user32.SetThreadDpiAwarenessContext(_DPI_AWARENESS_CONTEXT_PER_MONITOR_AWARE)
+    try:
+        yield
+    finally:
+        user32.SetThreadDpiAwarenessContext(previous)
+
+def _grab_client_region(hwnd: int, region: MyRect) -> Image.Image:
+    """
+    Capture only `region` in client region of the window.
+    (`ImageGrab.grab()` copies the whole window even if `bbox` is specified, and crops it)
+    """
+    user32, gdi32 = _get_gdi()
+    width, height = region.width, region.height
+    with _per_monitor_dpi_awareness(user32):
+        hdc_of_window = user32.GetDC(hwnd) # client region (the same as `ImageGrab.grab(window=hwnd)`)
+        if not hdc_of_window:
+            raise ctypes.WinError() # type: ignore
+        hdc_of_memory = gdi32.CreateCompatibleDC(hdc_of_window)
+        hbitmap = gdi32.CreateCompatibleBitmap(hdc_of_window, width, height)
+        try:
+            previous = gdi32.SelectObject(hdc_of_memory, hbitmap)
+            is_copied = gdi32.BitBlt(hdc_of_memory, 0, 0, width, height, hdc_of_window, region.left, region.top, _SRCCOPY)
+            gdi32.SelectObject(hdc_of_memory, previous)
+            if not is_copied:
+                raise ctypes.WinError() # type: ignore
+            header = _BITMAPINFOHEADER(ctypes.sizeof(_BITMAPINFOHEADER), width, -height, 1, 32, _BI_RGB, 0, 0, 0, 0, 0) # top-down
+            buffer = ctypes.create_string_buffer(width * height * 4)
+            if gdi32.GetDIBits(hdc_of_memory, hbitmap, 0, height, buffer, ctypes.byref(header), _DIB_RGB_COLORS) != height:
+                raise ctypes.WinError() # type: ignore
+        finally:
+            gdi32.DeleteObject(hbitmap)
+            gdi32.DeleteDC(hdc_of_memory)
+            user32.ReleaseDC(hwnd, hdc_of_window)
+    from PIL import Image # imported lazily (PIL is not needed until the first capture)
+    return Image.frombuffer("RGB", (width, height), buffer.raw, "raw", "BGRX", 0, 1)
+
+#=============================================================================
+# Screenshot
+
 class Screenshot:
-    def __init__(self, *, all_screens: bool = False):
+    def __init__(self, *, all_screens: bool = False, region: MyRect | None = None):
+        """
+        Capture active window (or all screens).
+        If `region` (in client region of active window) is specified, only the region is captured,
+        and pixels out of it can not be read.
+        """
+        from PIL import ImageGrab # imported lazily (PIL is not needed until the first capture)
+        start_ns = my_get_monotonic_ns()
         self.screen_info = get_screen_info()
         self.window_info = get_active_window_info()
         self.is_all_screens = all_screens
-        if self.is_all_screens:
+        self.region = region
+        if self.region is not None:
+            assert not self.is_all_screens
+            client = self.window_info.client
+            assert 0 <= self.region.left and self.region.right <= client.width, (self.region, client)
+            assert 0 <= self.region.top and self.region.bottom <= client.height, (self.region, client)
+            assert self.region.width > 0 and self.region.height > 0, self.region
+            hwnd = self.window_info.hwnd
+            assert hwnd
+            self.image = _grab_client_region(hwnd, self.region)
+        elif self.is_all_screens:
             # screenshot of all screens is affected by "monitor fading" of DisplayFusion
             # (screnshot of specified window is not affected)
             self.image = ImageGrab.grab(all_screens=True)
@@ -48,18 +154,46 @@ class Screenshot:
             self.image = ImageGrab.grab(window=hwnd)
             assert self.image.width == self.window_info.client.width, (self.image.width, self.window_info.client.width, self.image, self.window_info)
             assert self.image.height == self.window_info.client.height, (self.image.height, self.window_info.client.width, self.image, self.window_info)
+        if (recorder := _timingstat.active_timing_recorder) is not None:
+            recorder.record("capture", 0, my_get_monotonic_ns() - start_ns)
 
-    def get_pixel(self, offset: OffsetInWindow) -> Color:
+    def _to_xy_in_image(self, offset: OffsetInWindow) -> tuple[int, int]:
         assert self.window_info.client.includes(offset), (offset, self.window_info.client, self.window_info)
+        if self.region is not None:
+            assert self.region.includes(offset), (offset, self.region)
+            return offset.x - self.region.left, offset.y - self.region.top
         if self.is_all_screens:
             offset_in_screen = offset.to_position_in_screen(window_info=self.window_info, screen_info=self.screen_info).to_offset_in_screen(screen_info=self.screen_info)
-            color = self.image.getpixel(offset_in_screen.as_tuple())
-        else:
-            color = self.image.getpixel(offset.as_tuple())
+            return offset_in_screen.as_tuple()
+        return offset.as_tuple()
+
+    def get_pixel(self, offset: OffsetInWindow) -> Color:
+        color = self.image.getpixel(self._to_xy_in_image(offset))
         assert isinstance(color, tuple)
         assert len(color) == 3 # for Windows ("4" for macOS because color is RGBA)
         return Color(*color)
 
+    def get_pixels(self, offsets: Sequence[OffsetInWindow]) -> list[Color]:
+        """
+        Read pixels at once (faster than `get_pixel()` for each of them).
+        The bounding region of `offsets` is converted into bytes only once.
+        """
+        assert self.image.mode == "RGB", self.image.mode
+        points = [self._to_xy_in_image(offset) for offset in offsets]
+        if not points:
+            return []
+        left = min(x for x, _ in points)
+        top = min(y for _, y in points)
+        right = max(x for x, _ in points) + 1
+        bottom = max(y for _, y in points) + 1
+        data = self.image.crop((left, top, right, bottom)).tobytes()
+        stride = (right - left) * 3
+        colors: list[Color] = []
+        for x, y in points:
+            i = (y - top) * stride + (x - left) * 3
+            colors.append(Color(data[i], data[i + 1], data[i + 2]))
+        return colors
+
     def search_pixel(self, expected_color:Color, center: OffsetInWindow, width: int, height: int = 0) -> None | OffsetInWindow:
         if not height:
             height = width
@@ -92,3 +226,175 @@ class Screenshot:
                     print(f"scan_pixel: {offset2.x}, {offset2.y} : {color!s}")
                 if color == expected_color:
                     yield offset2
+
+#=============================================================================
+# Shared capture cache
+
+class MyScreenshotCache:
+    """
+    Share a screenshot between macros (or predicates) called within a short period.
+    A cached screenshot is discarded when it is older than `max_age_ms`,
+    or when any keyboard/mouse input is sent after capture (see `MyInputLock.sequence`).
+    """
+
+    def __init__(self, *, max_age_ms: int = 50):
+        assert max_age_ms >= 0
+        self._max_age_ns = max_age_ms * 1000 * 1000
+        self._entry: tuple[Screenshot, int, int] | None = None # (screenshot, timestamp_ns, input_sequence)
+        self.num_of_hits = 0
+        self.num_of_captures = 0
+
+    def invalidate(self) -> None:
+        self._entry = None
+
+    def put(self, screenshot: Screenshot, timestamp_ns: int, input_sequence: int) -> None:
+        """Store a screenshot captured at `timestamp_ns` (may be called from another thread)."""
+        self._entry = (screenshot, timestamp_ns, input_sequence) # replace at once for thread-safety
+
+    def get(self, *, max_age_ms: int | None = None) -> Screenshot:
+        max_age_ns = self._max_age_ns if max_age_ms is None else max_age_ms * 1000 * 1000
+        now_ns = my_get_monotonic_ns()
+        input_sequence = get_input_lock().sequence
+        entry = self._entry
+        if entry is not None:
+            screenshot, timestamp_ns, sequence = entry
+            if now_ns - timestamp_ns <= max_age_ns and sequence == input_sequence:
+                self.num_of_hits += 1
+                return screenshot
+        screenshot = Screenshot()
+        self.num_of_captures += 1
+        self.put(screenshot, now_ns, input_sequence)
+        return screenshot
+
+_shared_screenshot_cache = MyScreenshotCache()
+
+def get_shared_screenshot(*, max_age_ms: int | None = None) -> Screenshot:
+    """
+    Return a screenshot of active window from the cache shared in this process (see `MyScreenshotCache`).
+    """
+    return _shared_screenshot_cache.get(max_age_ms=max_age_ms)
+
+#=============================================================================
+# Frame watcher
+
+class MyFrameWatcher:
+    """
+    Capture active window periodically in a background thread, only while someone waits for its signals.
+    `frame_signal` is fired for each new frame.
+    A region signal (see `get_region_signal()`) is fired only when pixels in the region are changed
+    (and at the first frame after it is registered, because no baseline is captured before it).
+    While only region signals are waited, only the bounding box of the regions is captured.
+    Otherwise the whole window is captured, and it is shared through `get_shared_screenshot()`.
+    """
+
+    def __init__(self, *, interval_ms: int = 20):
+        assert interval_ms > 0
+        self._interval_ns: Final = interval_ms * 1000 * 1000
+        self.frame_signal: Final = MySignal("frame")
+        self._regions: dict[tuple[int, int, int, int], tuple[MySignal, list[bytes | None]]] = dict()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def get_region_signal(self, rect: MyRect) -> MySignal:
+        """
+        Return a signal which is fired when pixels in `rect` (in client region of active window) are changed.
+        """
+        box = (rect.left, rect.top, rect.right, rect.bottom)
+        with self._lock:
+            if box not in self._regions:
+                self._regions = {**self._regions, box: (MySignal(f"region{box}"), [None])}
+            signal, _ = self._regions[box]
+        self.start()
+        return signal
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="pykmmacro-frame-watcher", daemon=True)
+                self._thread.start()
+
+    def _is_waited(self) -> bool:
+        return self.frame_signal.num_of_waiters > 0 or any(signal.num_of_waiters > 0 for signal, _ in self._regions.values())
+
+    def _run(self) -> None:
+        next_ns = my_get_monotonic_ns()
+        while True:
+            next_ns = max(next_ns + self._interval_ns, my_get_monotonic_ns())
+            my_sleep_ms(max(1, (next_ns - my_get_monotonic_ns()) // (1000 * 1000)))
+            if not self._is_waited():
+                continue # no capture while nobody waits (CPU usage is near zero)
+            input_sequence = get_input_lock().sequence
+            timestamp_ns = my_get_monotonic_ns()
+            regions = self._regions
+            is_whole = self.frame_signal.num_of_waiters > 0
+            try:
+                client = get_active_window_info().client
+                if is_whole:
+                    captured = MyRect(top=0, right=client.width, bottom=client.height, left=0)
+                else:
+                    boxes = [box for box in regions if box[2] <= client.width and box[3] <= client.height]
+                    if not boxes:
+                        continue
+                    captured = MyRect(top=min(box[1] for box in boxes), right=max(box[2] for box in boxes),
+                                      bottom=max(box[3] for box in boxes), left=min(box[0] for box in boxes))
+                # by the same method in both cases (not to detect a difference of methods as a change of pixels)
+                screenshot = Screenshot(region=captured)
+            except Exception: # window may be switching, minimized or resizing now
+                continue
+            if is_whole:
+                _shared_screenshot_cache.put(screenshot, timestamp_ns, input_sequence)
+            for (left, top, right, bottom), (signal, previous) in regions.items():
+                if left < captured.left or top < captured.top or right > captured.right or bottom > captured.bottom:
+                    continue # out of window
+                data = screenshot.image.crop((left - captured.left, top - captured.top, right - captured.left, bottom - captured.top)).tobytes()
+                if data != previous[0]:
+                    previous[0] = data
+                    signal.fire() # also at the first frame (the region may be changed before it)
+            if is_whole:
+                self.frame_signal.fire() # after all regions are compared (a waiter of this frame sees it as their baselines)
+
+_shared_frame_watcher: MyFrameWatcher | None = None
+
+def get_frame_watcher() -> MyFrameWatcher:
+    """
+    Return the frame watcher shared in this process.
+    """
+    global _shared_frame_watcher
+    if _shared_frame_watcher is None:
+        _shared_frame_watcher = MyFrameWatcher()
+    return _shared_frame_watcher
+
+def get_frame_signal() -> MySignal:
+    """
+    Return a signal which is fired for each new frame of active window.
+    """
+    watcher = get_frame_watcher()
+    watcher.start()
+    return watcher.frame_signal
+
+def get_region_signal(rect: MyRect) -> MySignal:
+    """
+    Return a signal which is fired when pixels in `rect` (in client region of active window) are changed.
+    """
+    return get_frame_watcher().get_region_signal(rect)
+
+#=============================================================================
+# Test
+
+def _test_grab_client_region():
+    # on Windows with a still window active (also on a monitor scaled by DPI)
+    import sys
+    from PIL import ImageGrab
+    from .utils import my_assert_eq
+    window_info = get_active_window_info()
+    client = window_info.client
+    region = MyRect(top=client.height // 4, right=client.width * 3 // 4, bottom=client.height * 3 // 4, left=client.width // 4)
+    expected = ImageGrab.grab(window=window_info.hwnd).convert("RGB").crop((region.left, region.top, region.right, region.bottom))
+    image = _grab_client_region(window_info.hwnd, region)
+    my_assert_eq(image.size, expected.size)
+    assert image.tobytes() == expected.tobytes()
+    print(f"OK: {_test_grab_client_region.__name__}()")
+    sys.exit(1)
+
+if False:
+    _test_grab_client_region()
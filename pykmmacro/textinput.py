@@ -0,0 +1,179 @@
+import sys
+from typing import Final, Generator
+
+from .inputdispatch import *
+from .keyboardinput import NormalKey, _ModifierKey, key_press
+from .modifier import MyModifier
+from .utils import *
+from .utils import _NS_PER_MS, _run_blocking
+
+#=============================================================================
+# Constant
+
+_PERIOD_MS_FOR_KEY_HOLD: Final[int] = 6 # same as `key_press()` (max 9ms to avoid key repeat)
+_PERIOD_MS_FOR_KEY_INTERVAL: Final[int] = 4 # between key releases and the next key (typing should be faster than Ctrl+V with clipboard)
+_PERIOD_MS_FOR_SHIFT: Final[int] = 6 # between Shift key and other keys
+
+#=============================================================================
+# Character table (for Japanese keyboard)
+
+def _create_table_for_jis_keyboard() -> dict[str, tuple[NormalKey, MyModifier]]:
+    table: dict[str, tuple[NormalKey, MyModifier]] = dict()
+    for key in NormalKey:
+        keycode = key.keycode
+        if isinstance(keycode, str) and len(keycode) == 1 and keycode.isalnum():
+            table[keycode] = (key, MyModifier.NONE)
+            if keycode.isalpha():
+                table[keycode.upper()] = (key, MyModifier.SHIFT) # assume CapsLock is off
+    for chars, key in (
+        ('1!', NormalKey.One),
+        ('2"', NormalKey.Two),
+        ('3#', NormalKey.Three),
+        ('4$', NormalKey.Four),
+        ('5%', NormalKey.Five),
+        ('6&', NormalKey.Six),
+        ("7'", NormalKey.Seven),
+        ('8(', NormalKey.Eight),
+        ('9)', NormalKey.Nine),
+        ('-=', NormalKey.Hyphen),
+        ('^~', NormalKey.Hat),
+        ('@`', NormalKey.Atmark),
+        ('[{', NormalKey.LeftSquareBracket),
+        (']}', NormalKey.RightSquareBracket),
+        (';+', NormalKey.Semicolon),
+        (':*', NormalKey.Colon),
+        (',<', NormalKey.Comma),
+        ('.>', NormalKey.Period),
+        ('/?', NormalKey.Slash),
+        ('\\_', NormalKey.BackSlash),
+        ('¥|', NormalKey.YenSign), # '\\' is assigned to BackSlash key (both keys input U+005C)
+    ):
+        table[chars[0]] = (key, MyModifier.NONE)
+        table[chars[1]] = (key, MyModifier.SHIFT)
+    table[' '] = (NormalKey.Space, MyModifier.NONE)
+    table['\t'] = (NormalKey.TAB, MyModifier.NONE)
+    table['\n'] = (NormalKey.Enter, MyModifier.NONE)
+    return table
+
+_TABLE_FOR_JIS_KEYBOARD: Final[dict[str, tuple[NormalKey, MyModifier]]] = _create_table_for_jis_keyboard()
+
+def is_typable_by_keys(text: str) -> bool:
+    """
+    Return True if all characters of `text` can be typed by keys of Japanese keyboard (without unicode input).
+    """
+    return all(char in _TABLE_FOR_JIS_KEYBOARD for char in text)
+
+#=============================================================================
+# Private function
+
+def _compile_text(text: str, *, is_unicode_allowed: bool) -> MyCompiledInputSequence:
+    shift_keycode = _ModifierKey.LSHIFT.keycode
+    sequence = MyInputSequence()
+    is_shifted = False
+    for char in text:
+        entry = _TABLE_FOR_JIS_KEYBOARD.get(char)
+        if entry is None:
+            if not is_unicode_allowed:
+                raise MyError(f"not typable by keys: {char!r}")
+            if is_shifted:
+                sequence.key_up(shift_keycode)
+                sequence.sleep(_PERIOD_MS_FOR_SHIFT, variation_ratio=0.4)
+                is_shifted = False
+            sequence.unicode_down(char)
+            sequence.sleep(_PERIOD_MS_FOR_KEY_HOLD, variation_ratio=2/6)
+            sequence.unicode_up(char)
+        else:
+            key, modifiers = entry
+            if bool(modifiers) != is_shifted:
+                if is_shifted:
+                    sequence.key_up(shift_keycode)
+                else:
+                    sequence.key_down(shift_keycode)
+                sequence.sleep(_PERIOD_MS_FOR_SHIFT, variation_ratio=0.4)
+                is_shifted = not is_shifted
+            sequence.key_down(key.keycode)
+            sequence.sleep(_PERIOD_MS_FOR_KEY_HOLD, variation_ratio=2/6)
+            sequence.key_up(key.keycode)
+        sequence.sleep(_PERIOD_MS_FOR_KEY_INTERVAL, variation_ratio=0.4)
+    if is_shifted:
+        sequence.key_up(shift_keycode)
+    return sequence.compile()
+
+#=============================================================================
+# Public functions
+
+def g_type_text(text: str, /, *, is_unicode_allowed: bool = True) -> Generator[MyWaitRequest | None]:
+    """
+    Type text by keys (generator version of `type_text()`).
+    """
+    print(f"type_text: {text!r}")
+    yield from g_send_input_sequence(_compile_text(text, is_unicode_allowed=is_unicode_allowed))
+
+def type_text(text: str, /, *, is_unicode_allowed: bool = True) -> None:
+    """
+    Type text by keys of Japanese keyboard (without clipboard).
+    A character not on the keyboard is input by its code (unicode input) if `is_unicode_allowed` is True.
+    Otherwise, `MyError` is raised before any key is pressed (use `is_typable_by_keys()` to check in advance).
+    Key strokes are interpreted by IME, so IME should be off.
+    This function is synchronous (blocking) API (see `g_type_text()`).
+    """
+    print(f"type_text: {text!r}")
+    send_input_sequence(_compile_text(text, is_unicode_allowed=is_unicode_allowed))
+
+#=============================================================================
+# Test
+
+def _test_type_text():
+    import time
+    assert is_typable_by_keys("ac Basic Synthesis")
+    assert not is_typable_by_keys("ac 作業")
+    recorder = MyRecordingInputDispatcher()
+    previous_dispatcher = set_input_dispatcher(recorder)
+    previous_clock = set_clock(MyVirtualClock())
+    try:
+        start_ns = my_get_monotonic_ns()
+        type_text("aB|\n")
+        elapsed_ms = (my_get_monotonic_ns() - start_ns) / _NS_PER_MS
+        codes = [(event.kind.name, event.code) for _, event in recorder.get_events()]
+        print(f"{codes=}")
+        my_assert_eq(codes, [
+            ('KEY_DOWN', 'a'), ('KEY_UP', 'a'),
+            ('KEY_DOWN', 'shiftleft'), ('KEY_DOWN', 'b'), ('KEY_UP', 'b'), ('KEY_DOWN', NormalKey.YenSign.keycode), ('KEY_UP', NormalKey.YenSign.keycode),
+            ('KEY_UP', 'shiftleft'), ('KEY_DOWN', 'enter'), ('KEY_UP', 'enter'),
+        ])
+        print(f"typing 4 chars: {elapsed_ms:.1f}ms (simulated)")
+        recorder.clear()
+        type_text("作\U0001F600")
+        my_assert_eq([(event.kind, event.code) for _, event in recorder.get_events()], [
+            (MyInputEventKind.UNICODE_DOWN, '作'), (MyInputEventKind.UNICODE_UP, '作'),
+            (MyInputEventKind.UNICODE_DOWN, '\uD83D'), (MyInputEventKind.UNICODE_DOWN, '\uDE00'),
+            (MyInputEventKind.UNICODE_UP, '\uD83D'), (MyInputEventKind.UNICODE_UP, '\uDE00'),
+        ])
+        try:
+            type_text("作", is_unicode_allowed=False)
+            assert False
+        except MyError:
+            pass
+        # typed vs pasted (without the cost of clipboard)
+        command = "ac Basic Synthesis"
+        start_ns = my_get_monotonic_ns()
+        type_text(command)
+        typed_ms = (my_get_monotonic_ns() - start_ns) / _NS_PER_MS
+        start_ns = my_get_monotonic_ns()
+        key_press(NormalKey.V, MyModifier.CTRL)
+        pasted_ms = (my_get_monotonic_ns() - start_ns) / _NS_PER_MS
+        print(f"{command!r}: typed {typed_ms:.1f}ms vs pasted {pasted_ms:.1f}ms (simulated)")
+        assert typed_ms < pasted_ms
+    finally:
+        set_clock(previous_clock)
+        set_input_dispatcher(previous_dispatcher)
+    num_of_texts = 1000
+    start_ns = time.perf_counter_ns()
+    for _ in range(num_of_texts):
+        _compile_text("ac Basic Synthesis", is_unicode_allowed=True)
+    print(f"cost of compile: {(time.perf_counter_ns() - start_ns) / num_of_texts / 1000:.3f}us/text")
+    print(f"OK: {_test_type_text.__name__}()")
+    sys.exit(1)
+
+if False:
+    _test_type_text()
@@ -0,0 +1,199 @@
+from array import array
+import atexit
+import os
+import sys
+import time
+from typing import Final, TextIO
+
+#=============================================================================
+# Constant
+
+_NUM_OF_SUB_BUCKETS_BITS: Final[int] = 2 # 4 buckets per octave (max error is about 19%)
+_NUM_OF_SUB_BUCKETS: Final[int] = 1 << _NUM_OF_SUB_BUCKETS_BITS
+_NUM_OF_BUCKETS: Final[int] = 44 * _NUM_OF_SUB_BUCKETS # up to 2**44 ns (about 4.9 hours)
+
+_NS_PER_MS: Final[int] = 1000 * 1000
+
+_DIRECTORY_OF_PACKAGE: Final[str] = os.path.dirname(os.path.abspath(__file__))
+
+#=============================================================================
+# Log-bucketed histogram
+
+def _get_bucket_index(value_ns: int) -> int:
+    if value_ns < 2 * _NUM_OF_SUB_BUCKETS:
+        return max(0, value_ns) # linear buckets for tiny values
+    n = value_ns.bit_length()
+    index = (n - _NUM_OF_SUB_BUCKETS_BITS) * _NUM_OF_SUB_BUCKETS + ((value_ns >> (n - _NUM_OF_SUB_BUCKETS_BITS - 1)) & (_NUM_OF_SUB_BUCKETS - 1))
+    return min(index, _NUM_OF_BUCKETS - 1)
+
+def _get_bucket_lower_bound(index: int) -> int:
+    if index < 2 * _NUM_OF_SUB_BUCKETS:
+        return index
+    n = index // _NUM_OF_SUB_BUCKETS + _NUM_OF_SUB_BUCKETS_BITS
+    sub = index % _NUM_OF_SUB_BUCKETS
+    return (_NUM_OF_SUB_BUCKETS + sub) << (n - _NUM_OF_SUB_BUCKETS_BITS - 1)
+
+class MyHistogram:
+    """
+    Streaming histogram of durations (in nanoseconds) with logarithmic buckets.
+    Memory usage is fixed regardless of the number of samples.
+    """
+
+    def __init__(self):
+        self.counts: Final = array('Q', bytes(8 * _NUM_OF_BUCKETS))
+        self.num_of_samples = 0
+        self.max_ns = 0
+
+    def add(self, value_ns: int) -> None:
+        self.counts[_get_bucket_index(value_ns)] += 1
+        self.num_of_samples += 1
+        if value_ns > self.max_ns:
+            self.max_ns = value_ns
+
+    def get_percentile_ns(self, ratio: float) -> int:
+        """
+        Return the upper bound of the bucket which includes the percentile (`ratio` is in [0, 1]).
+        """
+        assert 0.0 <= ratio and ratio <= 1.0
+        if self.num_of_samples == 0:
+            return 0
+        threshold = ratio * self.num_of_samples
+        accumulated = 0
+        for index, count in enumerate(self.counts):
+            accumulated += count
+            if count and accumulated >= threshold:
+                return min(_get_bucket_lower_bound(index + 1), self.max_ns)
+        return self.max_ns
+
+#=============================================================================
+# Timing statistics
+
+class MyTimingStat:
+    """
+    Requested and actual durations of an operation (such as sleep, wait and capture) at a call site.
+    "excess" is the actual duration beyond the requested one (oversleep).
+    """
+
+    def __init__(self, kind: str, site: str):
+        self.kind: Final = kind
+        self.site: Final = site
+        self.total_requested_ns = 0
+        self.total_actual_ns = 0
+        self.actual: Final = MyHistogram()
+        self.excess: Final = MyHistogram()
+
+    def __str__(self):
+        count = max(1, self.actual.num_of_samples)
+        return (f"{self.kind} {self.site}: count={self.actual.num_of_samples} "
+                f"requested={self.total_requested_ns / count / _NS_PER_MS:.3f}ms actual={self.total_actual_ns / count / _NS_PER_MS:.3f}ms "
+                f"excess(p50/p99/max)={self.excess.get_percentile_ns(0.5) / _NS_PER_MS:.3f}/"
+                f"{self.excess.get_percentile_ns(0.99) / _NS_PER_MS:.3f}/{self.excess.max_ns / _NS_PER_MS:.3f}ms")
+
+    def record(self, requested_ns: int, actual_ns: int) -> None:
+        self.total_requested_ns += requested_ns
+        self.total_actual_ns += actual_ns
+        self.actual.add(actual_ns)
+        self.excess.add(actual_ns - requested_ns)
+
+#=============================================================================
+# Timing recorder
+
+def _get_caller_site() -> str:
+    # the nearest frame outside of this package (such as a line of a macro)
+    frame = sys._getframe(2)
+    while frame.f_back is not None and frame.f_code.co_filename.startswith(_DIRECTORY_OF_PACKAGE):
+        frame = frame.f_back
+    return f"{frame.f_code.co_filename}:{frame.f_lineno}"
+
+class MyTimingRecorder:
+    """
+    Record requested and actual durations of sleeps, waits, captures and inputs for each call site.
+    Enable it by `enable_timing_recorder()` (nothing is recorded while disabled).
+    """
+
+    def __init__(self):
+        self._table: Final[dict[tuple[str, str], MyTimingStat]] = dict()
+
+    def record(self, kind: str, requested_ns: int, actual_ns: int, /, *, site: str | None = None) -> None:
+        """
+        `site` is the caller of the pykmmacro API if not specified.
+        """
+        if site is None:
+            site = _get_caller_site()
+        key = (kind, site)
+        stat = self._table.get(key)
+        if stat is None:
+            stat = MyTimingStat(kind, site)
+            self._table[key] = stat
+        stat.record(requested_ns, actual_ns)
+
+    def get_all_stats(self) -> list[MyTimingStat]:
+        return list(self._table.values())
+
+    def dump(self, file: TextIO | None = None) -> None:
+        """
+        Print a summary for each kind, then statistics of each call site (sorted by total actual duration).
+        """
+        if file is None:
+            file = sys.stderr
+        stats = sorted(self._table.values(), key=lambda stat: (stat.kind, -stat.total_actual_ns))
+        print("===== timing summary =====", file=file)
+        for kind in sorted(set(stat.kind for stat in stats)):
+            requested_ns = sum(stat.total_requested_ns for stat in stats if stat.kind == kind)
+            actual_ns = sum(stat.total_actual_ns for stat in stats if stat.kind == kind)
+            count = sum(stat.actual.num_of_samples for stat in stats if stat.kind == kind)
+            print(f"{kind}: count={count} requested={requested_ns / 1e9:.3f}s actual={actual_ns / 1e9:.3f}s excess={(actual_ns - requested_ns) / 1e9:.3f}s", file=file)
+        for stat in stats:
+            print(f"  {stat}", file=file)
+
+# `None` while disabled (check this variable before calling `record()` to make zero overhead)
+active_timing_recorder: MyTimingRecorder | None = None
+
+def enable_timing_recorder(*, dump_at_exit: bool = True) -> MyTimingRecorder:
+    """
+    Start recording, and return the recorder.
+    If `dump_at_exit` is True, a summary is printed at exit of this process.
+    """
+    global active_timing_recorder
+    if active_timing_recorder is None:
+        active_timing_recorder = MyTimingRecorder()
+        if dump_at_exit:
+            atexit.register(active_timing_recorder.dump)
+    return active_timing_recorder
+
+def disable_timing_recorder() -> None:
+    global active_timing_recorder
+    active_timing_recorder = None
+
+def get_timing_recorder() -> MyTimingRecorder | None:
+    return active_timing_recorder
+
+#=============================================================================
+# Test
+
+def _test_timing_recorder():
+    for value_ns in (0, 1, 7, 8, 9, 15, 16, 1000, 123456789, 2**43):
+        index = _get_bucket_index(value_ns)
+        assert _get_bucket_lower_bound(index) <= value_ns < _get_bucket_lower_bound(index + 1), (value_ns, index)
+    histogram = MyHistogram()
+    for value_ns in range(1, 1001):
+        histogram.add(value_ns * 1000)
+    p50 = histogram.get_percentile_ns(0.5)
+    print(f"{p50=}")
+    assert 500 * 1000 <= p50 <= 500 * 1000 * 1.2
+    recorder = MyTimingRecorder()
+    for _ in range(100):
+        recorder.record("sleep", 5 * _NS_PER_MS, 6 * _NS_PER_MS, site="test:1")
+    recorder.record("capture", 0, 30 * _NS_PER_MS, site="test:2")
+    assert len(recorder.get_all_stats()) == 2
+    recorder.dump(sys.stdout)
+    num_of_records = 100 * 1000
+    start_ns = time.perf_counter_ns()
+    for _ in range(num_of_records):
+        recorder.record("sleep", 5 * _NS_PER_MS, 6 * _NS_PER_MS)
+    print(f"cost of record(): {(time.perf_counter_ns() - start_ns) / num_of_records / 1000:.3f}us")
+    print(f"OK: {_test_timing_recorder.__name__}()")
+    sys.exit(1)
+
+if False:
+    _test_timing_recorder()
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+from array import array
+import functools
+import math
+import sys
+from typing import Final
+
+from .humanize import get_humanize_rng
+from .inputdispatch import *
+from .utils import _NS_PER_MS
+
+#=============================================================================
+# Constant
+
+_INTERVAL_MS_FOR_TRAJECTORY: Final[int] = 8 # playback rate (125Hz)
+
+# duration of a move follows Fitts' law (a + b * log2(1 + distance / width))
+_DURATION_MS_FOR_FITTS_A: Final[float] = 80.0
+_DURATION_MS_FOR_FITTS_B: Final[float] = 100.0
+_WIDTH_FOR_FITTS: Final[float] = 20.0
+_SIGMA_FOR_DURATION: Final[float] = 0.15 # of logarithm
+_RATIO_FOR_CURVATURE: Final[float] = 0.12 # sigma of displacement of control points (relative to distance)
+
+_SIZE_OF_BUCKET: Final[int] = 16 # pixels (moves between the same buckets share trajectories)
+_NUM_OF_VARIANTS_PER_BUCKET: Final[int] = 4
+
+#=============================================================================
+# Trajectory
+
+@functools.cache
+def _get_bernstein_weights(num_of_points: int) -> tuple[array[float], array[float], array[float], array[float]]:
+    # weights of the control points of cubic Bezier curve at each point
+    # the curve parameter follows minimum-jerk profile (10t^3 - 15t^4 + 6t^5) to ease in and out
+    b0, b1, b2, b3 = array('d'), array('d'), array('d'), array('d')
+    for i in range(1, num_of_points + 1):
+        t = i / num_of_points
+        s = t * t * t * (10 + t * (-15 + t * 6))
+        u = 1 - s
+        b0.append(u * u * u)
+        b1.append(3 * u * u * s)
+        b2.append(3 * u * s * s)
+        b3.append(s * s * s)
+    return b0, b1, b2, b3
+
+def _create_trajectory(start: tuple[int, int], end: tuple[int, int]) -> tuple[tuple[int, ...], tuple[MyInputEvent, ...], int]:
+    rng = get_humanize_rng()
+    x0, y0 = start
+    x3, y3 = end
+    dx, dy = x3 - x0, y3 - y0
+    distance = math.hypot(dx, dy)
+    duration_ms = (_DURATION_MS_FOR_FITTS_A + _DURATION_MS_FOR_FITTS_B * math.log2(1 + distance / _WIDTH_FOR_FITTS)) * rng.lognormal(0.0, _SIGMA_FOR_DURATION)
+    num_of_points = max(1, round(duration_ms / _INTERVAL_MS_FOR_TRAJECTORY))
+    # control points are displaced perpendicularly to make a curve (usually bending to one side)
+    sigma = _RATIO_FOR_CURVATURE * distance
+    bend1 = rng.truncated_normal(0.0, sigma, -2 * sigma, 2 * sigma)
+    bend2 = rng.truncated_normal(bend1, sigma / 2, -2 * sigma, 2 * sigma)
+    nx, ny = (-dy / distance, dx / distance) if distance else (0.0, 0.0)
+    x1, y1 = x0 + dx / 3 + nx * bend1, y0 + dy / 3 + ny * bend1
+    x2, y2 = x0 + dx * 2 / 3 + nx * bend2, y0 + dy * 2 / 3 + ny * bend2
+    b0, b1, b2, b3 = _get_bernstein_weights(num_of_points)
+    xs = [round(w0 * x0 + w1 * x1 + w2 * x2 + w3 * x3) for w0, w1, w2, w3 in zip(b0, b1, b2, b3)]
+    ys = [round(w0 * y0 + w1 * y1 + w2 * y2 + w3 * y3) for w0, w1, w2, w3 in zip(b0, b1, b2, b3)]
+    interval_ns = _INTERVAL_MS_FOR_TRAJECTORY * _NS_PER_MS
+    offsets_ns: list[int] = []
+    events: list[MyInputEvent] = []
+    previous = start
+    for i, point in enumerate(zip(xs[:-1], ys[:-1])): # the last point is the exact end (added for each use)
+        if point != previous and point != end: # skip a point without move
+            offsets_ns.append((i + 1) * interval_ns)
+            events.append(get_mouse_move_event(*point))
+            previous = point
+    return tuple(offsets_ns), tuple(events), num_of_points * interval_ns
+
+_cache_for_trajectory: Final[dict[tuple[int, int, int, int], list[tuple[tuple[int, ...], tuple[MyInputEvent, ...], int]]]] = dict()
+
+def get_mouse_trajectory(start: tuple[int, int], end: tuple[int, int], /) -> MyCompiledInputSequence:
+    """
+    Return a sequence to move mouse cursor from `start` to `end` (position in screen) along a human-like curve.
+    A curve is eased in and out (minimum jerk), and its duration depends on the distance (Fitts' law).
+    Curves are cached for each pair of buckets of `start` and `end`, and a few variants are chosen randomly.
+    Intermediate points may be off by a bucket size, but the last point is always `end`.
+    """
+    key = (start[0] // _SIZE_OF_BUCKET, start[1] // _SIZE_OF_BUCKET, end[0] // _SIZE_OF_BUCKET, end[1] // _SIZE_OF_BUCKET)
+    variants = _cache_for_trajectory.get(key)
+    if variants is None:
+        variants = []
+        _cache_for_trajectory[key] = variants
+    if len(variants) < _NUM_OF_VARIANTS_PER_BUCKET:
+        variants.append(_create_trajectory(start, end))
+        offsets_ns, events, period_ns = variants[-1]
+    else:
+        offsets_ns, events, period_ns = variants[int(get_humanize_rng().uniform() * len(variants))]
+    return MyCompiledInputSequence(offsets_ns + (period_ns,), events + (get_mouse_move_event(*end),), period_ns)
+
+#=============================================================================
+# Test
+
+def _test_mouse_trajectory():
+    import time
+    start, end = (100, 900), (1500, 300)
+    sequence = get_mouse_trajectory(start, end)
+    points = [(event.x, event.y) for event in sequence.events]
+    print(f"{len(points)} points in {sequence.period_ns / _NS_PER_MS:.0f}ms: {points[:3]} ... {points[-3:]}")
+    assert points[-1] == end
+    assert all(event.kind == MyInputEventKind.MOUSE_MOVE_TO for event in sequence.events)
+    steps = [math.hypot(b[0] - a[0], b[1] - a[1]) for a, b in zip(points, points[1:])]
+    assert max(steps[:3]) < max(steps) and max(steps[-3:]) < max(steps) # eased in and out
+    for _ in range(_NUM_OF_VARIANTS_PER_BUCKET):
+        get_mouse_trajectory((start[0] + 1, start[1] + 1), (end[0] + 1, end[1] + 1))
+    assert len(_cache_for_trajectory) == 1
+    num_of_moves = 10 * 1000
+    start_ns = time.perf_counter_ns()
+    for _ in range(num_of_moves):
+        assert get_mouse_trajectory(start, end).events[-1] == get_mouse_move_event(*end)
+    print(f"cost of cached trajectory: {(time.perf_counter_ns() - start_ns) / num_of_moves / 1000:.3f}us/move")
+    start_ns = time.perf_counter_ns()
+    for _ in range(1000):
+        _create_trajectory(start, end)
+    print(f"cost of new trajectory: {(time.perf_counter_ns() - start_ns) / 1000 / 1000:.3f}us/move")
+    print(f"OK: {_test_mouse_trajectory.__name__}()")
+    sys.exit(1)
+
+if False:
+    _test_mouse_trajectory()
@@ -1,11 +1,20 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
+import contextlib
 import dataclasses
+import enum
+import heapq
 import itertools
 import random
+import sys
+import threading
 import time
-from typing import Any, Callable, Final, Generator, Iterable, Self
+from typing import Any, Callable, Final, Generator, Iterable, Iterator, Self
+
+from . import timingstat as _timingstat
+from .humanize import get_humanize_rng
+from .pollingstat import get_polling_stat
 
 #=============================================================================
 # Constant
@@ -14,6 +23,10 @@ _DELAY_MS_FOR_A_MOMENT: Final[int] = 100
 _DELAY_MS_FOR_ENSURE: Final[int] = 300
 _DELAY_MS_FOR_A_TICK: Final[int] = 50
 
+_NS_PER_MS: Final[int] = 1000 * 1000
+_DELAY_NS_FOR_SPIN: Final[int] = 1 * _NS_PER_MS # busy-wait at last to make sub-millisecond precision
+_INTERVAL_NS_FOR_EVENTS: Final[int] = 1 * _NS_PER_MS # to check other events while waiting for one of them
+
 #=============================================================================
 # Exception
 
@@ -26,6 +39,12 @@ class MyFailAlwaysError(MyError):
 class MyTimeoutError(MyError):
     pass
 
+class MyAbortError(MyError):
+    """
+    Thrown into macro generators when abort is requested (see `my_request_abort()`).
+    """
+    pass
+
 #=============================================================================
 # Private functions
 
@@ -57,80 +76,868 @@ def my_random() -> float:
     """
     use the average as *approximate* Gaussian random value
     https://k11i.biz/blog/2016/11/05/approximate-gaussian-rng/
+    The same distribution is drawn from the shared humanization RNG (see `MyHumanizeRng`).
     """
-    num = 100 # with no foundation
-    acc = 0.0
-    for _ in range(num):
-        acc += random.random()
-    result = acc / num
+    result = get_humanize_rng().approx_gaussian()
     assert 0.0 <= result and result < 1.0
     return result
 
+#=============================================================================
+# Clock
+
+class MyClock:
+    """
+    Interface of the clock used by all sleeps, waits, timeouts and timestamps in this package.
+    Replace it by `set_clock()` (such as `MyVirtualClock` for simulation).
+    """
+
+    def monotonic_ns(self) -> int:
+        """Return the value of monotonic clock (see `my_get_monotonic_ns()`)."""
+        raise NotImplementedError
+
+    def time_ns(self) -> int:
+        """Return the wall-clock time since the epoch."""
+        raise NotImplementedError
+
+    def sleep_until_ns(self, deadline_ns: int, /, *, is_precise: bool = True, wakeup_event: threading.Event | None = None) -> bool:
+        """
+        Sleep until the deadline on monotonic clock.
+        If `wakeup_event` is set while sleeping, return False immediately.
+        """
+        raise NotImplementedError
+
+    def wait_event(self, event: threading.Event, timeout_ns: int | None = None) -> bool:
+        """Wait until `event` is set (or timeout), and return whether `event` is set."""
+        raise NotImplementedError
+
+class MyRealClock(MyClock):
+    def monotonic_ns(self) -> int:
+        return time.perf_counter_ns()
+
+    def time_ns(self) -> int:
+        return time.time_ns()
+
+    def sleep_until_ns(self, deadline_ns: int, /, *, is_precise: bool = True, wakeup_event: threading.Event | None = None) -> bool:
+        # If `is_precise` is True, busy-wait at last to make sub-millisecond precision.
+        margin_ns = _DELAY_NS_FOR_SPIN if is_precise else 0
+        while (remaining_ns := deadline_ns - time.perf_counter_ns()) > margin_ns:
+            if wakeup_event is None:
+                time.sleep((remaining_ns - margin_ns) / 1e9)
+            elif wakeup_event.wait((remaining_ns - margin_ns) / 1e9):
+                return False
+        while time.perf_counter_ns() < deadline_ns:
+            pass
+        return True
+
+    def wait_event(self, event: threading.Event, timeout_ns: int | None = None) -> bool:
+        return event.wait(None if timeout_ns is None else max(0, timeout_ns) / 1e9)
+
+class MyVirtualClock(MyClock):
+    """
+    Simulated clock which advances instantly when sleeping.
+    Macros (with fake input/capture) can run thousands of times faster than real time.
+    Only waits without timeout for an event (set by another thread) take real time.
+    """
+
+    def __init__(self, *, start_ns: int | None = None, epoch_ns: int | None = None):
+        self._now_ns = time.perf_counter_ns() if start_ns is None else start_ns
+        self._offset_for_epoch_ns = (time.time_ns() if epoch_ns is None else epoch_ns) - self._now_ns
+        self._lock: Final = threading.Lock()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(now={self._now_ns}ns)"
+
+    def advance_ns(self, period_ns: int) -> None:
+        assert period_ns >= 0
+        with self._lock:
+            self._now_ns += period_ns
+
+    def monotonic_ns(self) -> int:
+        return self._now_ns
+
+    def time_ns(self) -> int:
+        return self._now_ns + self._offset_for_epoch_ns
+
+    def sleep_until_ns(self, deadline_ns: int, /, *, is_precise: bool = True, wakeup_event: threading.Event | None = None) -> bool:
+        if wakeup_event is not None and wakeup_event.is_set():
+            return False
+        with self._lock:
+            self._now_ns = max(self._now_ns, deadline_ns)
+        return True
+
+    def wait_event(self, event: threading.Event, timeout_ns: int | None = None) -> bool:
+        if event.is_set():
+            return True
+        if timeout_ns is None:
+            return event.wait() # nothing to simulate (only another thread can set it)
+        self.advance_ns(max(0, timeout_ns))
+        return event.is_set()
+
+_clock: MyClock = MyRealClock()
+
+def get_clock() -> MyClock:
+    """
+    Return the clock used in this process.
+    """
+    return _clock
+
+def set_clock(clock: MyClock) -> MyClock:
+    """
+    Replace the clock used in this process, and return the previous one.
+    """
+    global _clock
+    previous = _clock
+    _clock = clock
+    return previous
+
 #=============================================================================
 # Time
 
 def my_get_str_timestamp() -> str:
-    return time.strftime("%Y/%m/%d %H:%M:%S")
+    return time.strftime("%Y/%m/%d %H:%M:%S", time.localtime(_clock.time_ns() / 1e9))
 
 def my_get_timestamp_ms() -> int:
-    return time.time_ns() // (1000 * 1000)
+    return _clock.time_ns() // _NS_PER_MS
 
-def my_sleep_ms(period_ms: int):
-    assert period_ms > 0
-    time.sleep(period_ms / 1000)
+def my_get_monotonic_ns() -> int:
+    """
+    Return the value of monotonic clock (high resolution).
+    Use this clock to measure a period because it is not affected by clock adjustment.
+    """
+    return _clock.monotonic_ns()
 
-def my_sleep_with_random(period_ms: int, /, *, variation_ratio: float = 0.4):
+def _sleep_until_ns(deadline_ns: int, /, *, is_precise: bool = True, wakeup_event: threading.Event | None = None) -> bool:
+    """
+    Sleep until the deadline on monotonic clock.
+    If `is_precise` is True, busy-wait at last to make sub-millisecond precision.
+    If `wakeup_event` is set while sleeping, return False immediately.
+    """
+    return _clock.sleep_until_ns(deadline_ns, is_precise=is_precise, wakeup_event=wakeup_event)
+
+def _get_period_ms_with_random(period_ms: int, variation_ratio: float) -> float:
     assert period_ms > 0
     assert 0 <= variation_ratio and variation_ratio < 1.0
     variation = period_ms * variation_ratio # may be zero
-    period = period_ms - variation / 2 + variation * my_random()
-    time.sleep(period / 1000) # use `time.sleep()` directly to make leaf period (<=1ms) effective
+    return period_ms - variation / 2 + variation * my_random()
+
+def my_sleep_ms(period_ms: int):
+    assert period_ms > 0
+    start_ns = my_get_monotonic_ns()
+    _sleep_until_ns(start_ns + period_ms * _NS_PER_MS)
+    if (recorder := _timingstat.active_timing_recorder) is not None:
+        recorder.record("sleep", period_ms * _NS_PER_MS, my_get_monotonic_ns() - start_ns)
+
+def my_sleep_with_random(period_ms: int, /, *, variation_ratio: float = 0.4):
+    period_ns = int(_get_period_ms_with_random(period_ms, variation_ratio) * _NS_PER_MS) # sub-millisecond period is effective
+    start_ns = my_get_monotonic_ns()
+    _sleep_until_ns(start_ns + period_ns)
+    if (recorder := _timingstat.active_timing_recorder) is not None:
+        recorder.record("sleep", period_ns, my_get_monotonic_ns() - start_ns)
 
 def my_sleep_a_moment():
     my_sleep_with_random(_DELAY_MS_FOR_A_MOMENT, variation_ratio=0.2)
 
-def g_sleep_with_random(period_ms: int, /, *, variation_ratio: float = 0.4) -> Generator[None]:
-    assert period_ms > 0
-    assert 0 <= variation_ratio and variation_ratio < 1.0
-    variation = period_ms * variation_ratio # may be zero
-    period = period_ms - variation / 2 + variation * my_random()
-    limit = my_get_timestamp_ms() + period
-    while (now := my_get_timestamp_ms()) < limit - _DELAY_MS_FOR_A_TICK:
-        yield
-        my_sleep_ms(_DELAY_MS_FOR_A_TICK)
-    yield # use `yield` at least once to avoid long time blocking
-    period_at_last = limit - now
-    if period_at_last > 0:
-        time.sleep(period_at_last / 1000) # use `time.sleep()` directly to make leaf period (<=1ms) effective
+def g_sleep_with_random(period_ms: int, /, *, variation_ratio: float = 0.4) -> Generator[MyWaitRequest | None]:
+    period_ns = int(_get_period_ms_with_random(period_ms, variation_ratio) * _NS_PER_MS)
+    start_ns = my_get_monotonic_ns()
+    yield from g_wait_for(MyWaitRequest(deadline_ns=start_ns + period_ns))
+    if (recorder := _timingstat.active_timing_recorder) is not None:
+        recorder.record("g_sleep", period_ns, my_get_monotonic_ns() - start_ns)
 
-def g_sleep(period_ms: int) -> Generator[None]:
+def g_sleep(period_ms: int) -> Generator[MyWaitRequest | None]:
     yield from g_sleep_with_random(period_ms, variation_ratio=0.0)
 
-def g_sleep_a_moment() -> Generator[None]:
+def g_sleep_a_moment() -> Generator[MyWaitRequest | None]:
     yield from g_sleep_with_random(_DELAY_MS_FOR_A_MOMENT, variation_ratio=0.2)
 
-def g_sleep_to_ensure() -> Generator[None]:
+def g_sleep_to_ensure() -> Generator[MyWaitRequest | None]:
     yield from g_sleep_with_random(_DELAY_MS_FOR_ENSURE, variation_ratio=0.2)
 
-def g_with_timeout(timeout_ms: int, func: Callable[Any, Any], *args, **kwargs) -> Generator[None, Any]: # type: ignore
+def _get_call_site(depth: int) -> str:
+    frame = sys._getframe(depth + 1)
+    return f"{frame.f_code.co_filename}:{frame.f_lineno}"
+
+def _g_with_timeout_at(site: str, timeout_ms: int, func: Callable[Any, Any], args: Any, kwargs: Any) -> Generator[MyWaitRequest | None, Any]: # type: ignore
     # NOTE: `func` should not be a generator.
     assert timeout_ms > 0
-    limit = my_get_timestamp_ms() + timeout_ms
+    dependencies = _get_dependencies(func)
+    stat = get_polling_stat(site)
+    start = my_get_monotonic_ns()
+    limit = start + timeout_ms * _NS_PER_MS
+    paused_ns = _paused_ns
     while True:
+        if paused_ns != _paused_ns:
+            # extend the timeout by the duration of pauses (see `my_request_pause()`)
+            start += _paused_ns - paused_ns
+            limit += _paused_ns - paused_ns
+            paused_ns = _paused_ns
         # call `func()` before timeout judgement
-        timestamp = my_get_timestamp_ms() # capture this timing (before calling `func`)
+        timestamp = my_get_monotonic_ns() # capture this timing (before calling `func`)
+        request = MyWaitRequest.on_signals(dependencies, deadline_ns=limit) if dependencies else None # capture versions before calling `func`
         ret = func(*args, **kwargs)
+        now = my_get_monotonic_ns()
+        stat.record_evaluation((now - timestamp) / _NS_PER_MS)
+        if (recorder := _timingstat.active_timing_recorder) is not None:
+            recorder.record("predicate", 0, now - timestamp, site=site)
+            if ret is not None or timestamp > limit:
+                recorder.record("wait", 0, now - start, site=site)
         if ret is not None:
+            stat.record_success((timestamp - start) / _NS_PER_MS)
             return ret
         if timestamp > limit:
+            stat.record_timeout()
             raise MyTimeoutError(f"{timeout_ms=} / {func.__name__}()")
-        yield from g_sleep(_DELAY_MS_FOR_A_TICK)
+        if request is None:
+            interval_ms = stat.get_next_interval_ms((now - start) / _NS_PER_MS)
+            request = MyWaitRequest(deadline_ns=min(limit, now + int(interval_ms * _NS_PER_MS)))
+        yield from g_wait_for(request)
+
+def g_with_timeout(timeout_ms: int, func: Callable[Any, Any], *args, **kwargs) -> Generator[MyWaitRequest | None, Any]: # type: ignore
+    """
+    Call `func` repeatedly until it returns non-None value, and return the value.
+    If `func` declares its dependencies (see `my_depends_on()`), `func` is called again only when
+    one of them is fired. Otherwise the polling interval is adapted to the history of this call site
+    (see `MyPollingStat`).
+    """
+    return (yield from _g_with_timeout_at(_get_call_site(1), timeout_ms, func, args, kwargs))
 
 def g_with_timeout_until(timeout_ms: int, func: Callable[Any, Any], *args, **kwargs): # type: ignore
-    yield from g_with_timeout(timeout_ms, lambda: func(*args, **kwargs) or None)
+    predicate = my_depends_on(*_get_dependencies(func))(lambda: func(*args, **kwargs) or None)
+    return (yield from _g_with_timeout_at(_get_call_site(1), timeout_ms, predicate, (), {}))
 
 def g_with_timeout_while(timeout_ms: int, func: Callable[Any, Any], *args, **kwargs): # type: ignore
-    yield from g_with_timeout_until(timeout_ms, lambda: not func(*args, **kwargs))
+    predicate = my_depends_on(*_get_dependencies(func))(lambda: (not func(*args, **kwargs)) or None)
+    return (yield from _g_with_timeout_at(_get_call_site(1), timeout_ms, predicate, (), {}))
+
+#=============================================================================
+# Signal
+
+# set when any signal is fired (to wake up the scheduler from sleep)
+_wakeup_event: Final = threading.Event()
+
+class MySignal:
+    """
+    Notification source which a predicate can depend on (see `my_depends_on()`),
+    such as frame arrival, region change, input events and window change.
+    `fire()` can be called from any thread (such as a listener thread).
+    `num_of_waiters` tells the source whether someone waits for it now.
+    """
+
+    def __init__(self, name: str):
+        self.name: Final = name
+        self.version = 0
+        self.num_of_waiters = 0
+        self._callbacks: list[Callable[[], Any]] = []
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.name!r}, version={self.version}, waiters={self.num_of_waiters})"
+
+    def fire(self) -> None:
+        with self._lock:
+            self.version += 1
+            callbacks = self._callbacks
+        _wakeup_event.set()
+        for callback in callbacks:
+            callback()
+
+    def subscribe(self, callback: Callable[[], Any]) -> None:
+        """Call `callback` (in the thread which fires this signal) for each `fire()`."""
+        with self._lock:
+            self._callbacks = [*self._callbacks, callback]
+
+    def unsubscribe(self, callback: Callable[[], Any]) -> None:
+        with self._lock:
+            callbacks = list(self._callbacks)
+            callbacks.remove(callback)
+            self._callbacks = callbacks
+
+def my_depends_on[F: Callable[..., Any]](*signals: MySignal) -> Callable[[F], F]:
+    """
+    Declare signals which may change the result of a predicate (decorator).
+    Waits such as `g_with_timeout()` evaluate the predicate again only when one of the signals is fired,
+    instead of polling every tick.
+    `func` should be a function or a lambda (a bound method can not have attributes).
+    """
+    def decorator(func: F) -> F:
+        if signals:
+            setattr(func, "_my_dependencies", tuple(signals))
+        return func
+    return decorator
+
+def _get_dependencies(func: Callable[..., Any]) -> tuple[MySignal, ...]:
+    return getattr(func, "_my_dependencies", ())
+
+def g_wait_for(request: MyWaitRequest) -> Generator[MyWaitRequest | None]:
+    """
+    Yield `request` until it is satisfied.
+    This works even if the driver of this generator ignores `MyWaitRequest` (such as a simple for-loop).
+    """
+    for signal in request.signals:
+        signal.num_of_waiters += 1
+    try:
+        yield request # use `yield` at least once to avoid long time blocking
+        if my_get_current_task() is not None:
+            return # resumed by `MyScheduler` (the request is already satisfied)
+        # The driver ignores `MyWaitRequest`. So wait here tick by tick.
+        while not _wait_a_tick(request):
+            yield request
+    finally:
+        for signal in request.signals:
+            signal.num_of_waiters -= 1
+
+def _wait_a_tick(request: MyWaitRequest) -> bool:
+    """
+    Wait for `request` in this thread at most one tick, and return whether it is satisfied.
+    """
+    _wait_while_paused()
+    if _abort_error is not None:
+        if my_get_current_task() is not None:
+            raise _new_abort_error() # the scheduler aborts all macros and takes the error (see `MyScheduler._abort_all()`)
+        raise _take_abort_error()
+    _wakeup_event.clear() # clear before checking signals not to lose a wakeup
+    if request.is_satisfied(now_ns := my_get_monotonic_ns()):
+        return True
+    limit_ns = now_ns + _DELAY_MS_FOR_A_TICK * _NS_PER_MS
+    if (deadline_ns := request.get_deadline_ns()) is not None:
+        limit_ns = min(limit_ns, deadline_ns)
+    _sleep_until_ns(limit_ns, wakeup_event=_wakeup_event)
+    return False
+
+def _run_blocking[T](generator: Generator[MyWaitRequest | None, Any, T]) -> T:
+    """
+    Run a macro generator to the end in this thread, and return its return value (for blocking APIs such as `key_press()`).
+    Each `MyWaitRequest` is waited here even if this is called in a macro run by `MyScheduler`.
+    Pause is deferred while an input sequence is in progress (see `_deferring_pause()`).
+    """
+    try:
+        request = next(generator)
+        while True:
+            if request is not None:
+                while not _wait_a_tick(request):
+                    pass
+            request = next(generator)
+    except StopIteration as ex:
+        return ex.value
+    finally:
+        generator.close()
+
+#=============================================================================
+# Abort
+
+_abort_error: MyAbortError | None = None
+
+# called after macros are aborted (such as releasing pressed keys)
+_handlers_for_abort: Final[list[Callable[[], Any]]] = []
+
+def my_request_abort(error: MyAbortError) -> None:
+    """
+    Request to abort running macros (can be called from any thread, such as a watchdog).
+    `error` is thrown into each macro generator when it is resumed next time.
+    """
+    global _abort_error
+    if _abort_error is None: # keep the first reason
+        _abort_error = error
+    _wakeup_event.set()
+
+def my_is_abort_requested() -> bool:
+    return _abort_error is not None
+
+def _new_abort_error() -> MyAbortError:
+    # a new instance for each generator (not to mix tracebacks)
+    assert _abort_error is not None
+    return type(_abort_error)(*_abort_error.args)
+
+def _take_abort_error() -> MyAbortError:
+    global _abort_error
+    error = _new_abort_error()
+    _abort_error = None
+    for handler in _handlers_for_abort:
+        handler()
+    return error
+
+#=============================================================================
+# Pause
+
+_is_pause_requested = False
+_num_of_input_sequences = 0 # in progress (see `_deferring_pause()`)
+_paused_ns = 0 # total duration of pauses
+
+def my_request_pause() -> None:
+    """
+    Request to pause running macros (can be called from any thread, such as a hotkey).
+    Macros stop at their next yield until `my_request_resume()` is called (abort is still accepted).
+    If an input sequence is in progress, macros stop after it is finished not to leave keys held while paused.
+    Deadlines of waits (and timeouts of `g_with_timeout()`) are shifted by the paused duration.
+    """
+    global _is_pause_requested
+    _is_pause_requested = True
+    _wakeup_event.set()
+
+def my_request_resume() -> None:
+    global _is_pause_requested
+    _is_pause_requested = False
+    _wakeup_event.set()
+
+def my_is_pause_requested() -> bool:
+    return _is_pause_requested
+
+def _is_paused() -> bool:
+    return _is_pause_requested and _num_of_input_sequences == 0 and _abort_error is None
+
+def _get_paused_ns() -> int:
+    return _paused_ns
+
+def _wait_while_paused() -> None:
+    global _paused_ns
+    if not _is_paused():
+        return
+    start_ns = my_get_monotonic_ns()
+    while _is_paused():
+        _wakeup_event.clear() # clear before checking again not to lose a wakeup
+        if _is_paused():
+            _clock.wait_event(_wakeup_event)
+    _paused_ns += my_get_monotonic_ns() - start_ns
+
+@contextlib.contextmanager
+def _deferring_pause() -> Iterator[None]:
+    """
+    Defer pause until the end of this context (used while an input sequence is in progress, because keys may be held).
+    This can be used across `yield` in a macro generator.
+    """
+    global _num_of_input_sequences
+    _num_of_input_sequences += 1
+    try:
+        yield
+    finally:
+        _num_of_input_sequences -= 1
+
+#=============================================================================
+# Scheduler
+
+@dataclass(frozen=True, slots=True)
+class MyWaitRequest:
+    """
+    Represent what a macro generator waits for.
+    A macro generator yields this object to the scheduler (see `MyScheduler`),
+    and it is resumed when at least one of specified conditions is satisfied.
+    `deadline_ns` is a value of monotonic clock (see `my_get_monotonic_ns()`),
+    and it is shifted by the duration of pauses after this request is created (see `get_deadline_ns()`).
+    `predicate` and `event` are checked every tick.
+    `signals` are checked whenever any signal is fired (see `MyWaitRequest.on_signals()`).
+    """
+
+    deadline_ns: int | None = None
+    predicate: Callable[[], Any] | None = None
+    event: threading.Event | None = None
+    signals: tuple[MySignal, ...] = ()
+    versions: tuple[int, ...] = () # versions of `signals` when this request is created
+    paused_ns: int = dataclasses.field(default_factory=_get_paused_ns) # total duration of pauses when this request is created
+
+    def __post_init__(self):
+        if self.deadline_ns is None and self.predicate is None and self.event is None and not self.signals:
+            raise ValueError("no condition to wait for (it would never be satisfied)")
+
+    @classmethod
+    def on_signals(cls, signals: Iterable[MySignal], /, *, deadline_ns: int | None = None) -> MyWaitRequest:
+        """Create a request which is satisfied when one of `signals` is fired after now (or at the deadline)."""
+        signals = tuple(signals)
+        return cls(deadline_ns=deadline_ns, signals=signals, versions=tuple(signal.version for signal in signals))
+
+    def get_deadline_ns(self) -> int | None:
+        if self.deadline_ns is None:
+            return None
+        return self.deadline_ns + (_paused_ns - self.paused_ns)
+
+    def is_polled(self) -> bool:
+        return self.predicate is not None or self.event is not None
+
+    def has_fired(self) -> bool:
+        return any(signal.version != version for signal, version in zip(self.signals, self.versions))
+
+    def is_satisfied(self, now_ns: int) -> bool:
+        if (deadline_ns := self.get_deadline_ns()) is not None and deadline_ns <= now_ns:
+            return True
+        if self.has_fired():
+            return True
+        if self.event is not None and self.event.is_set():
+            return True
+        if self.predicate is not None and self.predicate():
+            return True
+        return False
+
+class MySchedulingPolicy(enum.Enum):
+    """
+    Order to resume macro generators which are ready at the same time.
+    ROUND_ROBIN: higher priority first, then the least recently resumed first.
+    EARLIEST_DEADLINE: earlier deadline first, then higher priority first.
+    """
+
+    ROUND_ROBIN = enum.auto()
+    EARLIEST_DEADLINE = enum.auto()
+
+class MyMacroTask:
+    """
+    Represent a macro generator run by `MyScheduler`.
+    Accounting values are in nanoseconds:
+    - `cpu_ns`: CPU time (of this thread) consumed while the macro is resumed
+    - `run_ns`: elapsed time while the macro is resumed (includes blocking calls)
+    - `wait_ns`: elapsed time while the macro waits for `MyWaitRequest`
+    - `lateness_ns`: total delay from the deadline to the actual resume
+    """
+
+    def __init__(self, generator: Generator[MyWaitRequest | None, Any, Any], /, *, name: str, priority: int = 0, abort_condition: Callable[[], Any] | None = None):
+        self.generator: Final = generator
+        self.name: Final = name
+        self.priority: Final = priority
+        self.abort_condition: Final = abort_condition
+        self.request: MyWaitRequest | None = None
+        self.generation = 0 # to invalidate stale entries in the heap
+        self.is_finished = False
+        self.is_aborted = False
+        self.result: Any = None
+        self.num_of_resumes = 0
+        self.cpu_ns = 0
+        self.run_ns = 0
+        self.wait_ns = 0
+        self.lateness_ns = 0
+        self._due_ns = 0
+        self._yielded_ns = 0
+        self._resumed_sequence = 0
+
+    def __repr__(self):
+        state = "aborted" if self.is_aborted else "finished" if self.is_finished else "running"
+        return (f"{self.__class__.__name__}({self.name!r}, {state}, priority={self.priority}, resumes={self.num_of_resumes}, "
+                f"cpu={self.cpu_ns / _NS_PER_MS:.3f}ms, run={self.run_ns / _NS_PER_MS:.3f}ms, wait={self.wait_ns / _NS_PER_MS:.3f}ms, "
+                f"lateness={self.lateness_ns / _NS_PER_MS:.3f}ms)")
+
+_current_task: MyMacroTask | None = None
+
+def my_get_current_task() -> MyMacroTask | None:
+    """
+    Return the macro task which is resumed now (or `None` if no scheduler is running).
+    """
+    return _current_task
+
+class MyScheduler:
+    """
+    Drive macro generators cooperatively in one thread with a deadline heap on monotonic clock.
+    A macro generator yields `None` (to resume as soon as possible) or `MyWaitRequest`.
+    The scheduler sleeps exactly until the nearest deadline (with sub-millisecond precision),
+    and wakes up every tick to evaluate predicates, abort conditions and `callback_for_each_yield`.
+    """
+
+    def __init__(self, *, callback_for_each_yield: Callable[[], Any] | None = None, tick_ms: int = _DELAY_MS_FOR_A_TICK, policy: MySchedulingPolicy = MySchedulingPolicy.ROUND_ROBIN):
+        assert tick_ms > 0
+        self._callback_for_each_yield = callback_for_each_yield
+        self._tick_ns: Final = tick_ms * _NS_PER_MS
+        self._policy: Final = policy
+        self._heap: list[tuple[int, int, int, MyMacroTask]] = [] # (deadline_ns, sequence, generation, task)
+        self._polled_tasks: list[MyMacroTask] = [] # tasks waiting for predicate, event or signals
+        self._sequence = itertools.count()
+        self._tasks: list[MyMacroTask] = []
+        self._num_of_tasks = 0
+
+    @property
+    def tasks(self) -> list[MyMacroTask]:
+        return list(self._tasks)
+
+    def add(self, generator: Generator[MyWaitRequest | None, Any, Any], /, *, name: str | None = None, priority: int = 0, abort_condition: Callable[[], Any] | None = None) -> MyMacroTask:
+        """
+        Add a macro generator.
+        The macro is closed (aborted) when `abort_condition()` returns truthy value.
+        """
+        if name is None:
+            name = getattr(generator, "__name__", f"macro{len(self._tasks)}")
+        task = MyMacroTask(generator, name=name, priority=priority, abort_condition=abort_condition)
+        self._tasks.append(task)
+        self._num_of_tasks += 1
+        now_ns = my_get_monotonic_ns()
+        task._yielded_ns = now_ns
+        self._push(task, now_ns)
+        return task
+
+    def _push(self, task: MyMacroTask, deadline_ns: int | None):
+        task.generation += 1
+        if deadline_ns is not None:
+            heapq.heappush(self._heap, (deadline_ns, next(self._sequence), task.generation, task))
+        request = task.request
+        if request is not None and (request.is_polled() or request.signals):
+            self._polled_tasks.append(task)
+
+    def _finish(self, task: MyMacroTask):
+        if task in self._polled_tasks:
+            self._polled_tasks.remove(task)
+        task.is_finished = True
+        task.generation += 1
+        self._num_of_tasks -= 1
+
+    def _abort(self, task: MyMacroTask):
+        global _current_task
+        task.is_aborted = True
+        self._finish(task)
+        _current_task = task # for cleanup in the macro (such as `g_with_input_lock()`)
+        try:
+            task.generator.close() # `finally` clauses in the macro are executed
+        finally:
+            _current_task = None
+
+    def _abort_all(self) -> MyAbortError:
+        global _current_task
+        errors: list[BaseException] = [] # raised by cleanup of macros (all macros are aborted anyway)
+        try:
+            for task in self._tasks:
+                if task.is_finished:
+                    continue
+                task.is_aborted = True
+                self._finish(task)
+                _current_task = task # for cleanup in the macro (such as `g_with_input_lock()`)
+                try:
+                    task.generator.throw(_new_abort_error())
+                    task.generator.close() # the macro ignores the abort
+                except (MyAbortError, StopIteration):
+                    pass
+                except Exception as ex:
+                    errors.append(ex)
+                finally:
+                    _current_task = None
+        finally:
+            error = _take_abort_error() # also for handlers (such as releasing keys) even if interrupted
+        for ex in errors:
+            error.add_note(f"error in cleanup of an aborted macro: {ex!r}")
+        if errors:
+            error.__context__ = errors[0]
+        return error
+
+    def _resume(self, task: MyMacroTask):
+        global _current_task
+        if task in self._polled_tasks:
+            self._polled_tasks.remove(task)
+        if task.abort_condition is not None and task.abort_condition():
+            self._abort(task)
+            return
+        start_ns = my_get_monotonic_ns()
+        task.wait_ns += start_ns - task._yielded_ns
+        task.lateness_ns += max(0, start_ns - task._due_ns)
+        task.num_of_resumes += 1
+        task._resumed_sequence = next(self._sequence)
+        start_cpu_ns = time.thread_time_ns()
+        _current_task = task
+        try:
+            request = next(task.generator)
+        except StopIteration as ex:
+            task.result = ex.value
+            self._finish(task)
+            return
+        except MyAbortError:
+            self._finish(task)
+            if _abort_error is None:
+                raise # raised by the macro itself
+            task.is_aborted = True # by a blocking API in the macro (see `_wait_a_tick()`), and the others are aborted in `run()`
+            return
+        except BaseException:
+            self._finish(task)
+            raise
+        finally:
+            _current_task = None
+            task.cpu_ns += time.thread_time_ns() - start_cpu_ns
+            task._yielded_ns = my_get_monotonic_ns()
+            task.run_ns += task._yielded_ns - start_ns
+        task.request = request
+        if request is None:
+            self._push(task, task._yielded_ns)
+        else:
+            assert isinstance(request, MyWaitRequest), request
+            self._push(task, request.get_deadline_ns())
+        if self._callback_for_each_yield is not None:
+            self._callback_for_each_yield()
+
+    def _pop_due_tasks(self, now_ns: int) -> list[MyMacroTask]:
+        tasks: list[MyMacroTask] = []
+        heap = self._heap
+        while heap and heap[0][0] <= now_ns:
+            deadline_ns, _, generation, task = heapq.heappop(heap)
+            if generation == task.generation:
+                task._due_ns = deadline_ns
+                tasks.append(task)
+        return tasks
+
+    def _sort_ready_tasks(self, tasks: list[MyMacroTask]):
+        match self._policy:
+            case MySchedulingPolicy.ROUND_ROBIN:
+                tasks.sort(key=lambda task: (-task.priority, task._resumed_sequence))
+            case MySchedulingPolicy.EARLIEST_DEADLINE:
+                tasks.sort(key=lambda task: (task._due_ns, -task.priority))
+
+    def _sleep(self, now_ns: int, next_tick_ns: int | None):
+        while self._heap and self._heap[0][2] != self._heap[0][3].generation:
+            heapq.heappop(self._heap) # discard stale entry
+        deadline_ns = next_tick_ns
+        is_precise = False
+        if self._heap and (deadline_ns is None or self._heap[0][0] <= deadline_ns):
+            deadline_ns = self._heap[0][0]
+            is_precise = True
+        requests = [task.request for task in self._polled_tasks if task.request is not None]
+        if any(request.signals for request in requests) or deadline_ns is None:
+            # wake up immediately when a signal is fired
+            if deadline_ns is None:
+                _clock.wait_event(_wakeup_event)
+            else:
+                _sleep_until_ns(deadline_ns, is_precise=is_precise, wakeup_event=_wakeup_event)
+            return
+        events = [request.event for request in requests if request.event is not None]
+        if events and not is_precise:
+            # wake up immediately when the first event is set, and soon when another event is set or abort is requested
+            # (events can not be waited at once)
+            while not _clock.wait_event(events[0], min(deadline_ns - now_ns, _INTERVAL_NS_FOR_EVENTS)):
+                now_ns = my_get_monotonic_ns()
+                if now_ns >= deadline_ns or _wakeup_event.is_set() or any(event.is_set() for event in events):
+                    break
+            return
+        _sleep_until_ns(deadline_ns, is_precise=is_precise, wakeup_event=_wakeup_event) # wake up immediately when abort is requested
+
+    def _shift_deadlines(self, period_ns: int):
+        if period_ns > 0:
+            # the order is not changed (the heap is still valid)
+            self._heap = [(deadline_ns + period_ns, sequence, generation, task) for deadline_ns, sequence, generation, task in self._heap]
+
+    def _needs_tick(self) -> bool:
+        # no need to wake up every tick if nothing is polled (CPU usage is near zero while waiting)
+        if self._callback_for_each_yield is not None:
+            return True
+        if any(task.request is not None and task.request.is_polled() for task in self._polled_tasks):
+            return True
+        return any(not task.is_finished and task.abort_condition is not None for task in self._tasks)
+
+    def _check_abort_conditions(self):
+        for task in self._tasks:
+            if not task.is_finished and task.abort_condition is not None and task.abort_condition():
+                self._abort(task)
+
+    def run(self) -> None:
+        """
+        Run until all macro generators are finished (or aborted).
+        An exception raised in a macro generator is propagated to the caller
+        after the other macro generators are closed (aborted).
+        If abort is requested (see `my_request_abort()`), `MyAbortError` is thrown into all macro generators
+        and raised to the caller.
+        While paused (see `my_request_pause()`), no macro generator is resumed, and then deadlines are shifted by the paused duration.
+        """
+        try:
+            next_tick_ns = my_get_monotonic_ns() + self._tick_ns
+            while self._num_of_tasks > 0:
+                if _abort_error is not None:
+                    raise self._abort_all()
+                if _is_paused():
+                    paused_ns = _paused_ns
+                    _wait_while_paused()
+                    self._shift_deadlines(_paused_ns - paused_ns)
+                    continue
+                _wakeup_event.clear() # clear before checking signals not to lose a wakeup
+                now_ns = my_get_monotonic_ns()
+                is_tick = now_ns >= next_tick_ns
+                if is_tick:
+                    self._check_abort_conditions()
+                ready = self._pop_due_tasks(now_ns)
+                for task in self._polled_tasks:
+                    request = task.request
+                    assert request is not None
+                    if task in ready:
+                        continue
+                    if request.has_fired() or (request.event is not None and request.event.is_set()) or (is_tick and request.predicate is not None and request.predicate()):
+                        task._due_ns = now_ns
+                        ready.append(task)
+                self._sort_ready_tasks(ready)
+                for task in ready:
+                    if _abort_error is not None:
+                        break # throw at the next iteration
+                    if not task.is_finished:
+                        self._resume(task)
+                if is_tick:
+                    next_tick_ns = now_ns + self._tick_ns
+                    if not ready and self._callback_for_each_yield is not None:
+                        self._callback_for_each_yield() # keep calling while waiting (for abort check)
+                if self._num_of_tasks > 0 and not self._has_ready_task(my_get_monotonic_ns()):
+                    self._sleep(my_get_monotonic_ns(), next_tick_ns if self._needs_tick() else None)
+        except BaseException as ex:
+            for task in self._tasks:
+                if not task.is_finished:
+                    try:
+                        self._abort(task) # `finally` clauses in the macro are executed (such as releasing the input lock)
+                    except Exception as error:
+                        ex.add_note(f"error in cleanup of an aborted macro: {error!r}")
+            raise
+
+    def _has_ready_task(self, now_ns: int) -> bool:
+        return bool(self._heap) and self._heap[0][0] <= now_ns
+
+def run_macro(generator: Generator[MyWaitRequest | None, Any, Any], callback_for_each_yield: Callable[[], Any] | None = None) -> Any:
+    """
+    Run a macro generator until it is finished, and return its return value.
+    `callback_for_each_yield` is called after each `yield` and every tick while waiting.
+    """
+    scheduler = MyScheduler(callback_for_each_yield=callback_for_each_yield)
+    task = scheduler.add(generator)
+    scheduler.run()
+    assert task.is_finished
+    return task.result
+
+#=============================================================================
+# Input lock
+
+class MyInputLock:
+    """
+    Mutual exclusion of keyboard/mouse input between macros run by one scheduler.
+    A macro which sends input over several `yield` (such as a chord) should hold this lock
+    to avoid interleaving with input from other macros.
+    `sequence` is incremented for each input event (it can be used to invalidate captured screen).
+    """
+
+    def __init__(self):
+        self.owner: MyMacroTask | None = None
+        self.sequence = 0
+        self.released_signal: Final = MySignal("input lock released")
+
+    def is_available(self) -> bool:
+        return self.owner is None or self.owner is my_get_current_task()
+
+    def g_acquire(self) -> Generator[MyWaitRequest | None]:
+        owner = my_get_current_task()
+        while not self.is_available():
+            assert owner is not None # only a macro run by a scheduler can be blocked
+            yield from g_wait_for(MyWaitRequest.on_signals((self.released_signal,)))
+        self.owner = owner
+
+    def release(self):
+        assert self.is_available()
+        self.owner = None
+        self.released_signal.fire()
+
+    def notify_input(self, *, is_release: bool = False):
+        # releasing keys/buttons is always allowed (for cleanup)
+        assert is_release or self.is_available(), f"input from {my_get_current_task()!r} while {self.owner!r} holds the input lock"
+        self.sequence += 1
+
+_shared_input_lock: Final = MyInputLock()
+
+def get_input_lock() -> MyInputLock:
+    """
+    Return the input lock shared in this process.
+    """
+    return _shared_input_lock
+
+def g_with_input_lock[T](generator: Generator[MyWaitRequest | None, Any, T]) -> Generator[MyWaitRequest | None, Any, T]:
+    """
+    Run a macro generator with holding the shared input lock.
+    """
+    lock = get_input_lock()
+    if lock.owner is not None and lock.owner is my_get_current_task():
+        return (yield from generator) # already held (nested)
+    yield from lock.g_acquire()
+    try:
+        return (yield from generator)
+    finally:
+        lock.release()
 
 #=============================================================================
 # Geometry
@@ -211,3 +1018,210 @@ class MyRect:
         assert self.width > 0
         assert self.height > 0
         return all(self.includes(pos) for pos in other.corners)
+
+#=============================================================================
+# Test
+
+def _test_scheduler_with_many_macros():
+    num_of_macros = 500
+    num_of_steps = 10
+    order: list[tuple[str, int]] = []
+    lock = get_input_lock()
+
+    def g_macro(index: int) -> Generator[MyWaitRequest | None]:
+        rng = random.Random(index)
+        for step in range(num_of_steps):
+            yield from g_sleep(rng.randint(1, 20))
+            if index % 50 == 0:
+                def g_chord() -> Generator[MyWaitRequest | None]:
+                    order.append((f"down{index}", step))
+                    lock.notify_input()
+                    yield from g_sleep(2) # other macros should not send input here
+                    order.append((f"up{index}", step))
+                    lock.notify_input()
+                yield from g_with_input_lock(g_chord())
+        return index
+
+    scheduler = MyScheduler(policy=MySchedulingPolicy.EARLIEST_DEADLINE)
+    tasks = [scheduler.add(g_macro(i), name=f"macro{i}", priority=i % 3) for i in range(num_of_macros)]
+    is_aborted = False
+    aborted = scheduler.add(g_macro(-1), name="aborted", abort_condition=lambda: is_aborted)
+    is_aborted = True
+    def g_holding_lock() -> Generator[MyWaitRequest | None]:
+        yield from g_with_input_lock(g_sleep(100)) # aborted while holding the input lock
+    deadline_ns = my_get_monotonic_ns() + 30 * _NS_PER_MS
+    aborted_with_lock = scheduler.add(g_holding_lock(), name="aborted with lock", abort_condition=lambda: my_get_monotonic_ns() >= deadline_ns)
+    start_ns = my_get_monotonic_ns()
+    scheduler.run()
+    elapsed_ms = (my_get_monotonic_ns() - start_ns) / _NS_PER_MS
+    assert all(task.is_finished and not task.is_aborted for task in tasks)
+    my_assert_eq([task.result for task in tasks], list(range(num_of_macros)))
+    assert aborted.is_aborted
+    assert aborted_with_lock.is_aborted
+    assert lock.owner is None # released by the aborted macro
+    for i in range(0, len(order), 2):
+        my_assert_eq(order[i][0].replace("down", "up"), order[i + 1][0]) # no interleaving
+    # any of events wakes up the scheduler
+    try:
+        MyWaitRequest()
+        assert False
+    except ValueError:
+        pass
+    events = [threading.Event() for _ in range(2)]
+    def g_waiting(event: threading.Event) -> Generator[MyWaitRequest | None]:
+        yield from g_wait_for(MyWaitRequest(event=event))
+        return my_get_monotonic_ns()
+    scheduler = MyScheduler()
+    waiting = [scheduler.add(g_waiting(event)) for event in events]
+    set_ns: list[int] = []
+    def set_event(event: threading.Event):
+        set_ns.append(my_get_monotonic_ns())
+        event.set()
+    threading.Timer(0.010, set_event, (events[1],)).start()
+    threading.Timer(0.100, set_event, (events[0],)).start()
+    scheduler.run()
+    assert waiting[1].result - set_ns[0] < 5 * _NS_PER_MS, (waiting[1].result - set_ns[0]) / _NS_PER_MS
+    # an exception in a macro closes the others
+    def g_failing() -> Generator[MyWaitRequest | None]:
+        yield from g_sleep(10)
+        raise ValueError("failing")
+    scheduler = MyScheduler()
+    failing = scheduler.add(g_failing())
+    holding = scheduler.add(g_holding_lock())
+    try:
+        scheduler.run()
+        assert False
+    except ValueError:
+        pass
+    assert failing.is_finished and not failing.is_aborted
+    assert holding.is_aborted
+    assert lock.owner is None # released by the closed macro
+    lateness_ms = max(task.lateness_ns for task in tasks) / _NS_PER_MS / num_of_steps
+    cpu_ms = sum(task.cpu_ns for task in tasks) / _NS_PER_MS
+    print(f"{num_of_macros} macros: {elapsed_ms=:.1f} {cpu_ms=:.1f} max average lateness per step={lateness_ms:.3f}ms")
+    print(f"OK: {_test_scheduler_with_many_macros.__name__}()")
+    sys.exit(1)
+
+if False:
+    _test_scheduler_with_many_macros()
+
+def _test_virtual_clock():
+    num_of_loops = 100
+    previous = set_clock(MyVirtualClock())
+    try:
+        def g_macro() -> Generator[MyWaitRequest | None]:
+            for _ in range(num_of_loops):
+                yield from g_sleep_to_ensure()
+                limit = my_get_monotonic_ns() + 2000 * _NS_PER_MS
+                yield from g_with_timeout(5000, lambda: my_get_monotonic_ns() >= limit or None) # ready after 2 seconds
+                my_sleep_a_moment()
+            return my_get_str_timestamp()
+
+        start_real_ns = time.perf_counter_ns()
+        start_ns = my_get_monotonic_ns()
+        timestamp = run_macro(g_macro())
+        elapsed_ms = (my_get_monotonic_ns() - start_ns) / _NS_PER_MS
+        real_ms = (time.perf_counter_ns() - start_real_ns) / _NS_PER_MS
+        print(f"simulated {elapsed_ms:.0f}ms in {real_ms:.1f}ms (x{elapsed_ms / real_ms:.0f}) until {timestamp}")
+        assert elapsed_ms >= num_of_loops * (_DELAY_MS_FOR_ENSURE * 0.9 + 2000 + _DELAY_MS_FOR_A_MOMENT * 0.9)
+        assert real_ms < elapsed_ms / 100
+    finally:
+        set_clock(previous)
+    print(f"OK: {_test_virtual_clock.__name__}()")
+    sys.exit(1)
+
+if False:
+    _test_virtual_clock()
+
+def _test_pause():
+    paused_ms = 5000
+    clock = MyVirtualClock()
+    previous = set_clock(clock)
+    try:
+        timestamps: dict[str, int] = {}
+
+        def g_pauser() -> Generator[MyWaitRequest | None]:
+            yield from g_sleep(10)
+            my_request_pause()
+            def resume():
+                time.sleep(0.05) # until the scheduler waits
+                clock.advance_ns(paused_ms * _NS_PER_MS)
+                my_request_resume()
+            threading.Thread(target=resume).start()
+            yield from g_sleep(1)
+            timestamps["pauser"] = my_get_monotonic_ns()
+
+        def g_sequence() -> Generator[MyWaitRequest | None]:
+            with _deferring_pause(): # as an input sequence
+                yield from g_sleep(30)
+            timestamps["sequence"] = my_get_monotonic_ns()
+
+        def g_sleeper() -> Generator[MyWaitRequest | None]:
+            yield from g_sleep(50)
+            timestamps["sleeper"] = my_get_monotonic_ns()
+
+        def g_waiter() -> Generator[MyWaitRequest | None]:
+            limit = my_get_monotonic_ns() + (paused_ms + 60) * _NS_PER_MS
+            yield from g_with_timeout(100, lambda: my_get_monotonic_ns() >= limit or None) # timed out at 100ms without pause
+            timestamps["waiter"] = my_get_monotonic_ns()
+
+        scheduler = MyScheduler()
+        for g_macro in (g_pauser, g_sequence, g_sleeper, g_waiter):
+            scheduler.add(g_macro())
+        start_ns = my_get_monotonic_ns()
+        scheduler.run()
+        elapsed_ms = {name: (timestamp - start_ns) / _NS_PER_MS for name, timestamp in timestamps.items()}
+        print(elapsed_ms)
+        assert 30 <= elapsed_ms["sequence"] < paused_ms # pause is deferred until the input sequence is finished
+        assert elapsed_ms["pauser"] < paused_ms
+        assert paused_ms + 50 <= elapsed_ms["sleeper"] < paused_ms + 60 # the deadline is shifted
+        assert paused_ms + 60 <= elapsed_ms["waiter"] <= paused_ms + 100 # the timeout is extended
+    finally:
+        set_clock(previous)
+    print(f"OK: {_test_pause.__name__}()")
+    sys.exit(1)
+
+if False:
+    _test_pause()
+
+def _test_abort():
+    log: list[str] = []
+    _handlers_for_abort.append(lambda: log.append("handler"))
+    try:
+        def g_blocking() -> Generator[MyWaitRequest | None]:
+            try:
+                _run_blocking(g_sleep(10 * 1000)) # such as `key_press()` in a macro
+                yield
+            finally:
+                log.append("blocking")
+
+        def g_failing_cleanup() -> Generator[MyWaitRequest | None]:
+            try:
+                yield from g_sleep(10 * 1000)
+            finally:
+                raise ValueError("cleanup")
+
+        def g_waiting() -> Generator[MyWaitRequest | None]:
+            try:
+                yield from g_sleep(10 * 1000)
+            finally:
+                log.append("waiting")
+
+        scheduler = MyScheduler()
+        tasks = [scheduler.add(g_macro()) for g_macro in (g_failing_cleanup, g_waiting, g_blocking)]
+        threading.Timer(0.05, my_request_abort, (MyAbortError("test"),)).start()
+        try:
+            scheduler.run()
+            assert False
+        except MyAbortError as ex:
+            assert isinstance(ex.__context__, ValueError), ex.__context__
+        my_assert_eq(sorted(log), ["blocking", "handler", "waiting"]) # the handler is called once
+        assert all(task.is_aborted for task in tasks)
+        assert not my_is_abort_requested()
+    finally:
+        _handlers_for_abort.pop()
+    print(f"OK: {_test_abort.__name__}()")
+    sys.exit(1)
+
+if False:
+    _test_abort()
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import threading
+from typing import Final
+
+from .keyboardstat import get_keyboard_signal, setup_keyboard_listener
+from .modifier import MyModifier
+from .utils import *
+from .windowsapi import *
+
+#=============================================================================
+# Exception
+
+class MyAbortedByKeyError(MyAbortError):
+    pass
+
+class MyAbortedByWindowChangeError(MyAbortError):
+    pass
+
+#=============================================================================
+# Watchdog
+
+_INTERVAL_SEC_WHILE_PAUSED: Final = 0.1
+
+class MyWatchdog:
+    """
+    Watch abort conditions in its own thread, and request abort of running macros (see `my_request_abort()`).
+    - `abort_keys`: abort when one of the modifier keys is pressed
+    - `window_title`: abort when the active window is changed from the window with this title (not checked while paused)
+    The thread sleeps until a keyboard event or a change of the foreground window is notified,
+    so macros do not need to check them for each yield.
+    """
+
+    def __init__(self, *, abort_keys: MyModifier = MyModifier.LSHIFT, window_title: str | None = None):
+        assert abort_keys # at least one key should be specified
+        self.abort_keys: Final = abort_keys
+        self.window_title: Final = window_title
+        self.error: MyAbortError | None = None # requested error (if any)
+        self._event: Final = threading.Event()
+        self._is_stopped = False
+        self._thread: threading.Thread | None = None
+        self._hwnd = 0
+        self._version_of_foreground = -1
+
+    def start(self) -> None:
+        assert self._thread is None
+        self._is_key_pressed_since_previous_call = setup_keyboard_listener()
+        self._is_key_pressed_since_previous_call(self.abort_keys) # call once in advance to clear status
+        self._keyboard_signal = get_keyboard_signal()
+        self._keyboard_signal.subscribe(self._event.set)
+        if self.window_title is not None:
+            self._foreground_signal = get_foreground_window_signal()
+            self._foreground_signal.subscribe(self._event.set)
+        self._thread = threading.Thread(target=self._run, name="pykmmacro-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._is_stopped = True
+        self._event.set()
+        self._keyboard_signal.unsubscribe(self._event.set)
+        if self.window_title is not None:
+            self._foreground_signal.unsubscribe(self._event.set)
+
+    def _check(self) -> MyAbortError | None:
+        if self._is_key_pressed_since_previous_call(self.abort_keys):
+            keynames = "+".join(modifier.keyname for modifier in self.abort_keys)
+            return MyAbortedByKeyError(f"Aborted by {keynames} key")
+        if self.window_title is None:
+            return None
+        if my_is_pause_requested():
+            return None # the user may use other windows while paused (checked again after resume)
+        if self._foreground_signal.version == self._version_of_foreground:
+            return None # no need to call Win32 API
+        self._version_of_foreground = self._foreground_signal.version
+        try:
+            window_info = get_active_window_info()
+        except TimeoutForWindowSwitch:
+            return MyAbortedByWindowChangeError("Aborted because no window is active")
+        if self._hwnd == 0 and window_info.title == self.window_title:
+            self._hwnd = window_info.hwnd
+        elif self._hwnd != 0 and window_info.hwnd != self._hwnd:
+            return MyAbortedByWindowChangeError("Aborted because the active window was changed")
+        return None
+
+    def _run(self) -> None:
+        while not self._is_stopped:
+            self._event.clear() # clear before checking not to lose an event
+            if (error := self._check()) is not None:
+                print(error)
+                self.error = error
+                my_request_abort(error)
+                return
+            self._event.wait(_INTERVAL_SEC_WHILE_PAUSED if my_is_pause_requested() else None) # no event is notified on resume
@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+import re
+import sys
+from typing import Final, Iterable
+
+# pywin32 is imported in each function, so this module (and the package) can be imported also on other OS
+# (such as tests with fake input backends)
+
+from .utils import *
+
+#=============================================================================
+# Window entry
+
+@dataclass(frozen=True, kw_only=True)
+class MyWindowEntry:
+    """
+    Represent a top-level window found by enumeration.
+    """
+
+    hwnd: int
+    title: str
+    class_name: str
+    pid: int
+    rect: MyRect
+
+    def __post_init__(self):
+        assert self.hwnd != 0
+
+#=============================================================================
+# Window enumerator
+
+class WindowEnumerator:
+    """
+    Interface to enumerate top-level windows.
+    Override this class to use a fake window list (for test).
+    """
+
+    def enumerate_handles(self) -> list[int]:
+        """Return handles of all top-level windows (in Z-order)."""
+        raise NotImplementedError
+
+    def get_window_entry(self, hwnd: int) -> MyWindowEntry | None:
+        """Return information about the window, or `None` if the window does not exist anymore."""
+        raise NotImplementedError
+
+class Win32WindowEnumerator(WindowEnumerator):
+    def enumerate_handles(self) -> list[int]:
+        # https://mhammond.github.io/pywin32/win32gui__EnumWindows_meth.html
+        import win32gui
+        handles: list[int] = []
+        win32gui.EnumWindows(lambda hwnd, _data: handles.append(hwnd), None)
+        return handles
+
+    def get_window_entry(self, hwnd: int) -> MyWindowEntry | None:
+        import win32gui
+        import win32process
+        assert hwnd != 0
+        if not win32gui.IsWindow(hwnd):
+            return None
+        try:
+            title = win32gui.GetWindowText(hwnd)
+            class_name = win32gui.GetClassName(hwnd)
+            _tid, pid = win32process.GetWindowThreadProcessId(hwnd)
+            left, top, right, bottom = win32gui.GetWindowRect(hwnd)
+        except win32gui.error:
+            return None # the window is destroyed while querying
+        return MyWindowEntry(
+            hwnd = hwnd,
+            title = title,
+            class_name = class_name,
+            pid = pid,
+            rect = MyRect(top=top, right=max(left, right), bottom=max(top, bottom), left=left),
+        )
+
+#=============================================================================
+# Window index
+
+class MyWindowIndex:
+    """
+    Table of top-level windows with lookup by title, class name, PID and regular expression.
+    The table is built by one enumeration and updated incrementally by `refresh()`.
+    """
+
+    def __init__(self, enumerator: WindowEnumerator | None = None):
+        self._enumerator: Final = enumerator if enumerator is not None else Win32WindowEnumerator()
+        self._entries: dict[int, MyWindowEntry] = dict() # keep Z-order of enumeration
+        self._by_title: dict[str, list[int]] = dict()
+        self._by_class_name: dict[str, list[int]] = dict()
+        self._by_pid: dict[int, list[int]] = dict()
+        self._cache_for_regexp: dict[str, list[int]] = dict()
+        self._is_built = False
+
+    def __len__(self):
+        self._ensure_built()
+        return len(self._entries)
+
+    def __contains__(self, hwnd: int):
+        self._ensure_built()
+        return hwnd in self._entries
+
+    def _ensure_built(self):
+        if not self._is_built:
+            self.refresh(full=True)
+
+    def _add(self, entry: MyWindowEntry):
+        self._entries[entry.hwnd] = entry
+        self._by_title.setdefault(entry.title, []).append(entry.hwnd)
+        self._by_class_name.setdefault(entry.class_name, []).append(entry.hwnd)
+        self._by_pid.setdefault(entry.pid, []).append(entry.hwnd)
+
+    def _remove(self, hwnd: int):
+        entry = self._entries.pop(hwnd)
+        for table, key in ((self._by_title, entry.title), (self._by_class_name, entry.class_name), (self._by_pid, entry.pid)):
+            handles = table[key] # type: ignore
+            handles.remove(hwnd)
+            if not handles:
+                del table[key] # type: ignore
+
+    def refresh(self, *, full: bool = False) -> None:
+        """
+        Enumerate windows again.
+        Only appeared windows are queried in detail unless `full` is True.
+        """
+        handles = self._enumerator.enumerate_handles()
+        if full:
+            for hwnd in list(self._entries):
+                self._remove(hwnd)
+        current = set(handles)
+        for hwnd in [hwnd for hwnd in self._entries if hwnd not in current]:
+            self._remove(hwnd)
+        entries = self._entries
+        self._entries = dict()
+        for hwnd in handles:
+            entry = entries.get(hwnd)
+            if entry is None:
+                entry = self._enumerator.get_window_entry(hwnd)
+                if entry is None:
+                    continue # already destroyed
+                self._add(entry)
+            self._entries[hwnd] = entry # follow the latest Z-order
+        self._cache_for_regexp.clear()
+        self._is_built = True
+
+    def refresh_window(self, hwnd: int) -> MyWindowEntry | None:
+        """
+        Query the window again and update the table.
+        Return `None` if the window does not exist anymore.
+        """
+        self._ensure_built()
+        if hwnd in self._entries:
+            self._remove(hwnd)
+        entry = self._enumerator.get_window_entry(hwnd)
+        if entry is not None:
+            self._add(entry)
+        self._cache_for_regexp.clear()
+        return entry
+
+    def entries(self) -> Iterable[MyWindowEntry]:
+        self._ensure_built()
+        return list(self._entries.values())
+
+    def get(self, hwnd: int) -> MyWindowEntry | None:
+        self._ensure_built()
+        return self._entries.get(hwnd)
+
+    def find_by_title(self, title: str) -> list[MyWindowEntry]:
+        self._ensure_built()
+        return [self._entries[hwnd] for hwnd in self._by_title.get(title, ())]
+
+    def find_by_class_name(self, class_name: str) -> list[MyWindowEntry]:
+        self._ensure_built()
+        return [self._entries[hwnd] for hwnd in self._by_class_name.get(class_name, ())]
+
+    def find_by_pid(self, pid: int) -> list[MyWindowEntry]:
+        self._ensure_built()
+        return [self._entries[hwnd] for hwnd in self._by_pid.get(pid, ())]
+
+    def find_by_regexp(self, pattern: str | re.Pattern[str]) -> list[MyWindowEntry]:
+        """
+        Return windows whose title matches `pattern` (by `re.search()`).
+        The result is cached until the table is updated.
+        """
+        self._ensure_built()
+        regexp = re.compile(pattern)
+        key = regexp.pattern
+        if (handles := self._cache_for_regexp.get(key)) is None:
+            handles = [hwnd for hwnd, entry in self._entries.items() if regexp.search(entry.title)]
+            self._cache_for_regexp[key] = handles
+        return [self._entries[hwnd] for hwnd in handles]
+
+    def find(self, *, title: str | None = None, pattern: str | re.Pattern[str] | None = None, class_name: str | None = None, pid: int | None = None) -> list[MyWindowEntry]:
+        """
+        Return windows which satisfy all of specified conditions.
+        At least one condition should be specified.
+        """
+        candidates: list[list[MyWindowEntry]] = []
+        if title is not None:
+            candidates.append(self.find_by_title(title))
+        if class_name is not None:
+            candidates.append(self.find_by_class_name(class_name))
+        if pid is not None:
+            candidates.append(self.find_by_pid(pid))
+        if pattern is not None:
+            candidates.append(self.find_by_regexp(pattern))
+        assert candidates # at least one condition should be specified
+        candidates.sort(key=len)
+        first, *rest = candidates
+        others = [set(entry.hwnd for entry in entries) for entries in rest]
+        return [entry for entry in first if all(entry.hwnd in s for s in others)]
+
+#=============================================================================
+# Shared index
+
+_shared_window_index: MyWindowIndex | None = None
+
+def get_window_index() -> MyWindowIndex:
+    """
+    Return the window index shared in this process.
+    """
+    global _shared_window_index
+    if _shared_window_index is None:
+        _shared_window_index = MyWindowIndex()
+    return _shared_window_index
+
+def find_window(*, title: str | None = None, pattern: str | re.Pattern[str] | None = None, class_name: str | None = None, pid: int | None = None, index: MyWindowIndex | None = None) -> MyWindowEntry | None:
+    """
+    Search a top-level window which satisfies all of specified conditions.
+    The shared window index is refreshed only when no window is found or the found window is stale.
+    """
+    if index is None:
+        index = get_window_index()
+    regexp = re.compile(pattern) if pattern is not None else None
+    def is_matched(entry: MyWindowEntry) -> bool:
+        return ((title is None or entry.title == title) and
+                (class_name is None or entry.class_name == class_name) and
+                (pid is None or entry.pid == pid) and
+                (regexp is None or regexp.search(entry.title) is not None))
+    for full in (None, False, True): # None: no refresh
+        if full is not None:
+            index.refresh(full=full)
+        for entry in index.find(title=title, pattern=regexp, class_name=class_name, pid=pid):
+            latest = index.refresh_window(entry.hwnd) # validate the entry because the table may be stale
+            if latest is not None and is_matched(latest):
+                return latest
+    return None
+
+#=============================================================================
+# Test
+
+def _test_window_index():
+    class FakeWindowEnumerator(WindowEnumerator):
+        def __init__(self, entries: list[MyWindowEntry]):
+            self.entries = {entry.hwnd: entry for entry in entries}
+            self.num_of_queries = 0
+
+        def enumerate_handles(self) -> list[int]:
+            return list(self.entries)
+
+        def get_window_entry(self, hwnd: int) -> MyWindowEntry | None:
+            self.num_of_queries += 1
+            return self.entries.get(hwnd)
+
+    rect = MyRect(top=0, right=100, bottom=100, left=0)
+    def make_entry(hwnd: int, title: str, class_name: str = "FakeClass", pid: int = 1):
+        return MyWindowEntry(hwnd=hwnd, title=title, class_name=class_name, pid=pid, rect=rect)
+
+    enumerator = FakeWindowEnumerator([make_entry(1, "foo"), make_entry(2, "FINAL FANTASY XIV", "FFXIVGAME", 42), make_entry(3, "bar baz")])
+    index = MyWindowIndex(enumerator)
+    my_assert_eq([entry.hwnd for entry in index.find_by_title("FINAL FANTASY XIV")], [2])
+    my_assert_eq([entry.hwnd for entry in index.find_by_class_name("FFXIVGAME")], [2])
+    my_assert_eq([entry.hwnd for entry in index.find_by_pid(1)], [1, 3])
+    my_assert_eq([entry.hwnd for entry in index.find_by_regexp(r"^ba")], [3])
+    my_assert_eq([entry.hwnd for entry in index.find(title="foo", pid=42)], [])
+    my_assert_eq(enumerator.num_of_queries, 3)
+
+    del enumerator.entries[1]
+    enumerator.entries[4] = make_entry(4, "foo")
+    index.refresh()
+    my_assert_eq(enumerator.num_of_queries, 4) # only the new window is queried
+    my_assert_eq([entry.hwnd for entry in index.find_by_title("foo")], [4])
+
+    enumerator.entries[3] = make_entry(3, "renamed")
+    entry = find_window(title="renamed", index=index)
+    assert entry is not None and entry.hwnd == 3
+    print(f"OK: {_test_window_index.__name__}()")
+    sys.exit(1)
+
+if False:
+    _test_window_index()
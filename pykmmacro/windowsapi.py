@@ -1,12 +1,17 @@
 from __future__ import annotations
 
+import ctypes
+from ctypes import wintypes
 from dataclasses import dataclass
+import re
+import threading
 from typing import Final
 
-import win32api
-import win32gui
+# pywin32 is imported in each function, so this module (and the package) can be imported also on other OS
+# (such as tests with fake input backends)
 
 from .utils import *
+from .windowindex import *
 
 #=============================================================================
 # Definition
@@ -24,16 +29,19 @@ def _restore_window(hwnd: int):
     Restore a window from maxmized/minimized.
     """
     # https://github.com/asweigart/PyGetWindow/blob/master/src/pygetwindow/_pygetwindow_win.py#L230-L232
+    import win32gui
     assert hwnd != 0
     cmdShow = 0x9
     win32gui.ShowWindow(hwnd, cmdShow)
 
 def _get_hwnd_of_active_window() -> int:
+    import win32gui
     return win32gui.GetForegroundWindow() # may be zero
 
 def _get_client_rect(hwnd: int) -> MyRect:
     """get client area of active window"""
     # https://mhammond.github.io/pywin32/win32gui__GetClientRect_meth.html
+    import win32gui
     assert hwnd != 0
     t = win32gui.GetClientRect(hwnd)
     rect = dict(zip(("left", "top", "right", "bottom"), t))
@@ -42,6 +50,7 @@ def _get_client_rect(hwnd: int) -> MyRect:
 def _get_window_rect(hwnd: int) -> MyRect:
     """get the whole area of active window (include MENU and BORDER)"""
     # https://mhammond.github.io/pywin32/win32gui__GetWindowRect_meth.html
+    import win32gui
     assert hwnd != 0
     t = win32gui.GetWindowRect(hwnd)
     rect = dict(zip(("left", "top", "right", "bottom"), t))
@@ -50,6 +59,7 @@ def _get_window_rect(hwnd: int) -> MyRect:
 def _get_window_title(hwnd: int) -> str:
     """get the title of active window"""
     # https://mhammond.github.io/pywin32/win32gui__GetWindowText_meth.html
+    import win32gui
     assert hwnd != 0
     title = win32gui.GetWindowText(hwnd)
     return title
@@ -57,6 +67,7 @@ def _get_window_title(hwnd: int) -> str:
 def _get_all_monitor_info() -> list[MyMonitorInfo]:
     # https://qiita.com/kznSk2/items/1c756eb4bee80c66233d
     # https://mhammond.github.io/pywin32/win32api.html
+    import win32api
     monitors = win32api.EnumDisplayMonitors()
     #print(f"{monitors=!r}")
     infos: list[MyMonitorInfo] = []
@@ -223,6 +234,46 @@ class OffsetInWindow(MyOffsetInRect):
     def to_position_in_screen(self, /, *, window_info: MyWindowInfo | None = None, screen_info: MyScreenInfo | None = None) -> PositionInScreen:
         return _convert_offset_in_client_region_of_active_window_to_position_in_screen(self, window_info=window_info, screen_info=screen_info)
 
+#=============================================================================
+# Window event
+
+# https://learn.microsoft.com/en-us/windows/win32/winauto/event-constants
+_EVENT_SYSTEM_FOREGROUND: Final[int] = 0x0003
+_WINEVENT_OUTOFCONTEXT: Final[int] = 0x0000
+
+_foreground_window_signal: Final = MySignal("foreground window")
+
+_thread_for_window_event: threading.Thread | None = None
+
+def _run_window_event_loop():
+    # https://learn.microsoft.com/en-us/windows/win32/api/winuser/nf-winuser-setwineventhook
+    user32 = ctypes.windll.user32 # type: ignore
+    WINEVENTPROC = ctypes.WINFUNCTYPE(None, wintypes.HANDLE, wintypes.DWORD, wintypes.HWND, wintypes.LONG, wintypes.LONG, wintypes.DWORD, wintypes.DWORD)
+    def callback(_hook, _event, _hwnd, _id_object, _id_child, _thread_id, _timestamp_ms):
+        _foreground_window_signal.fire()
+    proc = WINEVENTPROC(callback) # keep reference while the hook is alive
+    hook = user32.SetWinEventHook(_EVENT_SYSTEM_FOREGROUND, _EVENT_SYSTEM_FOREGROUND, 0, proc, 0, 0, _WINEVENT_OUTOFCONTEXT)
+    assert hook
+    try:
+        # the callback is called in this thread while the message loop runs
+        msg = wintypes.MSG()
+        while user32.GetMessageW(ctypes.byref(msg), 0, 0, 0) > 0:
+            user32.TranslateMessage(ctypes.byref(msg))
+            user32.DispatchMessageW(ctypes.byref(msg))
+    finally:
+        user32.UnhookWinEvent(hook)
+
+def get_foreground_window_signal() -> MySignal:
+    """
+    Return a signal which is fired when the active (foreground) window is changed.
+    A thread to receive window events is started at the first call.
+    """
+    global _thread_for_window_event
+    if _thread_for_window_event is None:
+        _thread_for_window_event = threading.Thread(target=_run_window_event_loop, name="pykmmacro-window-event", daemon=True)
+        _thread_for_window_event.start()
+    return _foreground_window_signal
+
 #=============================================================================
 # Public function
 
@@ -297,29 +348,25 @@ def get_screen_info():
 def show_dialog(text: str) -> None:
     # https://mhammond.github.io/pywin32/win32gui__MessageBox_meth.html
     # https://github.com/asweigart/PyMsgBox/blob/master/src/pymsgbox/_native_win.py#L69
+    import win32gui
     flags = 0
     flags |= 0x0     # MB_OK
     flags |= 0x10000 # MB_SETFOREGROUND
     flags |= 0x40000 # MB_TOPMOST
     win32gui.MessageBox(None, text, "PyKMmacro Dialog", flags) # type: ignore
 
-def activate_window(title: str) -> bool:
+def activate_window(title: str | None = None, /, *, pattern: str | re.Pattern[str] | None = None, class_name: str | None = None, pid: int | None = None) -> bool:
     """
-    Search the window whose title matches specified text, and make the window active (foreground).
+    Search the window which matches specified conditions, and make the window active (foreground).
+    The window is looked up in the shared window index (see `get_window_index()`).
     This function is synchronous (blocking) API.
     """
-    assert title
-    hwnd = 0
-    def callback(hwnd2: int, _data: Any):
-        nonlocal hwnd
-        assert hwnd2 != 0
-        title2 = _get_window_title(hwnd2)
-        if title2 and title2 == title:
-            hwnd = hwnd2
-            return False # stop enumeration
-    win32gui.EnumWindows(callback, None)
-    if hwnd == 0:
+    import win32gui
+    assert title or pattern or class_name or pid
+    entry = find_window(title=title, pattern=pattern, class_name=class_name, pid=pid)
+    if entry is None:
         return False
+    hwnd = entry.hwnd
     _restore_window(hwnd)
     win32gui.SetForegroundWindow(hwnd)
     timestamp_at_start = my_get_timestamp_ms()